@@ -0,0 +1,171 @@
+#!/usr/bin/python
+"""Static asset serving for IPMPV."""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from flask import request, make_response
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Content types worth compressing; images are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/manifest+json',
+					  'application/javascript', 'image/svg+xml', 'image/vnd.microsoft.icon')
+
+# Explicit types for files mimetypes doesn't know or gets wrong
+CONTENT_TYPES = {
+	'manifest.json': 'application/manifest+json',
+	'.ico': 'image/vnd.microsoft.icon',
+	'.js': 'application/javascript',
+}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+class StaticAssets:
+	"""
+	In-memory static asset layer.
+
+	Every file in the static folder is read once, hashed and precompressed
+	with gzip (and brotli, when the module is installed). Assets are served
+	under fingerprinted URLs with strong ETags and immutable cache headers,
+	so browsers and the service worker never have to revalidate them.
+	"""
+
+	def __init__(self, static_dir, url_prefix='/assets'):
+		"""
+		Initialize the asset layer.
+
+		Args:
+			static_dir (str): Folder containing the static files.
+			url_prefix (str): URL path fingerprinted assets are served under.
+		"""
+		self.static_dir = static_dir
+		self.url_prefix = url_prefix
+		self.assets = {}
+		self.fingerprinted = {}
+		self._load()
+
+	def _load(self):
+		"""Read, hash and compress every static file."""
+		names = sorted(os.listdir(self.static_dir))
+		# The manifest refers to other assets, so it is loaded last
+		if 'manifest.json' in names:
+			names.remove('manifest.json')
+			names.append('manifest.json')
+
+		for name in names:
+			path = os.path.join(self.static_dir, name)
+			if not os.path.isfile(path):
+				continue
+			with open(path, 'rb') as f:
+				data = f.read()
+			if name == 'manifest.json':
+				data = self._rewrite_manifest(data)
+			self.add(name, data)
+
+	def _rewrite_manifest(self, data):
+		"""Point the manifest at the fingerprinted icon and screenshot URLs."""
+		manifest = json.loads(data.decode('utf-8'))
+		for key in ('icons', 'screenshots'):
+			for entry in manifest.get(key, []):
+				if entry.get('src') in self.assets:
+					entry['src'] = self.url_for(entry['src'])
+		return json.dumps(manifest, indent=4).encode('utf-8')
+
+	def add(self, name, data, content_type=None):
+		"""
+		Add an asset from memory.
+
+		Args:
+			name (str): Asset name, e.g. "favicon.ico".
+			data (bytes): Asset contents.
+			content_type (str, optional): MIME type. Guessed from the name if not given.
+		"""
+		digest = hashlib.sha256(data).hexdigest()[:16]
+		if content_type is None:
+			content_type = (CONTENT_TYPES.get(name) or CONTENT_TYPES.get(os.path.splitext(name)[1])
+							or mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+		encodings = {}
+		if content_type.startswith(COMPRESSIBLE_TYPES):
+			compressed = gzip.compress(data, compresslevel=9, mtime=0)
+			if len(compressed) < len(data):
+				encodings['gzip'] = compressed
+			if brotli is not None:
+				compressed = brotli.compress(data, quality=11)
+				if len(compressed) < len(data):
+					encodings['br'] = compressed
+
+		stem, ext = os.path.splitext(name)
+		fingerprinted_name = f"{stem}.{digest}{ext}"
+		self.assets[name] = {
+			'data': data,
+			'digest': digest,
+			'content_type': content_type,
+			'encodings': encodings,
+			'fingerprinted_name': fingerprinted_name
+		}
+		self.fingerprinted[fingerprinted_name] = name
+
+	def url_for(self, name):
+		"""
+		Get the fingerprinted URL of an asset.
+
+		Args:
+			name (str): Asset name, e.g. "favicon.ico".
+
+		Returns:
+			str: URL that changes whenever the asset contents change.
+		"""
+		return f"{self.url_prefix}/{self.assets[name]['fingerprinted_name']}"
+
+	def urls(self):
+		"""Get the fingerprinted URLs of every asset."""
+		return [self.url_for(name) for name in self.assets]
+
+	def serve_fingerprinted(self, fingerprinted_name):
+		"""Serve an asset requested through its fingerprinted URL."""
+		name = self.fingerprinted.get(fingerprinted_name)
+		if name is None:
+			return "", 404
+		return self.serve(name, immutable=True)
+
+	def serve(self, name, immutable=False):
+		"""
+		Serve an asset, honouring If-None-Match and Accept-Encoding.
+
+		Args:
+			name (str): Asset name, e.g. "favicon.ico".
+			immutable (bool): Whether the URL is fingerprinted and can be cached forever.
+		"""
+		asset = self.assets.get(name)
+		if asset is None:
+			return "", 404
+
+		encoding = None
+		accepted = request.headers.get('Accept-Encoding', '')
+		for candidate in ('br', 'gzip'):
+			if candidate in asset['encodings'] and candidate in accepted:
+				encoding = candidate
+				break
+
+		# Strong ETags identify the exact bytes, so each encoding gets its own
+		etag = f'"{asset["digest"]}-{encoding}"' if encoding else f'"{asset["digest"]}"'
+		if etag in request.headers.get('If-None-Match', ''):
+			response = make_response("", 304)
+		else:
+			response = make_response(asset['encodings'][encoding] if encoding else asset['data'])
+			response.headers['Content-Type'] = asset['content_type']
+			if encoding:
+				response.headers['Content-Encoding'] = encoding
+
+		response.headers['ETag'] = etag
+		if asset['encodings']:
+			response.headers['Vary'] = 'Accept-Encoding'
+		response.headers['Cache-Control'] = IMMUTABLE if immutable else 'no-cache'
+		return response
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""Control socket benchmark for IPMPV.
+
+Compares the same volume steps sent through the control socket and through
+the HTTP API of a running IPMPV. Steps alternate up and down, so the
+volume ends where it started:
+
+	python bench_control.py [socket path] [HTTP URL] [count]
+"""
+
+import socket
+import sys
+import time
+import requests
+
+def _benchmark(path, http_url, count=2000):
+	"""Compare volume step round trips through the control socket and the HTTP API."""
+	commands = [b"vol+ 1\n", b"vol- 1\n"]
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(path)
+		reader = sock.makefile('rb')
+		start = time.perf_counter()
+		for i in range(count):
+			sock.sendall(commands[i % 2])
+			reply = reader.readline()
+			if not reply.startswith(b"OK"):
+				raise RuntimeError(f"control socket: {reply.decode().strip()}")
+		unix_secs = time.perf_counter() - start
+
+		# Pipelined: everything is sent before the first reply is read
+		start = time.perf_counter()
+		sock.sendall(b"".join(commands) * (count // 2))
+		for _ in range(count // 2 * 2):
+			reader.readline()
+		pipelined_secs = time.perf_counter() - start
+
+	session = requests.Session()
+	routes = ["volume_up", "volume_down"]
+	http_count = max(2, count // 10)
+	start = time.perf_counter()
+	for i in range(http_count):
+		response = session.get(f"{http_url}/{routes[i % 2]}", params={"step": 1}, timeout=5)
+		response.raise_for_status()
+	http_secs = time.perf_counter() - start
+
+	print(f"unix socket: {unix_secs / count * 1e6:8.1f} us/round trip, {count / unix_secs:8.0f} steps/s")
+	print(f"pipelined:   {pipelined_secs / count * 1e6:8.1f} us/step,       {count / pipelined_secs:8.0f} steps/s")
+	print(f"http:        {http_secs / http_count * 1e6:8.1f} us/round trip, {http_count / http_secs:8.0f} steps/s")
+
+if __name__ == "__main__":
+	_benchmark(sys.argv[1] if len(sys.argv) > 1 else "/tmp/ipmpv.sock",
+			   sys.argv[2] if len(sys.argv) > 2 else "http://127.0.0.1:5000",
+			   int(sys.argv[3]) if len(sys.argv) > 3 else 2000)
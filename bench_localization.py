@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""Index render benchmark for IPMPV with many languages installed.
+
+Renders the index page through the Flask test client with only the
+shipped languages installed, then with many more, to check that the render
+cost doesn't grow with the number of locale files, and that the page only
+links its strings:
+
+	python bench_localization.py [language count]
+"""
+
+import json
+import os
+import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import localization
+import server
+from localization import Localization
+from server import IPMPVServer
+
+def _benchmark(count=200, rounds=200, channel_count=500):
+	"""Time index renders with the shipped and with many languages installed."""
+	# The index template is read relative to the working directory
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	shipped_dir = 'locales'
+	channels = [{"name": f"Channel {n}", "url": f"http://streams.example/{n}.ts",
+				 "logo": f"http://logos.example/{n}.png", "group": f"Group {n % 20}"} for n in range(channel_count)]
+	ipmpv = IPMPVServer(channels, None, queue.Queue(), queue.Queue(), None, None)
+	client = ipmpv.app.test_client()
+	headers = {'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8'}
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		with open(os.path.join(shipped_dir, 'en.json'), encoding='utf-8') as f:
+			english = json.load(f)
+		for n in range(count):
+			code = f"x{n:03d}"
+			with open(os.path.join(tmp_dir, f"{code}.json"), 'w', encoding='utf-8') as f:
+				json.dump({key: f"{value} ({code})" for key, value in english.items()}, f)
+		for name in os.listdir(shipped_dir):
+			shutil.copy(os.path.join(shipped_dir, name), tmp_dir)
+
+		for label, locales_dir in (("shipped", shipped_dir), (f"{count} more", tmp_dir)):
+			# Both the server and _() use the module-level instance
+			instance = Localization(locales_dir=locales_dir)
+			localization.localization = server.localization = instance
+			times = []
+			renders = []
+			for _ in range(rounds):
+				start = time.perf_counter()
+				response = client.get('/', headers=headers)
+				times.append(time.perf_counter() - start)
+				renders.append(float(response.headers['Server-Timing'].split('dur=')[1].split(',')[0]))
+			page = response.get_data()
+			bundle_url = page.split(b'rel="preload" href="')[1].split(b'"')[0].decode()
+			bundle = client.get(bundle_url)
+			cached = client.get(bundle_url, headers={'If-None-Match': bundle.headers['ETag']})
+			print(f"{label} ({len(instance.available_languages)} languages): "
+				  f"request {statistics.median(times) * 1000:.2f} ms, render {statistics.median(renders):.2f} ms, "
+				  f"page {len(page)} bytes; bundle {len(bundle.get_data())} bytes, "
+				  f"{bundle.headers['Cache-Control']!r}, revalidated: {cached.status_code}")
+
+if __name__ == "__main__":
+	_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
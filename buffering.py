@@ -0,0 +1,246 @@
+#!/usr/bin/python
+"""Adaptive buffering controller for IPMPV."""
+
+import collections
+import json
+import os
+import threading
+import time
+
+class AdaptiveBuffer:
+	"""
+	Tune buffering from live cache statistics.
+
+	The controller keeps a target buffer length per stream. It backs off
+	multiplicatively on every underrun (and on bursts of dropped frames) and
+	creeps back down after a stretch of stall-free playback, converging on
+	the lowest latency the source can sustain. The level each channel
+	backed off to on its last underrun is kept as a floor the target
+	doesn't creep below; the floor decays slowly, so a channel that got
+	better is probed again, but not every few minutes. The target learned for each
+	channel is remembered and used as the starting point on the next tune;
+	it is written to disk when the channel changes and at most every
+	`save_interval` seconds.
+	"""
+
+	def __init__(self, player, min_secs=0.2, max_secs=8.0, initial_secs=1.0,
+				 stable_secs=30, interval=1.0, state_file=None, floor_half_life=1800, save_interval=300):
+		"""
+		Initialize the controller.
+
+		Args:
+			player (Player): Player whose mpv instance is tuned.
+			min_secs (float): Lowest buffer target.
+			max_secs (float): Highest buffer target.
+			initial_secs (float): Target for channels without a learned value.
+			stable_secs (float): Seconds without stalls before the target is lowered.
+			interval (float): Seconds between evaluations.
+			state_file (str, optional): JSON file to keep learned targets across restarts.
+			floor_half_life (float): Seconds of stable playback for the underrun floor of a channel to halve.
+			save_interval (float): Minimum seconds between two writes of the state file while playing.
+		"""
+		self.player = player
+		self.min_secs = min_secs
+		self.max_secs = max_secs
+		self.initial_secs = initial_secs
+		self.stable_secs = stable_secs
+		self.interval = interval
+		self.state_file = state_file
+		self.floor_half_life = floor_half_life
+		self.save_interval = save_interval
+
+		self.lock = threading.Lock()
+		self.learned = {}
+		self.floors = {}
+		self.dirty = False
+		self.last_save = time.monotonic()
+		self.decisions = collections.deque(maxlen=50)
+		self.channel = None
+		self.target = initial_secs
+		self.underruns = 0
+		self.drops = 0
+		self.last_drop_count = None
+		self.last_change = time.monotonic()
+		self.tuned_at = time.monotonic()
+		self.cache_duration = None
+		self.paused_for_cache = False
+		self.running = False
+		self._load()
+
+		mpv_player = self.player.player
+		mpv_player.observe_property('paused-for-cache', self._paused_for_cache_observer)
+		mpv_player.observe_property('demuxer-cache-duration', self._cache_duration_observer)
+
+	def _load(self):
+		"""Load learned targets from disk."""
+		if not self.state_file or not os.path.exists(self.state_file):
+			return
+		try:
+			with open(self.state_file, 'r', encoding='utf-8') as f:
+				self.learned = {name: float(value) for name, value in json.load(f).items()}
+		except (OSError, ValueError) as e:
+			print(f"Error loading learned buffer settings: {e}")
+
+	def _save(self):
+		"""Write learned targets to disk, if they changed. Must be called without the lock held."""
+		with self.lock:
+			if not self.dirty:
+				return
+			learned = dict(self.learned)
+			self.dirty = False
+			self.last_save = time.monotonic()
+		if not self.state_file:
+			return
+		try:
+			tmp_file = self.state_file + ".tmp"
+			with open(tmp_file, 'w', encoding='utf-8') as f:
+				json.dump(learned, f)
+			os.replace(tmp_file, self.state_file)
+		except OSError as e:
+			print(f"Error saving learned buffer settings: {e}")
+
+	def start(self):
+		"""Start the evaluation loop."""
+		if self.running:
+			return
+		self.running = True
+		threading.Thread(target=self._loop, name="adaptive-buffer", daemon=True).start()
+
+	def stop(self):
+		"""Stop the evaluation loop."""
+		self.running = False
+		self._save()
+
+	def start_channel(self, channel_name):
+		"""
+		Prepare for a new stream, starting from the target learned for it.
+
+		Args:
+			channel_name (str): Name of the channel being tuned, or None for custom URLs.
+		"""
+		with self.lock:
+			self._remember()
+			self.channel = channel_name
+			self.target = self.learned.get(channel_name, self.initial_secs)
+			self.underruns = 0
+			self.drops = 0
+			self.last_drop_count = None
+			self.last_change = time.monotonic()
+			self.tuned_at = self.last_change
+		self._save()
+		self._apply(f"tuned {channel_name}")
+
+	def reapply(self):
+		"""Push the current target again, e.g. after a profile switch overwrote it."""
+		self._apply("profile changed")
+
+	def _remember(self):
+		"""Store the target of the current channel. Must be called with the lock held."""
+		if self.channel is not None and self.learned.get(self.channel) != self.target:
+			self.learned[self.channel] = self.target
+			self.dirty = True
+
+	def _paused_for_cache_observer(self, name, value):
+		"""Count underruns: playback paused because the cache ran dry."""
+		# Filling the cache right after a tune is not an underrun
+		if value and not self.paused_for_cache and time.monotonic() - self.tuned_at > 3:
+			with self.lock:
+				self.underruns += 1
+				self._adjust(self.target * 1.5, "underrun")
+				if self.channel is not None:
+					self.floors[self.channel] = self.target
+		self.paused_for_cache = bool(value)
+
+	def _cache_duration_observer(self, name, value):
+		"""Track how many seconds of media are buffered."""
+		self.cache_duration = value
+
+	def _loop(self):
+		"""Periodically look at dropped frames and stable stretches."""
+		while self.running:
+			time.sleep(self.interval)
+			if self.channel is None and self.player.current_index is None:
+				continue
+			try:
+				drop_count = self.player.player.frame_drop_count
+			except Exception:
+				drop_count = None
+
+			with self.lock:
+				if drop_count is not None:
+					if self.last_drop_count is not None and drop_count - self.last_drop_count > 5:
+						self.drops += drop_count - self.last_drop_count
+						self._adjust(self.target * 1.2, f"{drop_count - self.last_drop_count} dropped frames")
+					self.last_drop_count = drop_count
+				if not self.paused_for_cache and time.monotonic() - self.last_change >= self.stable_secs:
+					self._step_down()
+				save = self.dirty and time.monotonic() - self.last_save >= self.save_interval
+			if save:
+				self._save()
+
+	def _step_down(self):
+		"""Lower the target after a stable stretch, staying above the last underrun. Must be called with the lock held."""
+		floor = self.floors.get(self.channel)
+		if floor is not None:
+			floor *= 0.5 ** (self.stable_secs / self.floor_half_life)
+			if floor <= self.min_secs:
+				del self.floors[self.channel]
+			else:
+				self.floors[self.channel] = floor
+		target = max(self.target * 0.9, floor or 0)
+		if target >= self.target:
+			# Hold while the floor of the last underrun decays
+			self.last_change = time.monotonic()
+			return
+		self._adjust(target, f"stable for {self.stable_secs} s")
+
+	def _adjust(self, target, reason):
+		"""Clamp and apply a new target. Must be called with the lock held."""
+		target = round(min(self.max_secs, max(self.min_secs, target)), 2)
+		self.last_change = time.monotonic()
+		if target == self.target:
+			return
+		self.target = target
+		self._remember()
+		threading.Thread(target=self._apply, args=(reason,), daemon=True).start()
+
+	def _apply(self, reason):
+		"""Push the target to mpv."""
+		target = self.target
+		with self.player.config_lock:
+			mpv_player = self.player.player
+			mpv_player['demuxer-readahead-secs'] = str(target)
+			# The low-latency profile owns the audio buffer and cache pausing
+			if not self.player.low_latency:
+				mpv_player['cache-pause-wait'] = str(target)
+				mpv_player['audio-buffer'] = str(min(0.5, target / 4))
+		decision = {
+			"time": time.time(),
+			"channel": self.channel,
+			"target_secs": target,
+			"reason": reason,
+			"cache_duration": self.cache_duration
+		}
+		self.decisions.append(decision)
+		print(f"Adaptive buffer: {self.channel} -> {target} s ({reason})")
+
+	def metrics(self):
+		"""
+		Get the controller state.
+
+		Returns:
+			dict: Current target, counters, learned values and recent decisions.
+		"""
+		with self.lock:
+			return {
+				"channel": self.channel,
+				"target_secs": self.target,
+				"bounds_secs": [self.min_secs, self.max_secs],
+				"cache_duration": self.cache_duration,
+				"paused_for_cache": self.paused_for_cache,
+				"underruns": self.underruns,
+				"dropped_frames": self.drops,
+				"learned": dict(self.learned),
+				"floors": {name: round(floor, 2) for name, floor in self.floors.items()},
+				"decisions": list(self.decisions)
+			}
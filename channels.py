@@ -1,63 +1,340 @@
 #!/usr/bin/python
 """Channel management for IPMPV."""
 
+import contextlib
+import gzip
+import io
+import lzma
+import mmap
+import os
 import re
 import requests
 import sys
-from utils import m3u_url
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from utils import m3u_sources, m3u_timeout, m3u_deadline
 
-def get_channels():
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# Errors a corrupt or truncated compressed playlist can raise while it is read
+DECOMPRESSION_ERRORS = (EOFError, lzma.LZMAError, zlib.error)
+if zstandard is not None:
+	DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+COMPRESSION_MAGIC = {
+	b'\x1f\x8b': 'gzip',
+	b'\xfd7zXZ\x00': 'xz',
+	b'\x28\xb5\x2f\xfd': 'zstd',
+}
+
+COMPRESSION_SUFFIXES = {
+	'.gz': 'gzip',
+	'.xz': 'xz',
+	'.zst': 'zstd',
+	'.zstd': 'zstd',
+}
+
+# #EXTVLCOPT options that have an mpv equivalent, applied per channel when it is loaded
+VLC_TO_MPV_OPTIONS = {
+	"http-user-agent": "user-agent",
+	"http-referrer": "referrer",
+	"http-referer": "referrer",
+}
+
+CATCHUP_ATTRIBUTES = ("catchup", "catchup-type", "catchup-days", "catchup-source", "catchup-correction")
+
+# Tokens of an #EXTINF line: key="value", key=value, or the comma that starts the title
+EXTINF_TOKEN_RE = re.compile(r'([^\s=,"]+)=(?:"([^"]*)"|([^\s,"]*))|,(.*)')
+
+# Text around the quoted values of an #EXTINF line that can take the fast path,
+# with the values taken out: the duration, then key=" key=" ... key=
+SIMPLE_KEYS_RE = re.compile(r'(?:[^\s=,"]* )?([a-z0-9_-]+(?:=" [a-z0-9_-]+)*)=')
+
+def parse_extinf(line):
 	"""
-	Get a list of channels from the M3U playlist.
-	
+	Split an #EXTINF line into its attributes and title.
+
+	Attributes may come in any order, quoted or not. The line is tokenized
+	in a single left-to-right scan; quoted values are consumed whole, so
+	the first comma outside them starts the title. Lines made only of
+	lowercase key="value" pairs separated by single spaces, as most
+	providers write them, are split without the tokenizer.
+
+	Args:
+		line (str): Line starting with "#EXTINF:".
+
 	Returns:
-		list: A list of channel dictionaries with name, url, logo, and group.
+		tuple: (attributes dict with lowercase keys, title str).
+	"""
+	head, comma, title = line.partition('",')
+	if comma:
+		# An even number of parts means the quote before the comma closes a value
+		parts = head[len("#EXTINF:"):].split('"')
+		keys = len(parts) % 2 == 0 and SIMPLE_KEYS_RE.fullmatch('"'.join(parts[0::2]))
+		if keys:
+			return dict(zip(keys.group(1).split('=" '), parts[1::2])), title.strip()
+
+	attributes = {}
+	for key, quoted, plain, title in EXTINF_TOKEN_RE.findall(line, len("#EXTINF:")):
+		if not key:
+			return attributes, title.strip()
+		attributes[key.lower()] = quoted or plain
+	return attributes, ""
+
+def parse_m3u(lines):
 	"""
-	if m3u_url:
-		try:
-			response = requests.get(m3u_url)
+	Parse an M3U playlist.
+
+	Args:
+		lines (iterable): Lines of the playlist, e.g. a list or an open file.
+
+	Returns:
+		list: A list of channel dictionaries with name, url, logo, group,
+			tvg_id, tvg_name, tvg_chno, catchup and options. A channel listed
+			in several groups (separated by semicolons) gets one entry per group.
+	"""
+	channels = []
+	attributes = None
+	for line in lines:
+		line = line.strip()
+		if not line:
+			continue
+		if line[0] == '#':
+			if line.startswith('#EXTINF:'):
+				attributes, title = parse_extinf(line)
+				extgrp = ""
+				options = {}
+			elif attributes is None:
+				continue
+			elif line.startswith('#EXTGRP:'):
+				extgrp = line[len('#EXTGRP:'):].strip()
+			elif line.startswith('#EXTVLCOPT:'):
+				key, _, value = line[len('#EXTVLCOPT:'):].partition('=')
+				option = VLC_TO_MPV_OPTIONS.get(key.strip().lower())
+				if option:
+					options[option] = value.strip()
+			continue
+
+		# The first non-comment line after #EXTINF is the URL
+		if attributes is None:
+			continue
+		# A plain loop: a comprehension costs a frame per channel
+		catchup = {}
+		for key in CATCHUP_ATTRIBUTES:
+			if key in attributes:
+				catchup[key] = attributes[key]
+		channel = {
+			"name": title or attributes.get("tvg-name") or line,
+			"url": line,
+			"logo": attributes.get("tvg-logo", ""),
+			"group": None,
+			"tvg_id": attributes.get("tvg-id", ""),
+			"tvg_name": attributes.get("tvg-name", ""),
+			"tvg_chno": attributes.get("tvg-chno", ""),
+			"catchup": catchup,
+			"options": options
+		}
+		groups = list(filter(None, map(str.strip, attributes.get("group-title", extgrp).split(';')))) or ["Other"]
+		channel["group"] = groups[0]
+		channels.append(channel)
+		for group in groups[1:]:
+			channels.append(dict(channel, group=group))
+		attributes = None
+	return channels
+
+def _detect_compression(source, head):
+	"""Tell the compression of a playlist from its first bytes, or its name."""
+	for magic, compression in COMPRESSION_MAGIC.items():
+		if head.startswith(magic):
+			return compression
+	for suffix, compression in COMPRESSION_SUFFIXES.items():
+		if source.endswith(suffix):
+			return compression
+	return None
+
+def _decompressor(stream, compression):
+	"""Wrap a binary stream so it reads decompressed data."""
+	if compression == 'gzip':
+		return gzip.GzipFile(fileobj=stream)
+	if compression == 'xz':
+		return lzma.LZMAFile(stream)
+	if compression == 'zstd':
+		if zstandard is None:
+			raise OSError("zstd playlists need the zstandard module")
+		return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+	return stream
+
+@contextlib.contextmanager
+def open_source(source, timeout=30, deadline=None):
+	"""
+	Open a playlist as a stream of lines.
+
+	Local files are memory-mapped. Compressed playlists (gzip, xz, zstd,
+	recognized by their magic bytes or name) are decompressed on the fly,
+	so the decompressed text is never held in memory as a whole.
+
+	Args:
+		source (str): HTTP(S) URL, file:// URL or path.
+		timeout (float): Seconds to wait for an HTTP server.
+		deadline (float, optional): time.monotonic() value after which reading
+			stops with a TimeoutError.
+
+	Yields:
+		tuple: (iterator of str lines, stats dict). The stats dict is filled
+			in with the format and the transfer size as the lines are read.
+	"""
+	stats = {"format": "plain", "transfer_bytes": 0, "text_bytes": 0}
+	with contextlib.ExitStack() as stack:
+		if source.startswith(('http://', 'https://')):
+			response = stack.enter_context(requests.get(source, stream=True, timeout=timeout))
 			response.raise_for_status()  # Raise exception for HTTP errors
-		except requests.RequestException as e:
-			print(f"Error fetching M3U playlist: {e}")
-			return []
-	else:
+			# Undo any Content-Encoding; compression of the file itself is handled below
+			response.raw.decode_content = True
+			stream = io.BufferedReader(response.raw)
+			head = stream.peek(6)[:6]
+			transfer_bytes = response.raw.tell
+		else:
+			path = source[len('file://'):] if source.startswith('file://') else source
+			f = stack.enter_context(open(path, 'rb'))
+			size = os.fstat(f.fileno()).st_size
+			# Empty files can't be mapped
+			stream = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else f
+			head = stream[:6] if size else b''
+			transfer_bytes = lambda: size
+
+		compression = _detect_compression(source, head)
+		if compression:
+			stats["format"] = compression
+			stream = stack.enter_context(_decompressor(stream, compression))
+
+		def lines():
+			for count, line in enumerate(iter(stream.readline, b'')):
+				stats["text_bytes"] += len(line)
+				# A server that trickles data would otherwise never hit the socket timeout
+				if deadline is not None and count % 1024 == 0 and time.monotonic() > deadline:
+					raise TimeoutError("playlist not loaded within its deadline")
+				yield line.decode('utf-8', errors='replace')
+			stats["transfer_bytes"] = transfer_bytes()
+
+		yield lines(), stats
+
+def load_source(source, timeout=30, deadline=None):
+	"""
+	Fetch and parse one playlist, reporting failures instead of raising them.
+
+	Args:
+		source (str): HTTP(S) URL, file:// URL or path.
+		timeout (float): Seconds to wait for an HTTP server.
+		deadline (float, optional): Seconds the whole playlist may take to load.
+
+	Returns:
+		tuple: (list of channel dictionaries, stats dict).
+	"""
+	start = time.perf_counter()
+	stats = {"source": source, "channels": 0, "error": None}
+	try:
+		# Lines go straight from the network or file into the parser
+		limit = time.monotonic() + deadline if deadline else None
+		with open_source(source, timeout, limit) as (lines, stream_stats):
+			channels = parse_m3u(lines)
+		stats.update(stream_stats)
+		stats["channels"] = len(channels)
+	except (requests.RequestException, OSError) + DECOMPRESSION_ERRORS as e:
+		print(f"Error fetching M3U playlist {source}: {e}")
+		stats["error"] = str(e)
+		channels = []
+	stats["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+	return channels, stats
+
+def merge_channels(catalogs):
+	"""
+	Merge the catalogs of several playlists.
+
+	Each playlist keeps its own groups. A channel already provided by a
+	playlist with higher precedence, by URL or by tvg-id, is left out; its
+	URL is kept as an alternate of the channel that was kept.
+
+	Args:
+		catalogs (list): Lists of channel dictionaries, highest precedence first.
+
+	Returns:
+		list: Merged list of channel dictionaries.
+	"""
+	merged = []
+	by_url = {}
+	by_tvg_id = {}
+	for catalog in catalogs:
+		added_urls = {}
+		added_ids = {}
+		for channel in catalog:
+			kept = by_url.get(channel["url"]) or (channel["tvg_id"] and by_tvg_id.get(channel["tvg_id"]))
+			if kept:
+				if channel["url"] != kept["url"] and channel["url"] not in kept.setdefault("alternates", []):
+					kept["alternates"].append(channel["url"])
+				continue
+			merged.append(channel)
+			added_urls.setdefault(channel["url"], channel)
+			if channel["tvg_id"]:
+				added_ids.setdefault(channel["tvg_id"], channel)
+		# Duplicates within one playlist are deliberate (several groups), so
+		# a playlist only deduplicates against the ones before it
+		for url, channel in added_urls.items():
+			by_url.setdefault(url, channel)
+		for tvg_id, channel in added_ids.items():
+			by_tvg_id.setdefault(tvg_id, channel)
+	return merged
+
+def get_channels(sources=None, timeout=None, deadline=None):
+	"""
+	Get a list of channels from the M3U playlists.
+
+	The playlists are fetched concurrently, so loading takes about as long
+	as the slowest one. A playlist that fails, or isn't loaded by the
+	deadline, is left out.
+
+	Args:
+		sources (list, optional): Playlist URLs or paths, highest precedence first.
+			Defaults to IPMPV_M3U_URL.
+		timeout (float, optional): Seconds to wait for each HTTP server.
+			Defaults to IPMPV_M3U_TIMEOUT.
+		deadline (float, optional): Seconds each playlist may take to load as a whole.
+			Defaults to IPMPV_M3U_DEADLINE.
+	
+	Returns:
+		list: A list of channel dictionaries, see parse_m3u().
+	"""
+	sources = m3u_sources if sources is None else sources
+	timeout = m3u_timeout if timeout is None else timeout
+	deadline = m3u_deadline if deadline is None else deadline
+	if not sources:
 		print("Error: IPMPV_M3U_URL not set. Please set this environment variable to the URL of your IPTV list, in M3U format.")
 		sys.exit(1)
-		
-	lines = response.text.splitlines()
-
-	channels = []
-	# Match tvg-logo and group-title attributes
-	logo_group_regex = re.compile(r'tvg-logo="(.*?)".*?group-title="(.*?)"', re.IGNORECASE)
-
-	for i in range(len(lines)):
-		if lines[i].startswith("#EXTINF"):
-			match = logo_group_regex.search(lines[i])
-			
-			logo = match.group(1) if match else ""
-			
-			# Handle multiple groups separated by semicolons
-			groups = []
-			if match and match.group(2):
-				# Split by semicolon and create a channel entry for each group
-				groups = [group.strip() for group in match.group(2).split(';')]
-			
-			# Default to "Other" if no groups found
-			if not groups:
-				groups = ["Other"]
-				
-			name = lines[i].split(",")[-1]
-			url = lines[i + 1]
-
-			# Create a channel entry for the primary group
-			primary_group = groups[0]
-			channels.append({"name": name, "url": url, "logo": logo, "group": primary_group})
-			
-			# Create additional channel entries for secondary groups if present
-			for group in groups[1:]:
-				if group:  # Skip empty groups
-					channels.append({"name": name, "url": url, "logo": logo, "group": group})
 
+	start = time.perf_counter()
+	pool = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="playlist")
+	futures = {pool.submit(load_source, source, timeout, deadline): source for source in sources}
+	loaded = {}
+	try:
+		for future in as_completed(futures, timeout=deadline):
+			loaded[futures[future]] = future.result()
+	except FuturesTimeoutError:
+		for source in sources:
+			if source not in loaded:
+				print(f"\033[91mPlaylist {source} not loaded within {deadline} s, leaving it out\033[0m")
+	finally:
+		# Don't wait for a stuck source; its own deadline stops it
+		pool.shutdown(wait=False, cancel_futures=True)
+	results = [loaded[source] for source in sources if source in loaded]
+	channels = merge_channels([catalog for catalog, _ in results])
+	for _, stats in results:
+		if stats["error"] is None:
+			print(f"Playlist {stats['source']}: {stats['channels']} channels in {stats['load_ms']} ms "
+				  f"({stats['format']}, {stats['transfer_bytes']} bytes transferred, {stats['text_bytes']} bytes of text)")
+	print(f"Loaded {len(channels)} channels from {len(sources)} playlists in {(time.perf_counter() - start) * 1000:.1f} ms")
 	return channels
 
 def group_channels(channels):
@@ -74,3 +351,34 @@ def group_channels(channels):
 	for channel in channels:
 		grouped_channels.setdefault(channel["group"], []).append(channel)
 	return grouped_channels
+
+def channel_key(channel):
+	"""
+	Get the identity of a channel, shared by every entry that carries the
+	same programme (alternate URLs, or the same channel listed in several groups).
+
+	Args:
+		channel (dict): Channel dictionary.
+
+	Returns:
+		str: Identity key.
+	"""
+	return channel.get("tvg_id") or channel["name"].strip().lower()
+
+def build_alternates(channels):
+	"""
+	Collect the URLs known for each channel identity.
+
+	Args:
+		channels (list): List of channel dictionaries.
+
+	Returns:
+		dict: Channel identity to a list of unique URLs, in playlist order.
+	"""
+	alternates = {}
+	for channel in channels:
+		urls = alternates.setdefault(channel_key(channel), [])
+		for url in [channel["url"]] + channel.get("alternates", []):
+			if url not in urls:
+				urls.append(url)
+	return alternates
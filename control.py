@@ -0,0 +1,467 @@
+#!/usr/bin/python
+"""Local control socket for IPMPV."""
+
+import errno
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import traceback
+from events import events, EventBus
+from profiles import DEFAULT_PROFILE
+
+# mpv events forwarded to subscribers
+FORWARDED_EVENTS = ('start-file', 'file-loaded', 'playback-restart', 'end-file')
+
+class ControlSocket:
+	"""
+	Line-based control interface for bridge daemons on the same machine.
+
+	Every request is one line, "<command> [arguments]", answered with one
+	line starting with "OK" or "ERR". Commands map straight onto Player and
+	VolumeControl calls, without the TCP handshake, WSGI and routing of the
+	HTTP API:
+
+		ping                    OK pong
+		ch <index>              tune a channel
+		ch+ [r] / ch- [r]       next/previous live channel
+		vol <level>             set the volume (0-100)
+		vol+ [step] [r]         raise the volume
+		vol- [step] [r]         lower the volume
+		mute [0|1]              set, or without an argument toggle, the mute state
+		profile <name>          switch playback profile
+		latency                 toggle low latency mode
+		deint [0|1]             set, or toggle, deinterlacing
+		osd / osd-hide          show or hide the OSD
+		stop                    stop playback
+		pause                   pause or resume live TV (timeshift)
+		rew [secs] / ff [secs]  move back or forward in the timeshift buffer
+		live                    jump back to live
+		state                   OK <JSON player and mixer state>
+		sub                     receive "EVT <JSON>" lines for every event
+
+	A trailing "r" marks a key repeat, as sent while a remote key is held.
+	Repeated volume steps apply at once. Repeated channel steps only move a
+	pending target, which is tuned once the key is released (no repeat for
+	`zap_delay` seconds), so holding a key zaps through the list without
+	starting a tune per channel. Toggles ignore repeats.
+
+	The same commands are accepted as UDP datagrams, one or more lines each,
+	answered to the sender; subscriptions need the stream socket.
+	"""
+
+	def __init__(self, server, path, udp_address=None, zap_delay=0.3):
+		"""
+		Initialize the control socket.
+
+		Args:
+			server (IPMPVServer): Server whose player, mixer and catalog are controlled.
+			path (str): Path of the Unix domain socket.
+			udp_address (tuple, optional): (host, port) to also accept UDP datagrams on.
+			zap_delay (float): Seconds after the last channel repeat before tuning.
+		"""
+		self.server = server
+		self.path = path
+		self.udp_address = udp_address
+		self.zap_delay = zap_delay
+
+		self.zap_lock = threading.Lock()
+		self.zap_target = None
+		self.zap_timer = None
+		self.mpv_events = EventBus()
+		self.listening = False
+		self.counters = {"connections": 0, "commands": 0, "errors": 0}
+
+	def _remove_stale_socket(self):
+		"""Remove a socket left behind by a previous run, but never one still in use."""
+		try:
+			mode = os.stat(self.path).st_mode
+		except FileNotFoundError:
+			return
+		if not stat.S_ISSOCK(mode):
+			raise OSError(errno.EEXIST, f"{self.path} exists and is not a socket")
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		probe.settimeout(1)
+		try:
+			probe.connect(self.path)
+		except ConnectionRefusedError:
+			# Nobody is listening any more
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+		else:
+			raise OSError(errno.EADDRINUSE, f"another process is listening on {self.path}")
+		finally:
+			probe.close()
+
+	def start(self):
+		"""Bind the sockets and serve them in the background."""
+		self._remove_stale_socket()
+		handler = self._stream_handler()
+		stream_server = socketserver.ThreadingUnixStreamServer(self.path, handler)
+		stream_server.daemon_threads = True
+		os.chmod(self.path, 0o660)
+		threading.Thread(target=stream_server.serve_forever, name="control", daemon=True).start()
+		print(f"Control socket listening on {self.path}")
+
+		if self.udp_address is not None:
+			udp_server = socketserver.UDPServer(self.udp_address, self._datagram_handler())
+			threading.Thread(target=udp_server.serve_forever, name="control-udp", daemon=True).start()
+			print(f"Control socket listening on udp://{self.udp_address[0]}:{self.udp_address[1]}")
+
+	def _stream_handler(self):
+		"""Build the request handler class for stream connections."""
+		control = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				control.counters["connections"] += 1
+				self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+				write_lock = threading.Lock()
+				subscriptions = []
+
+				def send(line):
+					with write_lock:
+						self.wfile.write(line.encode('utf-8') + b'\n')
+
+				try:
+					for raw in self.rfile:
+						line = raw.decode('utf-8', 'replace').strip()
+						if not line:
+							continue
+						if line.lower() == 'sub':
+							if not subscriptions:
+								subscriptions = control._subscribe(send)
+							send("OK subscribed")
+						else:
+							send(control.execute(line))
+				except (OSError, ValueError):
+					pass
+				finally:
+					for bus, subscriber in subscriptions:
+						bus.unsubscribe(subscriber)
+						subscriber.put(None)
+
+		return Handler
+
+	def _datagram_handler(self):
+		"""Build the request handler class for UDP datagrams."""
+		control = self
+
+		class Handler(socketserver.BaseRequestHandler):
+			def handle(self):
+				data, sock = self.request
+				replies = [control.execute(line.strip())
+						   for line in data.decode('utf-8', 'replace').splitlines() if line.strip()]
+				if replies:
+					sock.sendto('\n'.join(replies).encode('utf-8') + b'\n', self.client_address)
+
+		return Handler
+
+	def _subscribe(self, send):
+		"""
+		Forward the global events and the player's mpv events to a connection.
+
+		Args:
+			send (callable): Writes one line to the connection.
+
+		Returns:
+			list: (bus, queue) pairs to unsubscribe when the connection closes.
+		"""
+		if not self.listening and self._ready("player") is None:
+			self.listening = True
+			self.server.player.add_event_listener(self._on_player_event)
+
+		subscriptions = [(events, events.subscribe()), (self.mpv_events, self.mpv_events.subscribe())]
+
+		def forward(subscriber):
+			while True:
+				message = subscriber.get()
+				if message is None:
+					return
+				try:
+					send("EVT " + json.dumps(message, separators=(',', ':')))
+				except (OSError, ValueError):
+					return
+
+		for _, subscriber in subscriptions:
+			threading.Thread(target=forward, args=(subscriber,), daemon=True).start()
+		return subscriptions
+
+	def _on_player_event(self, name, data):
+		"""Publish the mpv events subscribers care about."""
+		if name in FORWARDED_EVENTS:
+			self.mpv_events.publish(name, index=self.server.player.current_index, **data)
+
+	def _ready(self, *subsystems):
+		"""
+		Check whether the given subsystems have finished starting up.
+
+		Returns:
+			str: An error reply if any of them is not ready yet, None otherwise.
+		"""
+		server = self.server
+		for name in subsystems:
+			if server.startup is not None and not server.startup.is_ready(name):
+				return f"ERR {name} not ready"
+		if "player" in subsystems and server.player is None:
+			return "ERR player not ready"
+		if "mixer" in subsystems and server.volume_control is None:
+			return "ERR mixer not ready"
+		return None
+
+	def execute(self, line):
+		"""
+		Run one command.
+
+		Args:
+			line (str): Command line, e.g. "vol+ 5 r".
+
+		Returns:
+			str: Reply line.
+		"""
+		self.counters["commands"] += 1
+		parts = line.split()
+		command, args = parts[0].lower(), parts[1:]
+		repeat = bool(args) and args[-1].lower() == 'r'
+		if repeat:
+			args = args[:-1]
+		handler = COMMANDS.get(command)
+		if handler is None:
+			self.counters["errors"] += 1
+			return f"ERR unknown command {command}"
+		try:
+			return handler(self, args, repeat)
+		except (ValueError, IndexError) as e:
+			self.counters["errors"] += 1
+			return f"ERR {command}: {e}"
+		except Exception as e:
+			# A failing command must not take the connection down with it
+			self.counters["errors"] += 1
+			print(f"\033[91mControl command {line!r} failed: {e}\033[0m")
+			traceback.print_exc()
+			return f"ERR {command}: {type(e).__name__}: {e}"
+
+	def _tune(self, index):
+		"""Tune a channel in the background."""
+		threading.Thread(
+			target=self.server.player.play_channel,
+			args=(index, self.server.channels),
+			daemon=True
+		).start()
+
+	def _zap(self):
+		"""Tune the channel a held channel key ended on."""
+		with self.zap_lock:
+			index, self.zap_target, self.zap_timer = self.zap_target, None, None
+		if index is not None:
+			self._tune(index)
+
+	def _cmd_ping(self, args, repeat):
+		return "OK pong"
+
+	def _cmd_channel(self, args, repeat):
+		busy = self._ready("player", "catalog")
+		if busy:
+			return busy
+		index = int(args[0])
+		if not 0 <= index < len(self.server.channels):
+			raise ValueError(f"no channel {index}")
+		self._tune(index)
+		return f"OK ch={index}"
+
+	def _cmd_channel_step(self, step, repeat):
+		busy = self._ready("player", "catalog")
+		if busy:
+			return busy
+		if not self.server.channels:
+			return "ERR no channels"
+		with self.zap_lock:
+			if self.zap_timer is not None:
+				self.zap_timer.cancel()
+			index = self.server._next_live_index(step, self.zap_target) % len(self.server.channels)
+			if repeat:
+				self.zap_target = index
+				self.zap_timer = threading.Timer(self.zap_delay, self._zap)
+				self.zap_timer.daemon = True
+				self.zap_timer.start()
+			else:
+				self.zap_target = None
+				self.zap_timer = None
+		if not repeat:
+			self._tune(index)
+		return f"OK ch={index} name={json.dumps(self.server.channels[index]['name'])}"
+
+	def _cmd_channel_up(self, args, repeat):
+		return self._cmd_channel_step(1, repeat)
+
+	def _cmd_channel_down(self, args, repeat):
+		return self._cmd_channel_step(-1, repeat)
+
+	def _volume_reply(self, volume, muted):
+		self.server._remember_volume()
+		return f"OK vol={volume} muted={int(muted)}"
+
+	def _cmd_volume(self, args, repeat):
+		busy = self._ready("mixer")
+		if busy:
+			return busy
+		return self._volume_reply(*self.server.volume_control.set_volume(int(args[0])))
+
+	def _cmd_volume_up(self, args, repeat):
+		busy = self._ready("mixer")
+		if busy:
+			return busy
+		volume = self.server.volume_control.volume_up(int(args[0]) if args else None)
+		return self._volume_reply(volume, self.server.volume_control.is_muted())
+
+	def _cmd_volume_down(self, args, repeat):
+		busy = self._ready("mixer")
+		if busy:
+			return busy
+		volume = self.server.volume_control.volume_down(int(args[0]) if args else None)
+		return self._volume_reply(volume, self.server.volume_control.is_muted())
+
+	def _cmd_mute(self, args, repeat):
+		busy = self._ready("mixer")
+		if busy:
+			return busy
+		volume_control = self.server.volume_control
+		if args:
+			return self._volume_reply(*volume_control.set_volume(muted=args[0] not in ('0', 'off')))
+		if repeat:
+			return self._volume_reply(volume_control.get_volume(), volume_control.is_muted())
+		muted = volume_control.toggle_mute()
+		return self._volume_reply(volume_control.get_volume(), muted)
+
+	def _cmd_profile(self, args, repeat):
+		busy = self._ready("player")
+		if busy:
+			return busy
+		if not self.server.player.set_profile(args[0]):
+			raise ValueError(f"unknown profile {args[0]}")
+		return f"OK profile={args[0]}"
+
+	def _cmd_latency(self, args, repeat):
+		busy = self._ready("player")
+		if busy:
+			return busy
+		player = self.server.player
+		if not repeat:
+			player.set_profile(DEFAULT_PROFILE if player.low_latency else 'low-latency')
+		return f"OK profile={player.profile}"
+
+	def _cmd_deinterlace(self, args, repeat):
+		busy = self._ready("player")
+		if busy:
+			return busy
+		player = self.server.player
+		if args:
+			player.set_deinterlace(args[0] not in ('0', 'off'))
+		elif not repeat:
+			player.set_deinterlace(not player.deinterlace)
+		return f"OK deint={int(player.deinterlace)}"
+
+	def _cmd_show_osd(self, args, repeat):
+		busy = self._ready("player", "catalog")
+		if busy:
+			return busy
+		self.server._handle_show_osd()
+		return "OK"
+
+	def _cmd_hide_osd(self, args, repeat):
+		self.server.to_qt_queue.put({'action': 'close_osd'})
+		return "OK"
+
+	def _cmd_stop(self, args, repeat):
+		busy = self._ready("player")
+		if busy:
+			return busy
+		self.server.player.stop()
+		return "OK"
+
+	def _timeshift(self):
+		"""Get the timeshift subsystem, or an error reply."""
+		busy = self._ready("player")
+		if busy:
+			return None, busy
+		if self.server.player.timeshift is None:
+			return None, "ERR timeshift disabled"
+		return self.server.player.timeshift, None
+
+	def _timeshift_reply(self, timeshift):
+		status = timeshift.status()
+		return f"OK paused={int(status['paused'])} delay={status.get('delay', 0)}"
+
+	def _cmd_pause(self, args, repeat):
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		if not repeat:
+			player = self.server.player
+			if player.current_index is None and not timeshift.active:
+				return "ERR no channel playing"
+			timeshift.toggle_pause(self.server.channels[player.current_index] if player.current_index is not None else None)
+			if not timeshift.active:
+				return f"ERR {timeshift.error}"
+		return self._timeshift_reply(timeshift)
+
+	def _timeshift_seek(self, direction, args):
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		if not timeshift.seek(direction * (float(args[0]) if args else 10)):
+			return "ERR timeshift not active"
+		return self._timeshift_reply(timeshift)
+
+	def _cmd_rewind(self, args, repeat):
+		return self._timeshift_seek(-1, args)
+
+	def _cmd_forward(self, args, repeat):
+		return self._timeshift_seek(1, args)
+
+	def _cmd_live(self, args, repeat):
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		if not timeshift.jump_live():
+			return "ERR timeshift not active"
+		return self._timeshift_reply(timeshift)
+
+	def _cmd_state(self, args, repeat):
+		server = self.server
+		state = {}
+		if server.player is not None:
+			state.update(index=server.player.current_index, profile=server.player.profile,
+						 deinterlace=server.player.deinterlace, tuning=server.player.tuning)
+		if server.volume_control is not None:
+			state.update(volume=server.volume_control.get_volume(), muted=server.volume_control.is_muted())
+		return "OK " + json.dumps(state, separators=(',', ':'))
+
+	def metrics(self):
+		"""Get the command counters."""
+		return dict(self.counters, path=self.path, udp=self.udp_address is not None)
+
+COMMANDS = {
+	'ping': ControlSocket._cmd_ping,
+	'ch': ControlSocket._cmd_channel,
+	'ch+': ControlSocket._cmd_channel_up,
+	'ch-': ControlSocket._cmd_channel_down,
+	'vol': ControlSocket._cmd_volume,
+	'vol+': ControlSocket._cmd_volume_up,
+	'vol-': ControlSocket._cmd_volume_down,
+	'mute': ControlSocket._cmd_mute,
+	'profile': ControlSocket._cmd_profile,
+	'latency': ControlSocket._cmd_latency,
+	'deint': ControlSocket._cmd_deinterlace,
+	'osd': ControlSocket._cmd_show_osd,
+	'osd-hide': ControlSocket._cmd_hide_osd,
+	'stop': ControlSocket._cmd_stop,
+	'pause': ControlSocket._cmd_pause,
+	'rew': ControlSocket._cmd_rewind,
+	'ff': ControlSocket._cmd_forward,
+	'live': ControlSocket._cmd_live,
+	'state': ControlSocket._cmd_state,
+}
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+"""Profiling and memory diagnostics for IPMPV."""
+
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+def sample_profile(seconds, interval=0.005):
+	"""
+	Sample the stacks of every thread for a while.
+
+	Args:
+		seconds (float): How long to sample for.
+		interval (float): Seconds between samples.
+
+	Returns:
+		tuple: (Counter of collapsed stacks, number of samples). Collapsed
+			stacks are "thread;outer (file:line);...;inner (file:line)"
+			strings, the input format of flamegraph.pl and speedscope.
+	"""
+	names = {}
+	stacks = collections.Counter()
+	samples = 0
+	me = threading.get_ident()
+	deadline = time.monotonic() + seconds
+	while time.monotonic() < deadline:
+		for thread_id, frame in sys._current_frames().items():
+			if thread_id == me:
+				continue
+			if thread_id not in names:
+				names = {thread.ident: thread.name for thread in threading.enumerate()}
+			parts = []
+			while frame is not None:
+				code = frame.f_code
+				parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+				frame = frame.f_back
+			parts.append(names.get(thread_id, str(thread_id)))
+			stacks[';'.join(reversed(parts))] += 1
+		samples += 1
+		time.sleep(interval)
+	return stacks, samples
+
+class MemoryTracker:
+	"""tracemalloc snapshots, each compared with the previous one on request."""
+
+	def __init__(self, frames=10):
+		"""
+		Initialize the tracker. Tracing only starts on the first snapshot,
+		since it slows down every allocation.
+
+		Args:
+			frames (int): Number of frames kept per allocation traceback.
+		"""
+		self.frames = frames
+		self.previous = None
+		self.lock = threading.Lock()
+
+	def snapshot(self, limit=20, diff=False, group_by='lineno'):
+		"""
+		Take a snapshot of the traced allocations.
+
+		Args:
+			limit (int): Number of top entries to return.
+			diff (bool): Compare with the previous snapshot instead of listing totals.
+			group_by (str): "lineno", "filename" or "traceback".
+
+		Returns:
+			dict: Traced memory totals and the top allocation sites.
+		"""
+		with self.lock:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start(self.frames)
+			snapshot = tracemalloc.take_snapshot().filter_traces((
+				tracemalloc.Filter(False, tracemalloc.__file__),
+				tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+			))
+			previous, self.previous = self.previous, snapshot
+
+		current, peak = tracemalloc.get_traced_memory()
+		result = {"traced_kb": current // 1024, "peak_kb": peak // 1024, "diff": bool(diff and previous)}
+		if diff and previous is not None:
+			entries = snapshot.compare_to(previous, group_by)[:limit]
+			result["top"] = [{
+				"where": str(stat.traceback),
+				"size_kb": round(stat.size / 1024, 1),
+				"size_diff_kb": round(stat.size_diff / 1024, 1),
+				"count": stat.count,
+				"count_diff": stat.count_diff
+			} for stat in entries]
+		else:
+			result["top"] = [{
+				"where": str(stat.traceback),
+				"size_kb": round(stat.size / 1024, 1),
+				"count": stat.count
+			} for stat in snapshot.statistics(group_by)[:limit]]
+		return result
+
+	def stop(self):
+		"""Stop tracing and forget the snapshots."""
+		with self.lock:
+			tracemalloc.stop()
+			self.previous = None
+
+def thread_stats():
+	"""
+	Get the threads of this process with the CPU time each has used.
+
+	Returns:
+		dict: Thread count and, per thread, its name and user/system CPU seconds.
+	"""
+	ticks = os.sysconf('SC_CLK_TCK')
+	threads = {thread.native_id: thread for thread in threading.enumerate()}
+	result = []
+	try:
+		task_ids = os.listdir('/proc/self/task')
+	except OSError:
+		task_ids = []
+	for task_id in task_ids:
+		try:
+			with open(f'/proc/self/task/{task_id}/stat', 'r') as f:
+				stat = f.read()
+		except OSError:
+			continue
+		# The thread name is in parentheses and may contain spaces
+		name = stat[stat.index('(') + 1:stat.rindex(')')]
+		fields = stat[stat.rindex(')') + 2:].split()
+		thread = threads.get(int(task_id))
+		result.append({
+			"tid": int(task_id),
+			"name": thread.name if thread else name,
+			"python": thread is not None,
+			"daemon": thread.daemon if thread else None,
+			"user_s": int(fields[11]) / ticks,
+			"system_s": int(fields[12]) / ticks
+		})
+	result.sort(key=lambda entry: entry["user_s"] + entry["system_s"], reverse=True)
+	return {"count": len(result), "python_threads": threading.active_count(), "threads": result}
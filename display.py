@@ -0,0 +1,354 @@
+#!/usr/bin/python
+"""Display mode backend for IPMPV."""
+
+import os
+import subprocess
+import threading
+import time
+from utils import is_wayland, drm_connector
+
+# Output modes IPMPV knows how to switch between
+MODES = {
+	"480i": {"size": "720x480", "interlaced": True},
+	"240p": {"size": "720x240", "interlaced": False},
+	"576i": {"size": "720x576", "interlaced": True},
+	"288p": {"size": "720x288", "interlaced": False},
+}
+
+# Mode selected by /toggle_resolution for each current mode
+TOGGLE_MODES = {
+	"480i": "240p",
+	"240p": "480i",
+	"576i": "288p",
+	"288p": "576i",
+}
+
+def crtc_mode(state, connector):
+	"""
+	Find the mode a connector is driven at in a DRM atomic state dump.
+
+	Args:
+		state (str): Contents of debugfs dri/<N>/state.
+		connector (str): Connector name, e.g. "Composite-1".
+
+	Returns:
+		str: The mode line of the connector's CRTC, e.g. '"720x480i": 60 13500 ...',
+			or None if the connector isn't listed or isn't driven.
+	"""
+	blocks = {}
+	name = None
+	for line in state.splitlines():
+		if line and not line[0].isspace():
+			# Block header, e.g. "crtc[33]: crtc-0" or "connector[35]: Composite-1"
+			kind, _, name = line.partition(": ")
+			name = (kind.split("[")[0], name.strip())
+			blocks[name] = {}
+		elif name is not None:
+			key, separator, value = line.strip().partition("=")
+			if not separator:
+				key, _, value = line.strip().partition(": ")
+			blocks[name][key] = value
+	crtc = blocks.get(("connector", connector), {}).get("crtc")
+	if not crtc or crtc == "(null)":
+		return None
+	return blocks.get(("crtc", crtc), {}).get("mode")
+
+class DisplayBackend:
+	"""
+	Cached display mode backend.
+
+	The current mode is kept in memory and only re-read when the connector
+	state changes, so callers never wait on xrandr/wlr-randr. The mode the
+	connector is driven at is read from the DRM state in debugfs where it is
+	mounted and readable; without it, a mode switched by another program
+	can't be observed, and the mode is re-read every `refresh_interval`
+	seconds instead. Connector discovery and the list of supported modes
+	come from /sys/class/drm when available, falling back to the CLI tools.
+	"""
+
+	def __init__(self, sysfs_root="/sys/class/drm", connector=None, wayland=None, poll_interval=2,
+				 debugfs_root="/sys/kernel/debug/dri", refresh_interval=30):
+		"""
+		Initialize the display backend.
+
+		Args:
+			sysfs_root (str): Root of the DRM class tree. Can point at a fake tree for testing.
+			connector (str, optional): Connector name, e.g. "Composite-1". Discovered from sysfs if not given.
+			wayland (bool, optional): Whether to use wlr-randr instead of xrandr. Defaults to the running session.
+			poll_interval (float): Seconds between checks of the connector state.
+			debugfs_root (str): Root of the DRM debugfs tree. Can point at a fake tree for testing.
+			refresh_interval (float): Seconds between mode queries when the current mode can't be observed.
+		"""
+		self.sysfs_root = sysfs_root
+		self.connector = connector or drm_connector
+		self.wayland = is_wayland if wayland is None else wayland
+		self.poll_interval = poll_interval
+		self.debugfs_root = debugfs_root
+		self.refresh_interval = refresh_interval
+		self.refreshed_at = None
+		self.mode = "UNK"
+		self.pending_mode = None
+		self.lock = threading.Lock()
+		self.change_lock = threading.Lock()
+		self._signature = None
+		self._watcher = None
+
+	def connectors(self):
+		"""
+		List the connectors exposed by DRM.
+
+		Returns:
+			dict: Connector name to sysfs directory, e.g. {"Composite-1": ".../card0-Composite-1"}.
+		"""
+		connectors = {}
+		try:
+			entries = os.listdir(self.sysfs_root)
+		except OSError:
+			return connectors
+		for entry in sorted(entries):
+			path = os.path.join(self.sysfs_root, entry)
+			# Connector directories are named card<N>-<connector>
+			if entry.startswith("card") and "-" in entry and os.path.exists(os.path.join(path, "status")):
+				connectors[entry.split("-", 1)[1]] = path
+		return connectors
+
+	def _read(self, path, name):
+		"""Read a sysfs attribute, returning None if it is not available."""
+		try:
+			with open(os.path.join(path, name)) as f:
+				return f.read().strip()
+		except OSError:
+			return None
+
+	def _connector_path(self):
+		"""Find the sysfs directory of the connector in use, discovering it if needed."""
+		connectors = self.connectors()
+		if self.connector:
+			return connectors.get(self.connector)
+		# Prefer a connected composite output, then any connected output
+		connected = [name for name, path in connectors.items() if self._read(path, "status") == "connected"]
+		for name in connected:
+			if name.startswith("Composite"):
+				self.connector = name
+				return connectors[name]
+		if connected:
+			self.connector = connected[0]
+			return connectors[connected[0]]
+		return None
+
+	def _current_mode(self):
+		"""Read the mode the connector is driven at from debugfs, or None if it isn't available."""
+		if not self.connector:
+			return None
+		try:
+			cards = sorted(os.listdir(self.debugfs_root))
+		except OSError:
+			return None
+		for card in cards:
+			state = self._read(os.path.join(self.debugfs_root, card), "state")
+			mode = crtc_mode(state, self.connector) if state else None
+			if mode is not None:
+				return mode
+		return None
+
+	def _connector_signature(self):
+		"""Get a snapshot of the connector state used to detect mode changes."""
+		path = self._connector_path()
+		if path is None:
+			return None
+		return (self._read(path, "status"), self._read(path, "enabled"), self._current_mode())
+
+	def supported_modes(self):
+		"""
+		Get the modes advertised by the connector.
+
+		Returns:
+			list: Mode strings as listed in sysfs (e.g. "720x480i"), or an empty list if unknown.
+		"""
+		path = self._connector_path()
+		modes = self._read(path, "modes") if path else None
+		return modes.split() if modes else []
+
+	def get_mode(self):
+		"""
+		Get the current display mode from the cache. Never blocks.
+
+		Returns:
+			str: One of the MODES keys, or "UNK".
+		"""
+		return self.mode
+
+	def refresh(self):
+		"""
+		Re-read the current mode from the display server. This spawns a CLI
+		tool and should only be called from a background thread.
+
+		Returns:
+			str: The current mode.
+		"""
+		mode = self._query_mode()
+		with self.lock:
+			self.mode = mode
+			self._signature = self._connector_signature()
+			self.refreshed_at = time.monotonic()
+		return mode
+
+	def check_for_changes(self):
+		"""
+		Refresh the cached mode if the connector state changed since the last check.
+
+		Returns:
+			bool: Whether a change was observed.
+		"""
+		signature = self._connector_signature()
+		if signature == self._signature:
+			return False
+		print("Display: connector state changed, refreshing mode")
+		self.refresh()
+		return True
+
+	def start_watcher(self):
+		"""Start a background thread that watches the connector for mode changes."""
+		if self._watcher is not None:
+			return
+		self._watcher = threading.Thread(target=self._watch, name="display-watcher", daemon=True)
+		self._watcher.start()
+
+	def _watch(self):
+		"""Poll the connector state. Only small sysfs and debugfs files are read here."""
+		while True:
+			time.sleep(self.poll_interval)
+			if self.pending_mode is not None:
+				continue
+			try:
+				if self.check_for_changes():
+					continue
+				signature = self._signature
+				stale = self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_interval
+				if (signature is None or signature[2] is None) and stale:
+					# Nothing shows the mode in use: ask the display server now and then
+					self.refresh()
+			except Exception as e:
+				print(f"Display: error checking connector state: {e}")
+
+	def set_mode(self, mode):
+		"""
+		Switch the output to the given mode. Blocks while the CLI tool runs.
+
+		Args:
+			mode (str): One of the MODES keys.
+
+		Returns:
+			str: The mode now in use.
+		"""
+		if mode not in MODES:
+			return self.mode
+		with self.change_lock:
+			if self.mode == mode:
+				return mode
+			mode_string = self._mode_string(mode)
+			output = self.connector or "Composite-1"
+			tool = "wlr-randr" if self.wayland else "xrandr"
+			env = os.environ.copy()
+			env["DISPLAY"] = ":0"
+			start = time.monotonic()
+			try:
+				result = subprocess.run([tool, "--output", output, "--mode", mode_string], check=False, env=env)
+			except FileNotFoundError:
+				print(f"Error: Could not find {tool}, cannot change resolution")
+				return self.mode
+			print(f"Display: {tool} set {output} to {mode_string} in {(time.monotonic() - start) * 1000:.0f} ms")
+			with self.lock:
+				# We made this change ourselves, so there is no need to query it back
+				if result.returncode == 0:
+					self.mode = mode
+					self.refreshed_at = time.monotonic()
+				self._signature = self._connector_signature()
+			return self.mode
+
+	def request_mode(self, mode, callback=None):
+		"""
+		Switch the output mode in the background.
+
+		Args:
+			mode (str): One of the MODES keys.
+			callback (callable, optional): Called with the mode in use once the switch completes.
+
+		Returns:
+			str: The requested mode, which becomes current once the switch completes.
+		"""
+		if mode not in MODES:
+			return self.mode
+		self.pending_mode = mode
+
+		def apply():
+			try:
+				self.set_mode(mode)
+			finally:
+				if self.pending_mode == mode:
+					self.pending_mode = None
+			if callback is not None:
+				callback(self.mode)
+
+		threading.Thread(target=apply, name="display-mode", daemon=True).start()
+		return mode
+
+	def toggle(self):
+		"""
+		Toggle between the progressive and interlaced mode of the current standard.
+
+		Returns:
+			str: The requested mode, or the current one if it cannot be toggled.
+		"""
+		current = self.pending_mode or self.mode
+		target = TOGGLE_MODES.get(current)
+		if target is None:
+			return current
+		return self.request_mode(target)
+
+	def _mode_string(self, mode):
+		"""Get the mode string to pass to the CLI tool."""
+		size = MODES[mode]["size"]
+		interlaced = MODES[mode]["interlaced"]
+		# Use the exact name advertised by the connector when we can
+		for supported in self.supported_modes():
+			if supported.rstrip("i") == size and supported.endswith("i") == interlaced:
+				return supported
+		# wlr-randr does not take the interlace suffix
+		return size + "i" if interlaced and not self.wayland else size
+
+	def _query_mode(self):
+		"""Get the current mode from xrandr or wlr-randr."""
+		output_name = self.connector or "Composite-1"
+		try:
+			if self.wayland:
+				output = subprocess.check_output(["wlr-randr"], universal_newlines=True, env=os.environ.copy())
+				in_output = False
+				for line in output.split("\n"):
+					if line and not line[0].isspace():
+						in_output = line.startswith(output_name)
+					elif in_output and "current" in line:
+						return self._mode_from_line(line)
+			else:
+				output = subprocess.check_output(["xrandr"], universal_newlines=True, env=os.environ.copy())
+				for line in output.split("\n"):
+					if line.startswith(output_name):
+						return self._mode_from_line(line)
+		except subprocess.CalledProcessError:
+			if self.wayland:
+				print("Error: Cannot get display resolution. Is this a wl-roots compatible compositor?")
+			else:
+				print("Error: Cannot get display resolution. Is an X session running?")
+		except FileNotFoundError:
+			if self.wayland:
+				print("Error: Could not find wlr-randr, resolution will be unknown")
+			else:
+				print("Error: Could not find xrandr, resolution will be unknown")
+		return "UNK"
+
+	def _mode_from_line(self, line):
+		"""Map a line of CLI output to one of the MODES keys."""
+		for mode, info in MODES.items():
+			if info["size"] in line:
+				return mode
+		return "UNK"
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+"""XMLTV programme guide for IPMPV."""
+
+import bisect
+import calendar
+import gzip
+import json
+import os
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from array import array
+import requests
+
+def parse_xmltv_time(value):
+	"""
+	Parse an XMLTV timestamp such as "20240131203000 +0100".
+
+	Args:
+		value (str): XMLTV timestamp. A missing offset means UTC.
+
+	Returns:
+		int: Unix time, or None if the value can't be parsed.
+	"""
+	try:
+		value = value.strip()
+		stamp = calendar.timegm((int(value[0:4]), int(value[4:6]), int(value[6:8]),
+								 int(value[8:10] or 0), int(value[10:12] or 0), int(value[12:14] or 0)))
+		offset = value[14:].strip()
+		if offset:
+			sign = -1 if offset[0] == '-' else 1
+			stamp -= sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+		return stamp
+	except (ValueError, IndexError):
+		return None
+
+class ChannelGuide:
+	"""Programmes of one channel, sorted by start time."""
+
+	__slots__ = ('starts', 'stops', 'titles')
+
+	def __init__(self, starts=(), stops=(), titles=()):
+		self.starts = array('q', starts)
+		self.stops = array('q', stops)
+		self.titles = list(titles)
+
+	def programme(self, i):
+		"""Get programme i as a dictionary."""
+		return {"title": self.titles[i], "start": self.starts[i], "stop": self.stops[i]}
+
+	def now_next(self, now):
+		"""
+		Find the programme airing at a given time and the one after it.
+
+		Args:
+			now (float): Unix time.
+
+		Returns:
+			tuple: (now, next) programme dictionaries, either of which may be None.
+		"""
+		i = bisect.bisect_right(self.starts, now) - 1
+		current = self.programme(i) if i >= 0 and self.stops[i] > now else None
+		following = self.programme(i + 1) if i + 1 < len(self.starts) else None
+		return current, following
+
+class EPG:
+	"""
+	Programme guide loaded from an XMLTV file or URL.
+
+	The XMLTV document is parsed as a stream: every element is cleared once
+	it has been read, so memory use depends on the number of programmes
+	kept, not on the size of the file. Each channel keeps its programmes in
+	time-sorted arrays, and now/next is a binary search.
+	"""
+
+	def __init__(self, source, cache_file=None, refresh_interval=6 * 3600, past_secs=3600, origin=None):
+		"""
+		Initialize the guide.
+
+		Args:
+			source (str): XMLTV URL or file path, optionally gzip-compressed.
+			cache_file (str, optional): JSON file the parsed guide is kept in for fast restarts.
+			refresh_interval (float): Seconds between downloads of the guide.
+			past_secs (float): How long programmes are kept after they ended.
+			origin (str, optional): Fleet origin to take the parsed guide from
+				before falling back to the source.
+		"""
+		self.source = source
+		self.cache_file = cache_file
+		self.refresh_interval = refresh_interval
+		self.past_secs = past_secs
+		self.origin = origin.rstrip('/') if origin else None
+
+		self.guides = {}
+		self.names = {}
+		self.loaded_at = None
+		self.stats = {}
+		self.running = False
+
+	def start(self):
+		"""Load the cached guide, then keep it up to date in the background."""
+		if self.running:
+			return
+		self.running = True
+		fresh = self._load_cache()
+		threading.Thread(target=self._loop, args=(fresh,), name="epg", daemon=True).start()
+
+	def _loop(self, fresh):
+		"""Refresh the guide periodically."""
+		if fresh:
+			time.sleep(max(0, self.loaded_at + self.refresh_interval - time.time()))
+		while self.running:
+			try:
+				if not self._pull_origin():
+					self.ingest()
+				self._save_cache()
+			except Exception as e:
+				print(f"\033[91mError loading EPG from {self.source}: {e}\033[0m")
+			time.sleep(self.refresh_interval)
+
+	def _open(self):
+		"""Open the source as a binary stream, decompressing gzip on the fly."""
+		if self.source.startswith(('http://', 'https://')):
+			response = requests.get(self.source, stream=True, timeout=30)
+			response.raise_for_status()
+			response.raw.decode_content = True
+			stream = response.raw
+		else:
+			stream = open(self.source, 'rb')
+		if self.source.endswith('.gz'):
+			return gzip.GzipFile(fileobj=stream)
+		return stream
+
+	def ingest(self):
+		"""Download and parse the guide, replacing the current one when done."""
+		start = time.monotonic()
+		# ru_maxrss is a high-water mark for the whole process, which the
+		# playlist, Qt or mpv may have set: trace this ingest's allocations instead
+		tracing = tracemalloc.is_tracing()
+		if tracing:
+			memory_before = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+		else:
+			memory_before = 0
+			tracemalloc.start(1)
+		cutoff = time.time() - self.past_secs
+
+		try:
+			programmes = {}
+			names = {}
+			count = 0
+			root = None
+			with self._open() as stream:
+				for event, element in ET.iterparse(stream, events=('start', 'end')):
+					if event == 'start':
+						if root is None:
+							root = element
+						continue
+					if element.tag == 'programme':
+						stop = parse_xmltv_time(element.get('stop', ''))
+						channel_id = element.get('channel')
+						if channel_id and stop is not None and stop > cutoff:
+							start_time = parse_xmltv_time(element.get('start', ''))
+							if start_time is not None:
+								programmes.setdefault(channel_id, []).append(
+									(start_time, stop, element.findtext('title', '')))
+								count += 1
+					elif element.tag == 'channel':
+						channel_id = element.get('id')
+						for display_name in element.iter('display-name'):
+							if display_name.text:
+								names[display_name.text.strip().lower()] = channel_id
+					else:
+						continue
+					# Drop what has been read, including the reference kept by the root
+					element.clear()
+					root.clear()
+
+			guides = {}
+			for channel_id, entries in programmes.items():
+				entries.sort()
+				starts, stops, titles = zip(*entries)
+				guides[channel_id] = ChannelGuide(starts, stops, titles)
+			memory_after, memory_peak = tracemalloc.get_traced_memory()
+		finally:
+			if not tracing:
+				tracemalloc.stop()
+		self.guides = guides
+		self.names = names
+		self.loaded_at = time.time()
+
+		self.stats = {
+			"source": self.source,
+			"channels": len(guides),
+			"programmes": count,
+			"ingest_ms": round((time.monotonic() - start) * 1000),
+			# Python allocations, including other threads' while the ingest ran
+			"peak_kb": max(0, memory_peak - memory_before) // 1024,
+			"retained_kb": max(0, memory_after - memory_before) // 1024,
+			"loaded_at": self.loaded_at,
+			"from_cache": False
+		}
+		print(f"EPG: {count} programmes for {len(guides)} channels in {self.stats['ingest_ms']} ms, "
+			  f"peak {self.stats['peak_kb']} KiB, {self.stats['retained_kb']} KiB kept")
+
+	def _load_cache(self):
+		"""
+		Load the guide saved by a previous run.
+
+		Returns:
+			bool: Whether the cached guide is recent enough to skip the first download.
+		"""
+		if not self.cache_file or not os.path.exists(self.cache_file):
+			return False
+		start = time.monotonic()
+		try:
+			with open(self.cache_file, 'r', encoding='utf-8') as f:
+				cache = json.load(f)
+			if cache.get("source") != self.source:
+				return False
+			self.load_snapshot(cache)
+		except (OSError, ValueError, KeyError, TypeError) as e:
+			print(f"Error loading cached EPG: {e}")
+			return False
+		self.stats = {
+			"source": self.source,
+			"channels": len(self.guides),
+			"programmes": sum(len(guide.starts) for guide in self.guides.values()),
+			"ingest_ms": round((time.monotonic() - start) * 1000),
+			"loaded_at": self.loaded_at,
+			"from_cache": True
+		}
+		print(f"EPG: loaded {self.stats['programmes']} cached programmes in {self.stats['ingest_ms']} ms")
+		return time.time() - self.loaded_at < self.refresh_interval
+
+	def _pull_origin(self):
+		"""
+		Take the parsed guide from the fleet origin.
+
+		Returns:
+			bool: Whether the origin had a guide.
+		"""
+		if not self.origin:
+			return False
+		start = time.monotonic()
+		try:
+			response = requests.get(f"{self.origin}/fleet/epg", timeout=30)
+			if response.status_code == 404:
+				return False
+			response.raise_for_status()
+			self.load_snapshot(response.json())
+		except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+			print(f"EPG: fleet origin {self.origin} unavailable: {e}")
+			return False
+		self.stats = {
+			"source": self.origin,
+			"channels": len(self.guides),
+			"programmes": sum(len(guide.starts) for guide in self.guides.values()),
+			"ingest_ms": round((time.monotonic() - start) * 1000),
+			"loaded_at": self.loaded_at,
+			"from_cache": False
+		}
+		print(f"EPG: {self.stats['programmes']} programmes from {self.origin} in {self.stats['ingest_ms']} ms")
+		return True
+
+	def snapshot(self):
+		"""Get the parsed guide as a JSON-serializable dictionary."""
+		return {
+			"source": self.source,
+			"loaded_at": self.loaded_at,
+			"names": self.names,
+			"guides": {
+				channel_id: [guide.starts.tolist(), guide.stops.tolist(), guide.titles]
+				for channel_id, guide in self.guides.items()
+			}
+		}
+
+	def load_snapshot(self, snapshot):
+		"""Replace the guide with one returned by snapshot()."""
+		guides = {channel_id: ChannelGuide(*columns) for channel_id, columns in snapshot["guides"].items()}
+		self.guides = guides
+		self.names = snapshot["names"]
+		self.loaded_at = snapshot["loaded_at"]
+
+	def _save_cache(self):
+		"""Write the guide to the cache file."""
+		if not self.cache_file:
+			return
+		cache = self.snapshot()
+		try:
+			tmp_file = self.cache_file + ".tmp"
+			with open(tmp_file, 'w', encoding='utf-8') as f:
+				json.dump(cache, f, separators=(',', ':'))
+			os.replace(tmp_file, self.cache_file)
+		except OSError as e:
+			print(f"Error saving EPG cache: {e}")
+
+	def guide_for(self, channel):
+		"""
+		Find the guide of a playlist channel, by tvg-id or by name.
+
+		Args:
+			channel (dict): Channel dictionary.
+
+		Returns:
+			ChannelGuide: The channel's programmes, or None if the guide doesn't list it.
+		"""
+		channel_id = channel.get("tvg_id")
+		if channel_id in self.guides:
+			return self.guides[channel_id]
+		channel_id = self.names.get(channel["name"].strip().lower())
+		return self.guides.get(channel_id)
+
+	def now_next(self, channel, now=None):
+		"""
+		Get the current and next programme of a channel.
+
+		Args:
+			channel (dict): Channel dictionary.
+			now (float, optional): Unix time. Defaults to the current time.
+
+		Returns:
+			dict: "now" and "next" programme dictionaries, or None where unknown.
+		"""
+		guide = self.guide_for(channel)
+		if guide is None:
+			return {"now": None, "next": None}
+		current, following = guide.now_next(time.time() if now is None else now)
+		return {"now": current, "next": following}
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+"""In-process event bus for IPMPV."""
+
+import queue
+import threading
+import time
+
+class EventBus:
+	"""
+	Publish state changes to any number of subscribers.
+
+	Each subscriber gets its own bounded queue; a subscriber that stops
+	reading loses old events instead of blocking the publisher.
+	"""
+
+	def __init__(self, max_pending=100):
+		"""
+		Initialize the event bus.
+
+		Args:
+			max_pending (int): Events kept for a subscriber that is not reading.
+		"""
+		self.max_pending = max_pending
+		self.subscribers = []
+		self.lock = threading.Lock()
+
+	def subscribe(self):
+		"""
+		Subscribe to all events.
+
+		Returns:
+			queue.Queue: Queue that receives event dictionaries.
+		"""
+		subscriber = queue.Queue(maxsize=self.max_pending)
+		with self.lock:
+			self.subscribers.append(subscriber)
+		return subscriber
+
+	def unsubscribe(self, subscriber):
+		"""Stop delivering events to a queue returned by subscribe()."""
+		with self.lock:
+			if subscriber in self.subscribers:
+				self.subscribers.remove(subscriber)
+
+	def publish(self, event, **data):
+		"""
+		Publish an event.
+
+		Args:
+			event (str): Event name, e.g. "retroarch".
+			**data: Event payload.
+		"""
+		message = {"event": event, "time": time.time(), **data}
+		with self.lock:
+			subscribers = list(self.subscribers)
+		for subscriber in subscribers:
+			try:
+				subscriber.put_nowait(message)
+			except queue.Full:
+				# Drop the oldest event to make room
+				try:
+					subscriber.get_nowait()
+					subscriber.put_nowait(message)
+				except (queue.Empty, queue.Full):
+					pass
+
+# Create a global event bus instance
+events = EventBus()
@@ -0,0 +1,422 @@
+#!/usr/bin/python
+"""Fleet mode for IPMPV: one origin fetches the catalog, peers pull snapshots from it."""
+
+import collections
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from channels import get_channels
+
+def catalog_version(channels):
+	"""
+	Get the version of a catalog: a hash of its content.
+
+	Args:
+		channels (list): List of channel dictionaries.
+
+	Returns:
+		str: 16 hex digits, identical for identical catalogs on every node.
+	"""
+	data = json.dumps(channels, sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+def logo_key(url):
+	"""Get the key a logo URL is cached and served under."""
+	return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+def make_delta(base, channels):
+	"""
+	Describe a catalog as edits of an older one.
+
+	Args:
+		base (list): Older catalog the peer has.
+		channels (list): New catalog.
+
+	Returns:
+		list: Operations rebuilding `channels` in order: [start, count] copies
+			channels start..start+count-1 of `base`, a dictionary is a new channel.
+	"""
+	positions = {}
+	for index, channel in enumerate(base):
+		positions.setdefault(json.dumps(channel, sort_keys=True), index)
+	ops = []
+	for channel in channels:
+		index = positions.get(json.dumps(channel, sort_keys=True))
+		if index is None:
+			ops.append(channel)
+		elif ops and isinstance(ops[-1], list) and sum(ops[-1]) == index:
+			ops[-1][1] += 1
+		else:
+			ops.append([index, 1])
+	return ops
+
+def apply_delta(base, ops):
+	"""Rebuild a catalog from an older one and the operations of make_delta()."""
+	channels = []
+	for op in ops:
+		if isinstance(op, list):
+			channels.extend(base[op[0]:op[0] + op[1]])
+		else:
+			channels.append(op)
+	return channels
+
+def sniff_image_type(data):
+	"""Guess the content type of a logo from its first bytes."""
+	if data.startswith(b'\x89PNG'):
+		return 'image/png'
+	if data.startswith(b'\xff\xd8'):
+		return 'image/jpeg'
+	if data.startswith(b'GIF8'):
+		return 'image/gif'
+	if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+		return 'image/webp'
+	if b'<svg' in data[:512]:
+		return 'image/svg+xml'
+	return 'application/octet-stream'
+
+def replace_catalog(server, channels):
+	"""
+	Swap the catalog of a running server, keeping the playing channel.
+
+	Args:
+		server (IPMPVServer): Server to update.
+		channels (list): New list of channel dictionaries.
+	"""
+	player = server.player
+	old = server.channels
+	if player is not None:
+		urls = {channel["url"]: index for index, channel in enumerate(channels)}
+		for attribute in ("current_index", "suspended_index"):
+			index = getattr(player, attribute)
+			if index is not None and index < len(old):
+				setattr(player, attribute, urls.get(old[index]["url"]))
+	server.channels = channels
+	if player is not None and player.health_monitor is not None:
+		player.health_monitor.set_catalog(channels)
+	if server.prober is not None:
+		server.prober.set_catalog(channels)
+
+class FleetOrigin:
+	"""
+	Catalog, logo and guide cache for the other IPMPV nodes of a site.
+
+	The origin downloads the playlist from the provider, and keeps the last
+	few catalog versions so a peer that is one refresh behind gets only a
+	delta. Each snapshot is compressed once and then served from memory.
+	"""
+
+	role = "origin"
+
+	def __init__(self, server, refresh_interval=3600, cache_dir=None, history=8):
+		"""
+		Initialize the origin.
+
+		Args:
+			server (IPMPVServer): Server whose catalog is shared.
+			refresh_interval (float): Seconds between playlist downloads.
+			cache_dir (str, optional): Directory logos are cached in. Without one, logos aren't proxied.
+			history (int): Number of older catalog versions deltas are built against.
+		"""
+		self.server = server
+		self.refresh_interval = refresh_interval
+		self.cache_dir = cache_dir
+		self.lock = threading.Lock()
+		self.versions = collections.OrderedDict()
+		self.history = history
+		self.bodies = {}
+		self.logos = {}
+		self.logo_failures = {}
+		# One download per logo at a time, however many peers ask for it
+		self.logo_locks = collections.defaultdict(threading.Lock)
+		self.session = requests.Session()
+		self.counters = collections.Counter()
+		if cache_dir:
+			os.makedirs(cache_dir, exist_ok=True)
+
+	def start(self):
+		"""Publish the loaded catalog, then refresh it in the background."""
+		self.publish(self.server.channels)
+		threading.Thread(target=self._loop, name="fleet-origin", daemon=True).start()
+
+	def _loop(self):
+		"""Download the playlist periodically."""
+		while True:
+			time.sleep(self.refresh_interval)
+			try:
+				channels = get_channels()
+			except Exception as e:
+				print(f"\033[91mFleet: error refreshing the catalog: {e}\033[0m")
+				continue
+			if not channels:
+				continue
+			if self.publish(channels):
+				replace_catalog(self.server, channels)
+
+	def publish(self, channels):
+		"""
+		Make a catalog the current version.
+
+		Args:
+			channels (list): List of channel dictionaries.
+
+		Returns:
+			bool: Whether it differs from the current version.
+		"""
+		version = catalog_version(channels)
+		with self.lock:
+			if self.versions and next(reversed(self.versions)) == version:
+				return False
+			self.versions[version] = channels
+			self.versions.move_to_end(version)
+			while len(self.versions) > self.history:
+				self.versions.popitem(last=False)
+			self.bodies = {key: body for key, body in self.bodies.items() if key[0] == "epg" or key[0] in self.versions}
+			self.logos = {logo_key(channel["logo"]): channel["logo"] for channel in channels if channel.get("logo")}
+		print(f"Fleet: publishing catalog {version} ({len(channels)} channels)")
+		return True
+
+	def snapshot(self, since=None):
+		"""
+		Get the current catalog for a peer.
+
+		Args:
+			since (str, optional): Version the peer already has.
+
+		Returns:
+			tuple: (version, gzip-compressed JSON body), with a None body if the
+				peer is up to date. The body is a delta if `since` is still known.
+		"""
+		with self.lock:
+			if not self.versions:
+				return None, None
+			version = next(reversed(self.versions))
+			if since == version:
+				self.counters["not_modified"] += 1
+				return version, None
+			base = since if since in self.versions else None
+			body = self.bodies.get((version, base))
+			if body is None:
+				channels = self.versions[version]
+				if base is None:
+					snapshot = {"version": version, "base": None, "channels": channels}
+				else:
+					snapshot = {"version": version, "base": base, "ops": make_delta(self.versions[base], channels)}
+				body = gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'), 6)
+				self.bodies[(version, base)] = body
+		self.counters["deltas" if base else "full"] += 1
+		return version, body
+
+	def logo(self, key):
+		"""
+		Get a channel logo, downloading it from the provider once.
+
+		Args:
+			key (str): Key from logo_key().
+
+		Returns:
+			tuple: (image bytes, content type), or (None, None) if it isn't available.
+		"""
+		url = self.logos.get(key)
+		if not self.cache_dir or url is None:
+			return None, None
+		path = os.path.join(self.cache_dir, key)
+		with self.lock:
+			logo_lock = self.logo_locks[key]
+		with logo_lock:
+			if os.path.exists(path):
+				with open(path, 'rb') as f:
+					data = f.read()
+				self.counters["logo_hits"] += 1
+				return data, sniff_image_type(data)
+			# Don't ask the provider again for an hour after a failure
+			if time.monotonic() - self.logo_failures.get(key, -3600) < 3600:
+				return None, None
+			try:
+				response = self.session.get(url, timeout=10)
+				response.raise_for_status()
+				data = response.content
+			except requests.RequestException as e:
+				self.logo_failures[key] = time.monotonic()
+				print(f"Fleet: error fetching logo {url}: {e}")
+				return None, None
+			tmp_file = path + ".tmp"
+			with open(tmp_file, 'wb') as f:
+				f.write(data)
+			os.replace(tmp_file, path)
+			self.counters["logo_misses"] += 1
+			return data, sniff_image_type(data)
+
+	def epg_snapshot(self):
+		"""
+		Get the programme guide for a peer.
+
+		Returns:
+			tuple: (version, gzip-compressed JSON body), or (None, None) without a guide.
+		"""
+		guide = self.server.player.epg if self.server.player is not None else None
+		if guide is None or guide.loaded_at is None:
+			return None, None
+		version = str(int(guide.loaded_at))
+		key = ("epg", version)
+		with self.lock:
+			body = self.bodies.get(key)
+		if body is None:
+			body = gzip.compress(json.dumps(guide.snapshot(), separators=(',', ':')).encode('utf-8'), 6)
+			with self.lock:
+				self.bodies = {k: v for k, v in self.bodies.items() if k[0] != "epg"}
+				self.bodies[key] = body
+		self.counters["epg"] += 1
+		return version, body
+
+	def metrics(self):
+		"""Get the published versions and request counters."""
+		with self.lock:
+			versions = list(self.versions)
+		return {
+			"role": self.role,
+			"version": versions[-1] if versions else None,
+			"versions": versions,
+			"cached_bodies": len(self.bodies),
+			"counters": dict(self.counters)
+		}
+
+class FleetPeer:
+	"""
+	Node that takes its catalog from a fleet origin.
+
+	The peer polls the origin for newer versions and applies the deltas it
+	gets. When the origin can't be reached at startup, the catalog comes from
+	the provider instead, and the peer switches back on the next poll the
+	origin answers.
+	"""
+
+	role = "peer"
+
+	def __init__(self, origin, interval=300, timeout=10):
+		"""
+		Initialize the peer.
+
+		Args:
+			origin (str): Base URL of the origin, e.g. "http://10.0.0.2:5000".
+			interval (float): Seconds between polls.
+			timeout (float): Seconds to wait for the origin.
+		"""
+		self.origin = origin.rstrip('/')
+		self.interval = interval
+		self.timeout = timeout
+		self.session = requests.Session()
+		self.version = None
+		self.channels = None
+		self.last_sync = None
+		self.last_error = None
+		self.counters = collections.Counter()
+
+	def fetch(self):
+		"""
+		Get the catalog from the origin if it has a newer one.
+
+		Returns:
+			list: Channel dictionaries with logos served by the origin, or None
+				if the catalog is unchanged or the origin can't be reached.
+		"""
+		start = time.monotonic()
+		try:
+			response = self.session.get(f"{self.origin}/fleet/catalog",
+										params={"since": self.version} if self.version else None,
+										timeout=self.timeout)
+			if response.status_code == 304:
+				self.last_sync = time.time()
+				return None
+			response.raise_for_status()
+			snapshot = response.json()
+		except (requests.RequestException, ValueError) as e:
+			self.counters["errors"] += 1
+			self.last_error = str(e)
+			print(f"Fleet: origin {self.origin} unavailable: {e}")
+			return None
+
+		if snapshot.get("base") is None:
+			channels = snapshot["channels"]
+		elif snapshot["base"] == self.version:
+			channels = apply_delta(self.channels, snapshot["ops"])
+		else:
+			channels = None
+		if channels is None or catalog_version(channels) != snapshot["version"]:
+			self.counters["mismatches"] += 1
+			if snapshot.get("base") is None:
+				self.last_error = "snapshot doesn't match its version"
+				print(f"Fleet: {self.last_error}")
+				return None
+			# Start over from a full snapshot
+			self.version = None
+			return self.fetch()
+
+		self.counters["deltas" if snapshot.get("base") else "full"] += 1
+		self.version = snapshot["version"]
+		self.channels = channels
+		self.last_sync = time.time()
+		self.last_error = None
+		print(f"Fleet: catalog {self.version} from {self.origin} ({len(channels)} channels, "
+			  f"{len(response.content)} bytes, {round((time.monotonic() - start) * 1000)} ms)")
+		return [
+			dict(channel, logo=f"{self.origin}/fleet/logo/{logo_key(channel['logo'])}") if channel.get("logo") else channel
+			for channel in channels
+		]
+
+	def start(self, on_update):
+		"""
+		Poll the origin in the background.
+
+		Args:
+			on_update (callable): Called with the new channel list when the catalog changes.
+		"""
+		def loop():
+			while True:
+				time.sleep(self.interval)
+				channels = self.fetch()
+				if channels is not None:
+					on_update(channels)
+
+		threading.Thread(target=loop, name="fleet-peer", daemon=True).start()
+
+	def metrics(self):
+		"""Get the synced version and request counters."""
+		return {
+			"role": self.role,
+			"origin": self.origin,
+			"version": self.version,
+			"last_sync": self.last_sync,
+			"last_error": self.last_error,
+			"counters": dict(self.counters)
+		}
+
+def _benchmark(source):
+	"""Compare the size of a playlist with its full and delta snapshots."""
+	start = time.monotonic()
+	channels = get_channels([source])
+	parse_ms = (time.monotonic() - start) * 1000
+	with open(source, 'rb') as f:
+		raw = f.read()
+
+	changed = [dict(channel, name=channel["name"] + " HD") if i % 100 == 0 else channel
+			   for i, channel in enumerate(channels)]
+	full = gzip.compress(json.dumps({"channels": changed}, separators=(',', ':')).encode('utf-8'), 6)
+	start = time.monotonic()
+	ops = make_delta(channels, changed)
+	delta_ms = (time.monotonic() - start) * 1000
+	delta = gzip.compress(json.dumps({"ops": ops}, separators=(',', ':')).encode('utf-8'), 6)
+	start = time.monotonic()
+	assert catalog_version(apply_delta(channels, ops)) == catalog_version(changed)
+	apply_ms = (time.monotonic() - start) * 1000
+
+	print(f"playlist:       {len(raw):>10} bytes, parsed in {parse_ms:.0f} ms")
+	print(f"full snapshot:  {len(full):>10} bytes")
+	print(f"delta (1% new): {len(delta):>10} bytes, built in {delta_ms:.0f} ms, applied and checked in {apply_ms:.0f} ms")
+
+if __name__ == "__main__":
+	import sys
+	_benchmark(sys.argv[1])
@@ -1,43 +1,112 @@
 import os
 import json
-from flask import request, make_response
+import hashlib
+import threading
+import time
+from flask import request, make_response, g, has_request_context
 
 class Localization:
 	"""Handles localization for IPMPV"""
 
-	def __init__(self, default_language='en'):
-		"""Initialize the localization system"""
+	def __init__(self, default_language='en', reload_interval=2, locales_dir=None):
+		"""
+		Initialize the localization system
+
+		Args:
+			default_language (str): Language used when nothing else matches
+			reload_interval (float): Minimum seconds between checks for changed locale files
+			locales_dir (str, optional): Directory of the translation files, locales/ next to this file by default
+		"""
 		self.default_language = default_language
+		self.reload_interval = reload_interval
+		self.locales_dir = locales_dir or os.path.join(os.path.dirname(__file__), 'locales')
 		self.translations = {}
+		self.versions = {}
+		self.mtimes = {}
+		self.last_checked = {}
 		self.available_languages = []
+		self.dir_mtime = None
+		self.dir_checked = 0
+		self.lock = threading.Lock()
 		self.cookie_name = 'ipmpv_language'
 		self.cookie_max_age = 31536000  # 1 year in seconds
-		self._load_translations()
-
-	def _load_translations(self):
-		"""Load all translation files from the locales directory"""
-		locales_dir = os.path.join(os.path.dirname(__file__), 'locales')
+		self._scan_languages()
 
+	def _scan_languages(self):
+		"""List the available translation files. They are only loaded when first used."""
 		# Create locales directory if it doesn't exist
-		if not os.path.exists(locales_dir):
-			os.makedirs(locales_dir)
-
-		# Load each translation file
-		for filename in os.listdir(locales_dir):
-			if filename.endswith('.json'):
-				language_code = filename.split('.')[0]
-				self.available_languages.append(language_code)
-
-				with open(os.path.join(locales_dir, filename), 'r', encoding='utf-8') as f:
-					self.translations[language_code] = json.load(f)
-
-		# If no translations are available, create an empty one for the default language
-		if not self.translations:
+		if not os.path.exists(self.locales_dir):
+			os.makedirs(self.locales_dir)
+
+		self.dir_mtime = os.stat(self.locales_dir).st_mtime
+		self.dir_checked = time.monotonic()
+		self.available_languages = sorted(
+			filename[:-len('.json')] for filename in os.listdir(self.locales_dir)
+			if filename.endswith('.json')
+		)
+
+		# If no translations are available, use an empty one for the default language
+		if not self.available_languages:
 			self.available_languages.append(self.default_language)
 			self.translations[self.default_language] = {}
 
+	def _rescan_if_changed(self):
+		"""Pick up translation files added or removed while running"""
+		now = time.monotonic()
+		if now - self.dir_checked < self.reload_interval:
+			return
+		self.dir_checked = now
+		try:
+			if os.stat(self.locales_dir).st_mtime != self.dir_mtime:
+				self._scan_languages()
+		except OSError:
+			pass
+
+	def _get_translations(self, language):
+		"""
+		Get the translations for a language, loading the file on first use and
+		reloading it when it changes on disk.
+		"""
+		now = time.monotonic()
+		if language in self.translations and now - self.last_checked.get(language, 0) < self.reload_interval:
+			return self.translations[language]
+
+		path = os.path.join(self.locales_dir, f'{language}.json')
+		with self.lock:
+			self.last_checked[language] = now
+			try:
+				mtime = os.stat(path).st_mtime
+			except OSError:
+				return self.translations.setdefault(language, {})
+			if self.mtimes.get(language) != mtime:
+				try:
+					with open(path, 'rb') as f:
+						data = f.read()
+					self.translations[language] = json.loads(data.decode('utf-8'))
+					self.versions[language] = hashlib.sha1(data).hexdigest()[:12]
+					self.mtimes[language] = mtime
+					if language not in self.available_languages:
+						self.available_languages.append(language)
+				except (OSError, ValueError) as e:
+					print(f"Error loading translations for '{language}': {e}")
+					self.translations.setdefault(language, {})
+			return self.translations[language]
+
 	def get_language(self):
 		"""Get the current language based on cookies or browser settings"""
+		# Resolve the language only once per request
+		if has_request_context() and 'ipmpv_language' in g:
+			return g.ipmpv_language
+
+		language = self._resolve_language()
+		if has_request_context():
+			g.ipmpv_language = language
+		return language
+
+	def _resolve_language(self):
+		"""Pick the language from the request cookie or the browser settings"""
+		self._rescan_if_changed()
+
 		# Check cookie first
 		lang_cookie = request.cookies.get(self.cookie_name)
 		if lang_cookie and lang_cookie in self.available_languages:
@@ -77,22 +146,47 @@ class Localization:
 			return True
 		return False
 
+	def get_bundle(self, language):
+		"""
+		Get every translation for a language, with missing keys filled in from
+		the default language
+
+		Returns:
+			tuple: (translations dict, version string), or (None, None) if the language doesn't exist
+		"""
+		if language not in self.available_languages:
+			return None, None
+		bundle = dict(self._get_translations(self.default_language))
+		bundle.update(self._get_translations(language))
+		version = self.versions.get(language, '')
+		if language != self.default_language:
+			version += self.versions.get(self.default_language, '')[:4]
+		return bundle, version
+
+	def get_bundle_url(self, language):
+		"""Get the versioned URL of a language bundle"""
+		_, version = self.get_bundle(language)
+		return f'/locales/{language}.json?v={version}'
+
 	def translate(self, key, language=None):
 		"""Translate a key to the specified or current language"""
 		if language is None:
 			language = self.get_language()
 
 		# If the language doesn't exist, use default
-		if language not in self.translations:
+		if language not in self.available_languages:
 			language = self.default_language
 
 		# If the key exists in the language, return the translation
-		if key in self.translations[language]:
-			return self.translations[language][key]
+		translations = self._get_translations(language)
+		if key in translations:
+			return translations[key]
 
 		# If not found in the current language, try the default language
-		if language != self.default_language and key in self.translations[self.default_language]:
-			return self.translations[self.default_language][key]
+		if language != self.default_language:
+			default_translations = self._get_translations(self.default_language)
+			if key in default_translations:
+				return default_translations[key]
 
 		# If still not found, return the key itself
 		return key
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+"""Log pipeline for IPMPV."""
+
+import collections
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+# mpv log levels, most severe first
+LEVELS = ('fatal', 'error', 'warn', 'info', 'v', 'debug', 'trace')
+LEVEL_RANK = {level: rank for rank, level in enumerate(LEVELS)}
+
+ANSI_ESCAPE_RE = re.compile(r'\033\[[0-9;]*m')
+
+def parse_log_levels(spec, default='info'):
+	"""
+	Parse per-component log levels, in mpv's msg-level syntax.
+
+	Args:
+		spec (str): E.g. "all=warn,ffmpeg=error,cplayer=info". May be empty.
+		default (str): Level of components the spec doesn't name.
+
+	Returns:
+		dict: Component name to level. "all" holds the default.
+	"""
+	levels = {'all': default}
+	for item in (spec or '').split(','):
+		component, _, level = item.strip().partition('=')
+		if level in LEVEL_RANK or level == 'no':
+			levels[component] = level
+		elif item.strip():
+			print(f"Ignoring invalid log level: {item}")
+	return levels
+
+class LogPipeline:
+	"""
+	Non-blocking log sink.
+
+	Producers (the mpv log callback, and everything printed once the output
+	is captured) only put a tuple on a SimpleQueue, which doesn't take any
+	Python-level lock. A background thread formats the messages, keeps the
+	most recent ones in a ring buffer and appends them to a size-rotated
+	file, so a slow SD card never stalls the player or the web server.
+	"""
+
+	def __init__(self, ring_size=2000, max_pending=10000):
+		"""
+		Initialize the pipeline.
+
+		Args:
+			ring_size (int): Number of recent messages kept in memory.
+			max_pending (int): Messages allowed to wait for the writer before
+				verbose ones are dropped.
+		"""
+		self.queue = queue.SimpleQueue()
+		self.ring = collections.deque(maxlen=ring_size)
+		self.max_pending = max_pending
+		self.mpv_levels = {'all': 'info'}
+		self.path = None
+		self.max_bytes = 0
+		self.backups = 0
+		self.file = None
+		self.running = False
+		self.counters = collections.Counter()
+		self.dropped = 0
+		self.output = sys.__stdout__
+
+	def configure(self, path=None, max_bytes=5 * 1024 * 1024, backups=3, mpv_levels=None):
+		"""
+		Set where and what to log.
+
+		Args:
+			path (str, optional): Log file. Without one, messages go to the original stdout.
+			max_bytes (int): Size at which the log file is rotated.
+			backups (int): Number of rotated files kept.
+			mpv_levels (str, optional): Per-component mpv levels, see parse_log_levels().
+		"""
+		self.path = path
+		self.max_bytes = max_bytes
+		self.backups = backups
+		if mpv_levels is not None:
+			self.mpv_levels = parse_log_levels(mpv_levels)
+
+	def mpv_loglevel(self):
+		"""
+		Get the level to request log messages from mpv at.
+
+		"terminal-default" makes mpv filter by its msg-level option, see
+		mpv_msg_level(), so messages of quiet components are never produced.
+		"""
+		if not any(level in LEVEL_RANK for level in self.mpv_levels.values()):
+			return 'no'
+		return 'terminal-default'
+
+	def mpv_msg_level(self):
+		"""Get mpv's msg-level option for the configured levels, "all" first so components override it."""
+		levels = [f"all={self.mpv_levels['all']}"]
+		levels += [f"{component}={level}" for component, level in self.mpv_levels.items() if component != 'all']
+		return ','.join(levels)
+
+	def start(self, capture_output=True):
+		"""
+		Start the writer thread.
+
+		Args:
+			capture_output (bool): Route print() output and tracebacks through the pipeline.
+		"""
+		if self.running:
+			return
+		self.running = True
+		if self.path:
+			self.file = open(self.path, 'a', encoding='utf-8')
+		threading.Thread(target=self._writer, name="log-writer", daemon=True).start()
+		if capture_output:
+			sys.stdout = _OutputCapture(self, 'stdout', 'info')
+			sys.stderr = _OutputCapture(self, 'stderr', 'error')
+
+	def log(self, source, level, message):
+		"""
+		Queue a message.
+
+		Args:
+			source (str): Where the message comes from, e.g. "mpv/ffmpeg" or "stdout".
+			level (str): One of LEVELS.
+			message (str): The message, without a trailing newline.
+		"""
+		if LEVEL_RANK.get(level, 3) > LEVEL_RANK['info'] and self.queue.qsize() > self.max_pending:
+			self.dropped += 1
+			return
+		self.queue.put((time.time(), source, level, message))
+
+	def mpv(self, level, component, message):
+		"""Log handler for libmpv. mpv filters messages by its msg-level option before they get here."""
+		self.log(f"mpv/{component}", level, message.rstrip('\n'))
+
+	def _writer(self):
+		"""Move queued messages to the ring buffer and the log file."""
+		while True:
+			batch = [self.queue.get()]
+			# Write whatever else is waiting in one go
+			try:
+				while len(batch) < 500:
+					batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+
+			lines = []
+			for timestamp, source, level, message in batch:
+				self.ring.append({"time": timestamp, "source": source, "level": level, "message": message})
+				self.counters[level] += 1
+				stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+				lines.append(f"{stamp}.{int(timestamp % 1 * 1000):03d} [{level}] {source}: {message}\n")
+			self._write(''.join(lines))
+
+	def _write(self, text):
+		"""Append to the log file, rotating it when it gets too big."""
+		try:
+			if self.file is None:
+				self.output.write(text)
+				self.output.flush()
+				return
+			if self.max_bytes and 0 < self.file.tell() and self.file.tell() + len(text) > self.max_bytes:
+				self._rotate()
+			self.file.write(text)
+			self.file.flush()
+		except (OSError, ValueError) as e:
+			sys.__stderr__.write(f"Error writing log: {e}\n")
+
+	def _rotate(self):
+		"""Shift ipmpv.log to ipmpv.log.1, ipmpv.log.1 to ipmpv.log.2, and so on."""
+		self.file.close()
+		for i in range(self.backups - 1, 0, -1):
+			if os.path.exists(f"{self.path}.{i}"):
+				os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+		if self.backups:
+			os.replace(self.path, f"{self.path}.1")
+		else:
+			os.remove(self.path)
+		self.file = open(self.path, 'a', encoding='utf-8')
+
+	def recent(self, limit=200, level=None, source=None):
+		"""
+		Get the most recent messages.
+
+		Args:
+			limit (int): Maximum number of messages.
+			level (str, optional): Only messages at this level or more severe.
+			source (str, optional): Only messages whose source starts with this.
+
+		Returns:
+			list: Message dictionaries, oldest first.
+		"""
+		entries = list(self.ring)
+		if level in LEVEL_RANK:
+			entries = [entry for entry in entries if LEVEL_RANK.get(entry["level"], 3) <= LEVEL_RANK[level]]
+		if source:
+			entries = [entry for entry in entries if entry["source"].startswith(source)]
+		return entries[-limit:] if limit > 0 else []
+
+	def stats(self):
+		"""Get message counts per level, the backlog and the mpv levels in use."""
+		return {
+			"counts": dict(self.counters),
+			"pending": self.queue.qsize(),
+			"dropped": self.dropped,
+			"file": self.path,
+			"mpv_levels": self.mpv_levels
+		}
+
+class _OutputCapture:
+	"""File-like object that sends complete printed lines to the pipeline."""
+
+	def __init__(self, pipeline, source, level):
+		self.pipeline = pipeline
+		self.source = source
+		self.level = level
+		# print() writes the text and the newline separately, so each thread
+		# builds its own line; a shared buffer would mix lines from threads
+		self.local = threading.local()
+
+	def write(self, text):
+		lines = (getattr(self.local, 'partial', '') + text).split('\n')
+		self.local.partial = lines.pop()
+		for line in lines:
+			if line:
+				# Errors are printed in red throughout IPMPV
+				level = 'error' if line.startswith('\033[91m') else self.level
+				self.pipeline.log(self.source, level, ANSI_ESCAPE_RE.sub('', line))
+		return len(text)
+
+	def flush(self):
+		pass
+
+	def isatty(self):
+		return False
+
+# Create a global log pipeline
+logs = LogPipeline()
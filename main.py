@@ -1,68 +1,260 @@
 #!/usr/bin/python
 """Entry point for IPMPV."""
 
+import time
+process_start = time.monotonic()
+
 import multiprocessing
-from multiprocessing import Queue
+import os
 import sys
 
 # Set up utils first
-from utils import setup_environment, get_current_resolution, ipmpv_retroarch_cmd
+from utils import setup_environment, ipmpv_retroarch_cmd, m3u_url, auto_mode, mode_overrides_file, adaptive_buffer, buffer_min, buffer_max, buffer_state_file, stream_health, stall_timeout, probe_channels, probe_workers, probe_rate, probe_interval, epg_url, epg_cache_file, state_file, resume_last_channel, log_file, log_max_bytes, log_backups, mpv_log_levels, control_socket, control_udp, fleet_role, fleet_origin, fleet_interval, fleet_refresh, fleet_cache_dir, http_port, timeshift_enabled, timeshift_dir, timeshift_max_mb, timeshift_max_secs, recordings_dir, record_max_concurrent, record_bandwidth_mbps, record_io_mbps, record_segment_secs
+from logs import logs
 
 # Initialize environment
 setup_environment()
 
-# Set up channel data
-from channels import get_channels
+from startup import StagedStartup
 
-# Import remaining modules
-from player import Player
-from server import IPMPVServer
-from qt_process import qt_process
-from volume import VolumeControl
+# Everything below this point only runs in the web/player process. The OSD
+# process is spawned from a fresh interpreter which re-imports this module,
+# so the module level above must stay free of heavy imports.
 
 def main():
 	"""Main entry point for IPMPV."""
+	if not m3u_url:
+		print("Error: IPMPV_M3U_URL not set. Please set this environment variable to the URL of your IPTV list, in M3U format.")
+		sys.exit(1)
+
+	# From here on, everything printed goes through the non-blocking log pipeline
+	logs.configure(path=log_file, max_bytes=log_max_bytes, backups=log_backups, mpv_levels=mpv_log_levels)
+	logs.start()
+
+	startup = StagedStartup(t0=process_start)
+
+	import_start = time.monotonic()
+	from server import IPMPVServer
+	startup.mark("imports", started=import_start)
+
+	# Spawn the OSD process instead of forking it, so it does not inherit the
+	# Flask/mpv state of this process and this process never loads Qt.
+	mp_context = multiprocessing.get_context("spawn")
+
 	# Create communication queues
-	to_qt_queue = Queue()
-	from_qt_queue = Queue()
-	
-	# Get initial data
-	channels = get_channels()
-	resolution = get_current_resolution()
-	
-	# Initialize player
-	player = Player(to_qt_queue)
-
-	# Initialize volume control
-	volume_control = VolumeControl(to_qt_queue=to_qt_queue)
-	
-	# Start Qt process
-	qt_proc = multiprocessing.Process(
-		target=qt_process,
-		args=(to_qt_queue, from_qt_queue),
-		daemon=True
-	)
-	qt_proc.start()
-	
-	# Start Flask server
+	to_qt_queue = mp_context.Queue()
+	from_qt_queue = mp_context.Queue()
+
+	# The server starts empty and every subsystem is attached to it as soon
+	# as its startup stage finishes.
 	server = IPMPVServer(
-		channels=channels,
-		player=player,
+		channels=[],
+		player=None,
 		to_qt_queue=to_qt_queue,
 		from_qt_queue=from_qt_queue,
-		resolution=resolution,
+		display=None,
 		ipmpv_retroarch_cmd=ipmpv_retroarch_cmd,
-		volume_control=volume_control
+		volume_control=None,
+		startup=startup
 	)
-	
+
+	def load_catalog():
+		from channels import get_channels
+		if fleet_role == "peer" and fleet_origin:
+			from fleet import FleetPeer
+			server.fleet = FleetPeer(fleet_origin, interval=fleet_interval)
+			channels = server.fleet.fetch()
+			if channels:
+				server.channels = channels
+				return len(channels)
+			print("Fleet: loading the playlist from the provider instead")
+		server.channels = get_channels()
+		return len(server.channels)
+
+	def load_display():
+		from display import DisplayBackend
+		display = DisplayBackend()
+		display.refresh()
+		display.start_watcher()
+		server.display = display
+		return display.get_mode()
+
+	def load_player():
+		from player import Player
+		server.player = Player(to_qt_queue)
+
+	def load_mixer():
+		from volume import VolumeControl
+		server.volume_control = VolumeControl(to_qt_queue=to_qt_queue)
+
+	def load_osd():
+		from qt_process import qt_process
+		qt_proc = mp_context.Process(
+			target=qt_process,
+			args=(to_qt_queue, from_qt_queue),
+			daemon=True
+		)
+		qt_proc.start()
+		return qt_proc
+
+	def load_mode_policy():
+		from modematch import ModeMatchPolicy
+		policy = ModeMatchPolicy(server.display, overrides_file=mode_overrides_file)
+		policy.on_switch = server.player.on_output_mode
+		server.player.mode_policy = policy
+
+	def load_buffer_controller():
+		from buffering import AdaptiveBuffer
+		controller = AdaptiveBuffer(server.player, min_secs=buffer_min, max_secs=buffer_max, state_file=buffer_state_file)
+		controller.start()
+		server.player.buffer_controller = controller
+
+	def load_health_monitor():
+		from streamhealth import StreamHealthMonitor
+		monitor = StreamHealthMonitor(server.player, stall_secs=stall_timeout)
+		monitor.set_catalog(server.channels)
+		server.player.health_monitor = monitor
+
+	def load_prober():
+		from prober import ChannelProber
+		prober = ChannelProber(server.player, workers=probe_workers, rate=probe_rate, interval=probe_interval)
+		prober.set_catalog(server.channels)
+		prober.start()
+		server.prober = prober
+		if server.player.health_monitor is not None:
+			server.player.health_monitor.prober = prober
+
+	def load_epg():
+		from epg import EPG
+		guide = EPG(epg_url, cache_file=epg_cache_file, origin=fleet_origin if fleet_role == "peer" else None)
+		guide.start()
+		server.player.epg = guide
+
+	def load_state():
+		from state import StateStore
+		server.state = StateStore(state_file)
+
+	def resume_session():
+		# Runs as soon as the player is up, without waiting for the catalog
+		# or the web UI: the saved channel carries everything needed to tune it
+		state = server.state
+		player = server.player
+		player.state = state
+		if state.get("deinterlace") and not player.deinterlace:
+			player.toggle_deinterlace()
+		if state.get("profile") in player.profiles:
+			player.set_profile(state.get("profile"))
+		saved = state.get("last_channel")
+		if not resume_last_channel or not saved or player.current_index is not None:
+			return None
+		if not player.play_saved_channel(saved):
+			return None
+		first_picture_ms = round((time.monotonic() - process_start) * 1000)
+		print(f"First picture {first_picture_ms} ms after launch ({saved['name']})")
+		return first_picture_ms
+
+	def locate_resumed_channel():
+		# The resumed channel was tuned on its own; find its place in the catalog
+		player = server.player
+		saved = player.resumed_channel
+		if saved is None or player.current_index is not None:
+			return
+		index = server.state.find_channel(server.channels, saved)
+		# Unless the viewer tuned something else in the meantime
+		if player.resumed_channel is saved:
+			player.current_index = index
+			player.resumed_channel = None
+
+	def restore_volume():
+		volume = server.state.get("volume")
+		muted = server.state.get("muted")
+		if volume is None and muted is None:
+			return
+		try:
+			server.volume_control.set_volume(volume, muted, show_osd=False)
+		except Exception as e:
+			# Some mixers can't mute; the rest of the startup doesn't depend on it
+			print(f"\033[91mCould not restore the volume: {e}\033[0m")
+
+	def load_fleet():
+		from fleet import FleetOrigin, replace_catalog
+		if fleet_role == "origin":
+			server.fleet = FleetOrigin(server, refresh_interval=fleet_refresh, cache_dir=fleet_cache_dir)
+			server.fleet.start()
+		else:
+			server.fleet.start(lambda channels: replace_catalog(server, channels))
+
+	def load_timeshift():
+		from timeshift import Timeshift
+		server.player.timeshift = Timeshift(server.player, timeshift_dir,
+											max_bytes=timeshift_max_mb * 1024 * 1024, max_secs=timeshift_max_secs)
+
+	def load_recorder():
+		from recorder import RecordingScheduler
+		# Budgets are given in megabits and megabytes per second
+		scheduler = RecordingScheduler(
+			server.player, recordings_dir,
+			max_concurrent=record_max_concurrent,
+			bandwidth=record_bandwidth_mbps * 1000000 / 8,
+			io_rate=record_io_mbps * 1024 * 1024,
+			segment_secs=record_segment_secs,
+			schedule_file=os.path.join(recordings_dir, "schedule.json")
+		)
+		scheduler.start()
+		server.recorder = scheduler
+
+	def load_control():
+		from control import ControlSocket
+		udp_address = None
+		if control_udp:
+			host, _, port = control_udp.rpartition(':')
+			udp_address = (host or '127.0.0.1', int(port))
+		control = ControlSocket(server, control_socket, udp_address=udp_address)
+		control.start()
+		server.control = control
+
+	startup.add("catalog", load_catalog)
+	startup.add("display", load_display)
+	startup.add("player", load_player)
+	startup.add("mixer", load_mixer)
+	startup.add("osd", load_osd)
+	startup.add("state", load_state)
+	startup.add("resume", resume_session, after=("player", "state"))
+	startup.add("resume_index", locate_resumed_channel, after=("resume", "catalog"))
+	startup.add("volume", restore_volume, after=("mixer", "state"))
+	if control_socket:
+		startup.add("control", load_control)
+	if auto_mode:
+		startup.add("modematch", load_mode_policy, after=("player", "display"))
+	if adaptive_buffer:
+		startup.add("buffering", load_buffer_controller, after=("player",))
+	if stream_health:
+		startup.add("health", load_health_monitor, after=("player", "catalog"))
+	if probe_channels:
+		startup.add("liveness", load_prober, after=("player", "catalog") + (("health",) if stream_health else ()))
+	if timeshift_enabled:
+		startup.add("timeshift", load_timeshift, after=("player",))
+	if recordings_dir:
+		startup.add("recorder", load_recorder, after=("player", "catalog"))
+	if epg_url:
+		startup.add("epg", load_epg, after=("player",))
+	if fleet_role == "origin" or (fleet_role == "peer" and fleet_origin):
+		# Catalog updates are handed to the stages that index the catalog
+		startup.add("fleet", load_fleet, after=("player", "catalog")
+					+ (("health",) if stream_health else ()) + (("liveness",) if probe_channels else ()))
+	startup.start()
+
 	try:
 		# Run the Flask server (this will block)
-		server.run(host="0.0.0.0", port=5000)
+		server.run(host="0.0.0.0", port=http_port)
 	except KeyboardInterrupt:
 		print("Shutting down...")
 	finally:
 		# Clean up
-		if qt_proc.is_alive():
+		if server.state is not None:
+			server.state.flush()
+		qt_proc = startup.stages["osd"]["result"]
+		if qt_proc is not None and qt_proc.is_alive():
 			qt_proc.terminate()
 			qt_proc.join(timeout=1)
 		sys.exit(0)
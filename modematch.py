@@ -0,0 +1,176 @@
+#!/usr/bin/python
+"""Automatic display mode matching for IPMPV."""
+
+import json
+import os
+import threading
+import time
+from display import MODES
+
+class ModeMatchPolicy:
+	"""
+	Pick the output mode from the characteristics of the playing source.
+
+	Low-resolution progressive sources (240p/288p) are sent out as such
+	instead of being scaled to 480i/576i and deinterlaced, and interlaced SD
+	sources go out on the interlaced mode of their standard. A new mode only
+	takes effect after it has been stable for `settle` seconds and at least
+	`hold` seconds after the previous switch, so fast zapping does not make
+	the display flap. Per-channel overrides take precedence.
+	"""
+
+	def __init__(self, display, overrides_file=None, settle=3, hold=10):
+		"""
+		Initialize the policy.
+
+		Args:
+			display (DisplayBackend): Backend used to switch modes.
+			overrides_file (str, optional): JSON file mapping channel names to a mode or "off".
+			settle (float): Seconds a new decision must stay the same before it is applied.
+			hold (float): Minimum seconds between two mode switches.
+		"""
+		self.display = display
+		self.overrides_file = overrides_file
+		self.settle = settle
+		self.hold = hold
+		self.overrides = {}
+		self.last_switch = 0
+		self.candidate = None
+		self.timer = None
+		# Called with the new mode once a switch has actually happened
+		self.on_switch = None
+		self.lock = threading.Lock()
+		self._load_overrides()
+
+	def _load_overrides(self):
+		"""Load per-channel overrides from disk."""
+		if not self.overrides_file or not os.path.exists(self.overrides_file):
+			return
+		try:
+			with open(self.overrides_file, 'r', encoding='utf-8') as f:
+				self.overrides = json.load(f)
+		except (OSError, ValueError) as e:
+			print(f"Error loading mode overrides: {e}")
+
+	def set_override(self, channel_name, mode):
+		"""
+		Set or clear the override for a channel.
+
+		Args:
+			channel_name (str): Name of the channel.
+			mode (str): One of the display modes, "off" to never switch for this
+				channel, or None to go back to automatic matching.
+
+		Returns:
+			bool: Whether the override was accepted.
+		"""
+		if mode is not None and mode != "off" and mode not in MODES:
+			return False
+		with self.lock:
+			if mode is None:
+				self.overrides.pop(channel_name, None)
+			else:
+				self.overrides[channel_name] = mode
+			overrides = dict(self.overrides)
+		if self.overrides_file:
+			try:
+				tmp_file = self.overrides_file + ".tmp"
+				with open(tmp_file, 'w', encoding='utf-8') as f:
+					json.dump(overrides, f, indent=2)
+				os.replace(tmp_file, self.overrides_file)
+			except OSError as e:
+				print(f"Error saving mode overrides: {e}")
+		return True
+
+	def choose_mode(self, height, interlaced, fps=None):
+		"""
+		Choose the output mode that best matches a source.
+
+		Args:
+			height (int): Source height in lines.
+			interlaced (bool): Whether the source is interlaced.
+			fps (float, optional): Source frame rate, used to tell 525 and 625 line
+				standards apart for HD sources.
+
+		Returns:
+			str: One of the display modes, or None if the source is unknown.
+		"""
+		if not height:
+			return None
+		if fps:
+			pal = abs(fps - 25) < 1 or abs(fps - 50) < 1
+		else:
+			pal = 260 < height <= 300 or 500 < height <= 600
+		if height <= 300 and not interlaced:
+			return "288p" if pal else "240p"
+		return "576i" if pal else "480i"
+
+	def observe(self, channel_name, height, interlaced, fps=None):
+		"""
+		Feed the characteristics of a freshly tuned source to the policy.
+
+		Args:
+			channel_name (str): Name of the channel, or None for custom URLs.
+			height (int): Source height in lines.
+			interlaced (bool): Whether the source is interlaced.
+			fps (float, optional): Source frame rate.
+
+		Returns:
+			str: The mode the output is heading to, or None if it will not change.
+		"""
+		override = self.overrides.get(channel_name) if channel_name else None
+		if override == "off":
+			return None
+		mode = override or self.choose_mode(height, interlaced, fps)
+		if mode is None:
+			return None
+
+		with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			if mode == (self.display.pending_mode or self.display.get_mode()):
+				self.candidate = None
+				return mode
+
+			self.candidate = mode
+			delay = max(self.settle, self.last_switch + self.hold - time.monotonic())
+			self.timer = threading.Timer(delay, self._apply, args=(mode,))
+			self.timer.daemon = True
+			self.timer.start()
+		print(f"Mode match: {height}{'i' if interlaced else 'p'} source on {channel_name}, switching to {mode} in {delay:.1f} s")
+		return mode
+
+	def _apply(self, mode):
+		"""Apply a decision that survived the settle time."""
+		with self.lock:
+			if self.candidate != mode:
+				return
+			self.candidate = None
+			self.timer = None
+			self.last_switch = time.monotonic()
+		self.display.request_mode(mode, callback=self.on_switch)
+
+	def needs_deinterlace(self, mode, interlaced, height=None):
+		"""
+		Check whether a source still has to be deinterlaced on a mode.
+
+		Interlaced sources on an interlaced mode with the same line count are
+		sent out field by field; any scaling mixes the fields, so they need
+		deinterlacing. Progressive sources never need it.
+
+		Args:
+			mode (str): Output mode in use.
+			interlaced (bool): Whether the source is interlaced.
+			height (int, optional): Source height in lines.
+
+		Returns:
+			bool: True if deinterlacing is useful for this source and mode.
+		"""
+		if not interlaced:
+			return False
+		if mode not in MODES or not MODES[mode]["interlaced"] or not height:
+			return True
+		lines = int(MODES[mode]["size"].split("x")[1])
+		# Allow for the few lines some SD sources crop or pad
+		return abs(height - lines) > 16
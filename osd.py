@@ -3,6 +3,7 @@
 
 import os
 import requests
+import time
 import traceback
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
@@ -19,6 +20,10 @@ class OsdWidget(QWidget):
 
         super().__init__()
 
+        # Make room for the now/next lines
+        if channel_info.get('now') or channel_info.get('next'):
+            height += 50
+
         self.channel_info = channel_info
         self.orig_width = width
         self.orig_height = height
@@ -163,8 +168,21 @@ class OsdWidget(QWidget):
             # Draw deinterlace status
             painter.drawText(x_offset + 20, y_offset + 70, f"Deinterlacing {'on' if self.channel_info['deinterlace'] else 'off'}")
 
-            # Draw latency mode
-            painter.drawText(x_offset + 20, y_offset + 100, f"{'Low' if self.channel_info['low_latency'] else 'High'} latency")
+            # Draw playback profile
+            profile = self.channel_info.get('profile')
+            if profile:
+                painter.drawText(x_offset + 20, y_offset + 100, f"Profile: {profile}")
+            else:
+                painter.drawText(x_offset + 20, y_offset + 100, f"{'Low' if self.channel_info['low_latency'] else 'High'} latency")
+
+            # Draw now/next from the programme guide
+            metrics = QFontMetrics(font)
+            for i, (label, key) in enumerate((("Now", 'now'), ("Next", 'next'))):
+                programme = self.channel_info.get(key)
+                if programme:
+                    text = f"{label} {time.strftime('%H:%M', time.localtime(programme['start']))}  {programme['title']}"
+                    text = metrics.elidedText(text, Qt.ElideRight, self.orig_width - 40)
+                    painter.drawText(x_offset + 20, y_offset + 130 + i * 25, text)
 
             # Draw codec badges if available
             if self.video_codec:
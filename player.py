@@ -2,10 +2,49 @@
 """MPV player functionality for IPMPV."""
 
 import mpv
+import os
+import tempfile
 import threading
 import time
 import traceback
-from utils import hwdec, ao
+from utils import hwdec, ao, profiles_file, tune_timeout
+from logs import logs
+from profiles import load_profiles, profiles_to_config, DEFAULT_PROFILE, MPV_PROFILE_PREFIX
+
+# mpv_end_file_reason values
+END_FILE_REASONS = {0: 'eof', 2: 'stop', 3: 'quit', 4: 'error', 5: 'redirect'}
+
+# mpv_event_id values of the events passed on to listeners
+LISTENED_EVENTS = {6: 'start-file', 7: 'end-file', 8: 'file-loaded', 21: 'playback-restart'}
+
+def event_info(event):
+	"""
+	Normalize an mpv event, whose shape differs between python-mpv versions.
+
+	Args:
+		event: Event passed to an mpv event callback.
+
+	Returns:
+		tuple: (event name, data dictionary). End-file reasons are given as strings.
+	"""
+	if not isinstance(event, dict):
+		event = event.as_dict()
+	name = event.get('event')
+	if isinstance(name, bytes):
+		name = name.decode()
+	name = str(name).lower().replace('_', '-').split('.')[-1]
+	data = event.get('data')
+	if not isinstance(data, dict):
+		data = event
+	data = dict(data)
+	reason = data.get('reason')
+	if isinstance(reason, bytes):
+		reason = reason.decode()
+	if isinstance(reason, int):
+		reason = END_FILE_REASONS.get(reason, str(reason))
+	if reason is not None:
+		data['reason'] = str(reason).lower()
+	return name, data
 
 class Player:
 	"""MPV player wrapper with IPMPV-specific functionality."""
@@ -14,7 +53,9 @@ class Player:
 		"""Initialize the player."""
 		self.to_qt_queue = to_qt_queue
 		self.player = mpv.MPV(
-			log_handler=self.error_check,
+			log_handler=logs.mpv,
+			loglevel=logs.mpv_loglevel(),
+			msg_level=logs.mpv_msg_level(),
 			vo='gpu',
 			hwdec=hwdec if hwdec is not None else 'auto-safe',
             ao=ao if ao is not None else 'alsa',
@@ -28,30 +69,102 @@ class Player:
 		
 		self.deinterlace = False
 		self.low_latency = False
+		self.profile = None
+		self.profile_timings = {}
+
+		# Serializes configuration changes so a zap never sees a half-applied one
+		self.config_lock = threading.Lock()
+		self.profiles = load_profiles(profiles_file)
+		self.profiles_registered = self._register_profiles()
 		self.current_index = None
+		# Saved channel tuned at startup, before the catalog could place it
+		self.resumed_channel = None
 		self.vcodec = None
 		self.acodec = None
 		self.video_res = None
 		self.interlaced = None
+
+		# Optional ModeMatchPolicy that picks the output mode for each source
+		self.mode_policy = None
+		self.mode_target = None
+		self.skip_deinterlace = False
+
+		# Optional AdaptiveBuffer that tunes buffering for each stream
+		self.buffer_controller = None
+
+		# Optional EPG shown on the OSD
+		self.epg = None
+
+		# Optional StateStore that remembers the session across restarts
+		self.state = None
+
+		# Optional Timeshift that pauses live TV
+		self.timeshift = None
+
+		# Channel to go back to after yielding the decoder to another program
+		self.suspended_index = None
+		self.yield_timings = {}
 		
 		# Set up property observers
 		self.player.observe_property('video-format', self.video_codec_observer)
 		self.player.observe_property('audio-codec-name', self.audio_codec_observer)
+
+		# Fan mpv events out to interested components
+		self.event_listeners = []
+		self.player.register_event_callback(self._dispatch_event)
+
+		# Optional StreamHealthMonitor that recovers stalled streams
+		self.health_monitor = None
+		self.tuning = False
+
+		# Tunes are driven by mpv events and bounded by a deadline
+		self.tune_timeout = tune_timeout
+		self.tune_waiter = None
+		self.tune_stats = {}
+		self.add_event_listener(self._on_tune_event)
+		self.add_event_listener(self._log_event)
 		
 		# Channel change management
 		self.channel_change_lock = threading.Lock()
 		self.current_channel_thread = None
 		self.channel_change_counter = 0  # To track the most recent channel change
+
+		# Last: set_profile() reads the collaborators assigned above
+		self.set_profile(DEFAULT_PROFILE)
 	
-	def error_check(self, loglevel, component, message):
-		"""Check for errors in MPV logs."""
-		print(f"[{loglevel}] {component}: {message}")
-		if loglevel == 'error' and (component == 'ffmpeg' or component == 'cplayer') and 'Failed to recognize file format' in message:
-			self.player.loadfile("./nosignal.png")
-			self.to_qt_queue.put({
-				'action': 'start_close'
-			})
-	
+	def add_event_listener(self, callback):
+		"""
+		Register a callback for mpv events.
+
+		Args:
+			callback (callable): Called as callback(name, data), see event_info(),
+				for the events in LISTENED_EVENTS.
+		"""
+		self.event_listeners.append(callback)
+
+	def _dispatch_event(self, event):
+		"""Pass the mpv events listeners handle on to every listener."""
+		if not self.event_listeners:
+			return
+		# Log messages and property changes make up most events: skip them before decoding
+		if not isinstance(event, dict):
+			event_id = getattr(event.event_id, 'value', event.event_id)
+			if event_id not in LISTENED_EVENTS:
+				return
+		try:
+			name, data = event_info(event)
+		except Exception as e:
+			print(f"Error decoding mpv event: {e}")
+			return
+		if name not in LISTENED_EVENTS.values():
+			return
+		for callback in self.event_listeners:
+			try:
+				callback(name, data)
+			except Exception as e:
+				print(f"Error in mpv event listener: {e}")
+				traceback.print_exc()
+
 	def video_codec_observer(self, name, value):
 		"""Observe changes to the video codec."""
 		if value:
@@ -65,39 +178,105 @@ class Player:
 	def play_channel(self, index, channels):
 		"""
 		Play a channel by index.
+
+		The tune is bounded by `tune_timeout`: a channel that fails or doesn't
+		start playing in time gets the no-signal card, and the calling thread
+		is released. A newer tune aborts this one straight away.
 		
 		Args:
 			index (int): Index of the channel to play.
 			channels (list): List of channel dictionaries.
+
+		Returns:
+			bool: Whether the channel is playing.
 		"""
 
 		print(f"\n=== Changing channel to index {index} ===")
+		index = index % len(channels)
+		return self._tune(channels[index], index)
+
+	def play_saved_channel(self, channel):
+		"""
+		Play a saved channel before its place in the catalog is known.
+
+		The channel is kept in `resumed_channel`, and `current_index` stays
+		None until the caller finds it in the catalog.
+
+		Args:
+			channel (dict): Channel dictionary.
+
+		Returns:
+			bool: Whether the channel is playing.
+		"""
+		print(f"\n=== Resuming channel {channel['name']} ===")
+		return self._tune(channel, None)
+
+	def _tune(self, channel, index):
+		"""
+		Tune a channel, see play_channel().
+
+		Args:
+			channel (dict): Channel dictionary.
+			index (int, optional): Index of the channel in the catalog, None if not known.
+
+		Returns:
+			bool: Whether the channel is playing.
+		"""
+		with self.channel_change_lock:
+			self.channel_change_counter += 1
+			change_id = self.channel_change_counter
+
+		# An explicit tune overrides a pending resume
+		self.suspended_index = None
 
 		self.vcodec = None
 		self.acodec = None
 
-		self.current_index = index % len(channels)
-		print(f"Playing channel: {channels[self.current_index]['name']} ({channels[self.current_index]['url']})")
+		self.current_index = index
+		self.resumed_channel = channel if index is None else None
+		print(f"Playing channel: {channel['name']} ({channel['url']})")
+
+		self.tuning = True
+		if self.health_monitor is not None:
+			self.health_monitor.unwatch()
+		if self.timeshift is not None:
+			self.timeshift.stop()
+
+		start = time.monotonic()
+		deadline = start + self.tune_timeout
 		
 		try:
-			self.player.loadfile("./novideo.png")
-			self.player.wait_until_playing()
+			outcome, reason = self._load_and_wait("./novideo.png", deadline)
+			if outcome == 'aborted':
+				return False
 			
-			channel_info = {
-				"name": channels[self.current_index]["name"],
-				"deinterlace": self.deinterlace,
-				"low_latency": self.low_latency,
-				"logo": channels[self.current_index]["logo"]
-			}
-
 			self.to_qt_queue.put({
 				'action': 'show_osd',
-				'channel_info': channel_info
+				'channel_info': self.channel_info(channel)
 			})
 
 
-			self.player.loadfile(channels[self.current_index]['url'])
-			self.player.wait_until_playing()
+			if self.buffer_controller is not None:
+				self.buffer_controller.start_channel(channel['name'])
+
+			outcome, reason = self._load_and_wait(channel['url'], deadline, channel.get('options'))
+			self._record_tune(channel['name'], outcome, reason, start)
+			if outcome == 'aborted':
+				return False
+			if outcome != 'playing':
+				print(f"\033[91mCould not tune {channel['name']}: {reason}\033[0m")
+				if change_id != self.channel_change_counter:
+					return False
+				self.player.loadfile("./nosignal.png")
+				self.to_qt_queue.put({
+					'action': 'start_close'
+				})
+				return False
+
+			if self.health_monitor is not None:
+				self.health_monitor.watch(channel)
+			if self.state is not None:
+				self.state.record_channel(channel)
 
 			video_params = self.player.video_params
 			video_frame_info = self.player.video_frame_info
@@ -111,43 +290,355 @@ class Player:
 					'video_res': self.video_res,
 					'interlaced': self.interlaced
 				})
+				self._match_output_mode(channel['name'])
 
 			self.to_qt_queue.put({
 				'action': 'start_close',
 			})
+			return True
 
 
 		except Exception as e:
 				print(f"\033[91mError in play_channel: {str(e)}\033[0m")
 				traceback.print_exc()
+		finally:
+			if change_id == self.channel_change_counter:
+				self.tuning = False
 		
-		return
+		return False
+
+	def play_url(self, url):
+		"""
+		Play a URL that isn't in the catalog.
+
+		Args:
+			url (str): Stream URL.
+		"""
+		print(f"\n=== Playing custom URL {url} ===")
+		with self.channel_change_lock:
+			# Any tune still in progress is superseded
+			self.channel_change_counter += 1
+		self.suspended_index = None
+		self.current_index = None
+		self.resumed_channel = None
+		self.vcodec = None
+		self.acodec = None
+		if self.health_monitor is not None:
+			self.health_monitor.unwatch()
+		if self.timeshift is not None:
+			self.timeshift.stop()
+		with self.config_lock:
+			self.player.loadfile(url)
+
+	def channel_info(self, channel):
+		"""
+		Get what the OSD shows about a channel.
+
+		Args:
+			channel (dict): Channel dictionary.
+
+		Returns:
+			dict: Channel name, logo, playback settings and, with an EPG, now/next.
+		"""
+		channel_info = {
+			"name": channel["name"],
+			"deinterlace": self.deinterlace,
+			"low_latency": self.low_latency,
+			"profile": self.profile,
+			"logo": channel["logo"]
+		}
+		if self.epg is not None:
+			channel_info.update(self.epg.now_next(channel))
+		return channel_info
+
+	def _load_and_wait(self, url, deadline, options=None):
+		"""
+		Load a URL and wait until it plays, fails, or the deadline passes.
+
+		Args:
+			url (str): URL or path to load.
+			deadline (float): time.monotonic() value to give up at.
+			options (dict, optional): mpv options that apply to this file only.
+
+		Returns:
+			tuple: (outcome, reason). The outcome is 'playing', 'error',
+				'timeout' or 'aborted' (stopped or replaced by a newer tune).
+		"""
+		waiter = {
+			'done': threading.Event(),
+			'lock': threading.Lock(),
+			# Events that came in before loadfile returned the id of the entry
+			'early': [],
+			'entry_id': None,
+			'started': False,
+			'loaded_at': None,
+			'outcome': None,
+			'reason': None
+		}
+		# Only one load can be awaited at a time; an older tune gives up
+		previous = self.tune_waiter
+		self.tune_waiter = waiter
+		if previous is not None:
+			self._finish_wait(previous, 'aborted', 'superseded')
+		try:
+			entry_id = self._loadfile(url, options)
+			with waiter['lock']:
+				waiter['entry_id'] = entry_id
+				early, waiter['early'] = waiter['early'], None
+				for name, data in early:
+					self._follow_tune(waiter, name, data)
+			if not waiter['done'].wait(max(0, deadline - time.monotonic())):
+				stage = "opening" if waiter['loaded_at'] is None else "waiting for the first frame"
+				self._finish_wait(waiter, 'timeout', f"timed out {stage}")
+			return waiter['outcome'], waiter['reason']
+		finally:
+			if self.tune_waiter is waiter:
+				self.tune_waiter = None
+
+	def _finish_wait(self, waiter, outcome, reason=None):
+		"""Settle a load waiter, unless it has already been settled."""
+		if waiter['outcome'] is None:
+			waiter['outcome'] = outcome
+			waiter['reason'] = reason
+			waiter['done'].set()
+
+	def _loadfile(self, url, options=None):
+		"""
+		Replace the playing file, like MPV.loadfile().
+
+		Args:
+			url (str): URL or path to load.
+			options (dict, optional): mpv options that apply to this file only.
+
+		Returns:
+			int: Playlist entry id of the new file, or None if mpv doesn't report it.
+		"""
+		encoded = mpv.MPV._encode_options(options or {})
+		if getattr(self.player, 'mpv_version_tuple', (0, 0, 0)) >= (0, 38, 0):
+			result = self.player.command('loadfile', url, 'replace', -1, encoded)
+		else:
+			result = self.player.command('loadfile', url, 'replace', encoded)
+		return result.get('playlist_entry_id') if isinstance(result, dict) else None
+
+	def _on_tune_event(self, name, data):
+		"""Follow the file being tuned through mpv's events."""
+		waiter = self.tune_waiter
+		if waiter is None or waiter['outcome'] is not None:
+			return
+		with waiter['lock']:
+			if waiter['early'] is not None:
+				# Until loadfile returns, it isn't known which entry the event belongs to
+				waiter['early'].append((name, data))
+			else:
+				self._follow_tune(waiter, name, data)
+
+	def _follow_tune(self, waiter, name, data):
+		"""Apply an mpv event to a load waiter. Must be called with the waiter lock held."""
+		if waiter['outcome'] is not None:
+			return
+		# The looping no-video card keeps restarting its own entry; only this tune's entry counts
+		entry_id = data.get('playlist_entry_id')
+		if entry_id is not None and waiter['entry_id'] is not None and entry_id != waiter['entry_id']:
+			return
+		# Events of the previous file can still be queued; the awaited one begins with start-file
+		if name == 'start-file':
+			waiter['started'] = True
+			return
+		if not waiter['started']:
+			return
+		if name == 'file-loaded':
+			waiter['loaded_at'] = time.monotonic()
+		elif name == 'playback-restart':
+			self._finish_wait(waiter, 'playing')
+		elif name == 'end-file':
+			reason = data.get('reason')
+			if reason == 'redirect':
+				# mpv loads the playlist the URL pointed to, as new entries
+				waiter['started'] = False
+				waiter['entry_id'] = data.get('playlist_insert_id') or None
+			elif reason in ('stop', 'quit'):
+				self._finish_wait(waiter, 'aborted', reason)
+			else:
+				error = data.get('file_error') or data.get('error')
+				if isinstance(error, bytes):
+					error = error.decode()
+				self._finish_wait(waiter, 'error', str(error) if error else f"ended ({reason})")
+
+	def _log_event(self, name, data):
+		"""Log playback errors from mpv's end-file events."""
+		if name == 'end-file' and data.get('reason') == 'error':
+			error = data.get('file_error') or data.get('error')
+			if isinstance(error, bytes):
+				error = error.decode()
+			logs.log("player", "error", f"Playback failed: {error or 'unknown error'}")
+
+	def _record_tune(self, channel_name, outcome, reason, start):
+		"""Count the outcome of a tune for the channel."""
+		stats = self.tune_stats.setdefault(channel_name, {
+			"tunes": 0, "playing": 0, "timeouts": 0, "errors": 0, "aborted": 0,
+			"last_outcome": None, "last_reason": None, "last_ms": None
+		})
+		stats["tunes"] += 1
+		stats[{'playing': 'playing', 'timeout': 'timeouts', 'error': 'errors'}.get(outcome, 'aborted')] += 1
+		stats["last_outcome"] = outcome
+		stats["last_reason"] = reason
+		stats["last_ms"] = round((time.monotonic() - start) * 1000)
 	
+	def _match_output_mode(self, channel_name):
+		"""Let the mode policy pick the output mode for the current source."""
+		if self.mode_policy is None:
+			return
+		fps = self.player.container_fps
+		self.mode_target = self.mode_policy.observe(channel_name, self.video_res, self.interlaced, fps)
+		# Judge by the mode in use: a pending switch re-checks in on_output_mode()
+		self._update_skip_deinterlace(self.mode_policy.display.get_mode())
+
+	def on_output_mode(self, mode):
+		"""
+		Re-check deinterlacing once the mode policy has switched the output.
+
+		Args:
+			mode (str): The output mode now in use.
+		"""
+		if mode == self.mode_target:
+			self._update_skip_deinterlace(mode)
+
+	def _update_skip_deinterlace(self, mode):
+		"""Don't deinterlace what the output mode in use can show natively."""
+		skip = (self.mode_target is not None and mode == self.mode_target
+				and not self.mode_policy.needs_deinterlace(mode, self.interlaced, self.video_res))
+		if skip != self.skip_deinterlace:
+			self.skip_deinterlace = skip
+			self._apply_deinterlace()
+
+	def _apply_deinterlace(self):
+		"""Set the video filter chain from the deinterlace state."""
+		with self.config_lock:
+			if self.deinterlace and not self.skip_deinterlace:
+				self.player['vf'] = 'yadif=0'
+			else:
+				self.player['vf'] = ''
+
 	def toggle_deinterlace(self):
 		"""Toggle deinterlacing."""
-		self.deinterlace = not self.deinterlace
-		if self.deinterlace:
-			self.player['vf'] = 'yadif=0'
-		else:
-			self.player['vf'] = ''
+		return self.set_deinterlace(not self.deinterlace)
+
+	def set_deinterlace(self, enabled):
+		"""
+		Turn deinterlacing on or off.
+
+		Args:
+			enabled (bool): Whether to deinterlace.
+
+		Returns:
+			bool: The new deinterlace state.
+		"""
+		self.deinterlace = bool(enabled)
+		self._apply_deinterlace()
+		if self.state is not None:
+			self.state.set('deinterlace', self.deinterlace)
 		return self.deinterlace
 	
+	def _register_profiles(self):
+		"""
+		Register the playback profiles with mpv.
+
+		Returns:
+			bool: True if mpv knows the profiles and they can be applied with a
+				single apply-profile command.
+		"""
+		config = profiles_to_config(self.profiles)
+		fd, path = tempfile.mkstemp(prefix='ipmpv-profiles-', suffix='.conf')
+		try:
+			with os.fdopen(fd, 'w') as f:
+				f.write(config)
+			self.player.command('load-config-file', path)
+			return True
+		except Exception as e:
+			print(f"Could not register playback profiles with mpv ({e}), setting options one by one")
+			return False
+		finally:
+			os.remove(path)
+
+	def set_profile(self, name):
+		"""
+		Switch to a playback profile.
+
+		Args:
+			name (str): Name of the profile, e.g. "low-latency".
+
+		Returns:
+			bool: Whether the profile exists and was applied.
+		"""
+		if name not in self.profiles:
+			return False
+		with self.config_lock:
+			start = time.perf_counter()
+			if self.profiles_registered:
+				# One command, applied by mpv as a whole
+				self.player.command('apply-profile', MPV_PROFILE_PREFIX + name)
+			else:
+				for key, value in self.profiles[name].items():
+					self.player[key] = value
+			elapsed_ms = (time.perf_counter() - start) * 1000
+			self.profile = name
+			self.low_latency = name == 'low-latency'
+		self.profile_timings[name] = round(elapsed_ms, 3)
+		if self.state is not None:
+			self.state.set('profile', name)
+		if self.buffer_controller is not None:
+			self.buffer_controller.reapply()
+		print(f"Applied playback profile {name} in {elapsed_ms:.2f} ms "
+			  f"({'apply-profile' if self.profiles_registered else 'per property'})")
+		return True
+
 	def toggle_latency(self):
 		"""Toggle low latency mode."""
-		self.low_latency = not self.low_latency
-		self.player['audio-buffer'] = '0' if self.low_latency else '0.2'
-		self.player['vd-lavc-threads'] = '1' if self.low_latency else '0'
-		self.player['cache-pause'] = 'no' if self.low_latency else 'yes'
-		self.player['demuxer-lavf-o'] = 'reconnect=1,fflags=+nobuffer' if self.low_latency else 'reconnect=1'
-		self.player['demuxer-lavf-probe-info'] = 'nostreams' if self.low_latency else 'auto'
-		self.player['demuxer-lavf-analyzeduration'] = '0.1' if self.low_latency else '0'
-		self.player['video-sync'] = 'audio'
-		self.player['interpolation'] = 'no'
-		self.player['video-latency-hacks'] = 'yes' if self.low_latency else 'no'
-		self.player['stream-buffer-size'] = '4k' if self.low_latency else '512k'
+		self.set_profile(DEFAULT_PROFILE if self.low_latency else 'low-latency')
 		return self.low_latency
 
+	def suspend(self):
+		"""
+		Stop decoding to leave the CPU, GPU and audio device to another program.
+
+		Unloading the file makes mpv tear down the (hardware) decoders, the
+		video output and the audio output. The current channel is remembered
+		so resume() can tune it again.
+		"""
+		if self.suspended_index is not None:
+			return
+		start = time.monotonic()
+		index = self.current_index
+		self.to_qt_queue.put({
+			'action': 'close_osd',
+		})
+		self.stop()
+		self.suspended_index = index
+		self.yield_timings['suspend_ms'] = round((time.monotonic() - start) * 1000)
+		print(f"Player suspended in {self.yield_timings['suspend_ms']} ms (was on channel {index})")
+
+	def resume(self, channels):
+		"""
+		Re-tune the channel that was playing when suspend() was called.
+
+		Args:
+			channels (list): List of channel dictionaries.
+		"""
+		index = self.suspended_index
+		self.suspended_index = None
+		if index is None or not channels:
+			return
+		start = time.monotonic()
+		self.play_channel(index, channels)
+		self.yield_timings['resume_ms'] = round((time.monotonic() - start) * 1000)
+		print(f"Player resumed channel {index} in {self.yield_timings['resume_ms']} ms")
+
 	def stop(self):
 		"""Stop the player."""
+		if self.health_monitor is not None:
+			self.health_monitor.unwatch()
+		if self.timeshift is not None:
+			self.timeshift.stop()
 		self.player.stop()
 		self.current_index = None
+		self.resumed_channel = None
@@ -0,0 +1,237 @@
+#!/usr/bin/python
+"""Channel liveness probing for IPMPV."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+
+PROBE_SCHEMES = ('http', 'https')
+
+# Upper estimate of the bytes a probe moves: TLS handshake, headers and the first chunk
+PROBE_BYTES = 16 * 1024
+
+# Bitrate assumed for the live stream when mpv doesn't report one, in bits per second
+DEFAULT_LIVE_BITRATE = 1000000
+
+def probe_url(url, timeout=3, session=None):
+	"""
+	Check whether a stream URL answers, and how fast.
+
+	Only the first chunk of the response is read, so a probe costs a
+	connection and a few kilobytes at most.
+
+	Args:
+		url (str): Stream URL.
+		timeout (float): Seconds allowed for connecting and for the first byte.
+		session (requests.Session, optional): Session to reuse connections with.
+
+	Returns:
+		dict: alive (True, False, or None when the URL can't be probed),
+			ttfb_ms, status and error.
+	"""
+	result = {"alive": None, "ttfb_ms": None, "status": None, "error": None}
+	if urlparse(url).scheme not in PROBE_SCHEMES:
+		result["error"] = "unsupported scheme"
+		return result
+
+	start = time.monotonic()
+	try:
+		response = (session or requests).get(url, stream=True, timeout=(timeout, timeout))
+		try:
+			result["status"] = response.status_code
+			response.raise_for_status()
+			next(response.iter_content(1024), b'')
+			result["ttfb_ms"] = round((time.monotonic() - start) * 1000)
+			result["alive"] = True
+		finally:
+			response.close()
+	except requests.RequestException as e:
+		result["alive"] = False
+		result["error"] = type(e).__name__
+	return result
+
+class ChannelProber:
+	"""
+	Background liveness checks for every catalog URL.
+
+	URLs are probed a few at a time on a thread pool, with new probes
+	started at a limited rate and held back entirely while the player is
+	tuning, so a sweep never competes with the stream being watched.
+	While a channel plays, probes are also spaced so their traffic stays
+	under `live_share` of the live stream's bitrate.
+	"""
+
+	def __init__(self, player=None, workers=4, timeout=3, rate=2, interval=900, live_share=0.05):
+		"""
+		Initialize the prober.
+
+		Args:
+			player (Player, optional): Player whose tunes take priority over probes.
+			workers (int): Maximum number of concurrent probes.
+			timeout (float): Per-probe timeout in seconds.
+			rate (float): Maximum number of probes started per second.
+			interval (float): Seconds between the end of a sweep and the next one.
+			live_share (float): Largest share of the live bitrate probes may use while a channel plays.
+		"""
+		self.player = player
+		self.workers = workers
+		self.timeout = timeout
+		self.rate = rate
+		self.interval = interval
+		self.live_share = live_share
+
+		self.lock = threading.Lock()
+		self.urls = []
+		self.results = {}
+		self.sweeps = 0
+		self.sweep_ms = None
+		self.last_sweep = None
+		self.next_slot = 0
+		self.running = False
+		self.session = requests.Session()
+
+	def set_catalog(self, channels):
+		"""
+		Set the channels to probe.
+
+		Args:
+			channels (list): List of channel dictionaries.
+		"""
+		urls = list(dict.fromkeys(channel["url"] for channel in channels))
+		with self.lock:
+			self.urls = urls
+			self.results = {url: result for url, result in self.results.items() if url in urls}
+
+	def start(self):
+		"""Start sweeping in the background."""
+		if self.running:
+			return
+		self.running = True
+		threading.Thread(target=self._loop, name="channel-prober", daemon=True).start()
+
+	def stop(self):
+		"""Stop after the current sweep."""
+		self.running = False
+
+	def _loop(self):
+		"""Sweep the catalog periodically."""
+		while self.running:
+			self.sweep()
+			time.sleep(self.interval)
+
+	def sweep(self):
+		"""Probe every URL once."""
+		start = time.monotonic()
+		with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe") as pool:
+			for url in list(self.urls):
+				self._throttle()
+				pool.submit(self._probe, url)
+		self.sweeps += 1
+		self.sweep_ms = round((time.monotonic() - start) * 1000)
+		self.last_sweep = time.time()
+		summary = self.summary()
+		print(f"Channel prober: {summary['alive']} alive, {summary['dead']} dead, "
+			  f"{summary['unknown']} unknown in {self.sweep_ms} ms")
+
+	def _live_bitrate(self):
+		"""Get the bitrate of the channel being watched in bits per second, or None if nothing plays."""
+		player = self.player
+		if player is None or (player.current_index is None and player.resumed_channel is None):
+			return None
+		try:
+			bitrate = (player.player.video_bitrate or 0) + (player.player.audio_bitrate or 0)
+		except Exception:
+			bitrate = 0
+		return bitrate or DEFAULT_LIVE_BITRATE
+
+	def _throttle(self):
+		"""Wait for the next probe slot, and for the player to finish tuning."""
+		while self.player is not None and self.player.tuning:
+			time.sleep(0.5)
+		spacing = 1 / self.rate
+		bitrate = self._live_bitrate()
+		if bitrate is not None:
+			spacing = max(spacing, PROBE_BYTES * 8 / (bitrate * self.live_share))
+		now = time.monotonic()
+		if self.next_slot > now:
+			time.sleep(self.next_slot - now)
+		self.next_slot = max(now, self.next_slot) + spacing
+
+	def _probe(self, url):
+		"""Probe a URL and store the result."""
+		result = probe_url(url, self.timeout, self.session)
+		result["checked"] = time.time()
+		with self.lock:
+			self.results[url] = result
+
+	def is_dead(self, url):
+		"""
+		Check whether the last probe of a URL failed.
+
+		Args:
+			url (str): Stream URL.
+
+		Returns:
+			bool: True if the URL was probed and didn't answer.
+		"""
+		result = self.results.get(url)
+		return result is not None and result["alive"] is False
+
+	def rank_key(self, url):
+		"""
+		Get a sort key that puts live, fast URLs first.
+
+		Args:
+			url (str): Stream URL.
+		"""
+		result = self.results.get(url)
+		if result is None or result["alive"] is None:
+			return (1, 0)
+		if not result["alive"]:
+			return (2, 0)
+		return (0, result["ttfb_ms"])
+
+	def summary(self):
+		"""Count alive, dead and not yet (or not) probed URLs."""
+		with self.lock:
+			results = [self.results.get(url) for url in self.urls]
+		alive = sum(1 for result in results if result and result["alive"])
+		dead = sum(1 for result in results if result and result["alive"] is False)
+		return {"alive": alive, "dead": dead, "unknown": len(results) - alive - dead}
+
+	def metrics(self, channels):
+		"""
+		Get the probe results.
+
+		Args:
+			channels (list): List of channel dictionaries.
+
+		Returns:
+			dict: Sweep statistics and the channels ranked by time to first byte.
+		"""
+		ranked = []
+		seen = set()
+		for index, channel in enumerate(channels):
+			if channel["url"] in seen:
+				continue
+			seen.add(channel["url"])
+			result = self.results.get(channel["url"]) or {}
+			ranked.append({
+				"index": index,
+				"name": channel["name"],
+				"alive": result.get("alive"),
+				"ttfb_ms": result.get("ttfb_ms"),
+				"status": result.get("status"),
+				"error": result.get("error"),
+				"checked": result.get("checked")
+			})
+		ranked.sort(key=lambda entry: self.rank_key(channels[entry["index"]]["url"]))
+		return {
+			"sweeps": self.sweeps,
+			"sweep_ms": self.sweep_ms,
+			"last_sweep": self.last_sweep,
+			**self.summary(),
+			"channels": ranked
+		}
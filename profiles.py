@@ -0,0 +1,111 @@
+#!/usr/bin/python
+"""Playback profiles for IPMPV."""
+
+import json
+import os
+import re
+
+# Built-in profiles. "balanced" is what the player starts with.
+BUILTIN_PROFILES = {
+	"low-latency": {
+		"audio-buffer": "0",
+		"vd-lavc-threads": "1",
+		"cache-pause": "no",
+		"demuxer-lavf-o": "reconnect=1,fflags=+nobuffer",
+		"demuxer-lavf-probe-info": "nostreams",
+		"demuxer-lavf-analyzeduration": "0.1",
+		"video-sync": "audio",
+		"interpolation": "no",
+		"video-latency-hacks": "yes",
+		"stream-buffer-size": "4k",
+		"cache": "auto",
+		"cache-pause-wait": "1",
+		"demuxer-readahead-secs": "1",
+	},
+	"balanced": {
+		"audio-buffer": "0.2",
+		"vd-lavc-threads": "0",
+		"cache-pause": "yes",
+		"demuxer-lavf-o": "reconnect=1",
+		"demuxer-lavf-probe-info": "auto",
+		"demuxer-lavf-analyzeduration": "0",
+		"video-sync": "audio",
+		"interpolation": "no",
+		"video-latency-hacks": "no",
+		"stream-buffer-size": "512k",
+		"cache": "auto",
+		"cache-pause-wait": "1",
+		"demuxer-readahead-secs": "1",
+	},
+	"high-buffer": {
+		"audio-buffer": "0.5",
+		"vd-lavc-threads": "0",
+		"cache": "yes",
+		"cache-pause": "yes",
+		"cache-pause-wait": "2",
+		"demuxer-readahead-secs": "10",
+		"demuxer-lavf-o": "reconnect=1",
+		"demuxer-lavf-probe-info": "auto",
+		"demuxer-lavf-analyzeduration": "0",
+		"video-sync": "audio",
+		"interpolation": "no",
+		"video-latency-hacks": "no",
+		"stream-buffer-size": "4M",
+	},
+}
+
+DEFAULT_PROFILE = "balanced"
+
+# Prefix of the mpv profile names, so ours never clash with user mpv.conf profiles
+MPV_PROFILE_PREFIX = "ipmpv-"
+
+PROFILE_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+
+def load_profiles(profiles_file=None):
+	"""
+	Get the built-in profiles merged with the user-defined ones.
+
+	Args:
+		profiles_file (str, optional): JSON file mapping profile names to
+			{mpv option: value} dictionaries.
+
+	Returns:
+		dict: Profile name to mpv options.
+	"""
+	profiles = {name: dict(options) for name, options in BUILTIN_PROFILES.items()}
+	if not profiles_file or not os.path.exists(profiles_file):
+		return profiles
+	try:
+		with open(profiles_file, 'r', encoding='utf-8') as f:
+			user_profiles = json.load(f)
+	except (OSError, ValueError) as e:
+		print(f"Error loading playback profiles: {e}")
+		return profiles
+
+	for name, options in user_profiles.items():
+		if not PROFILE_NAME_RE.match(name) or not isinstance(options, dict):
+			print(f"Ignoring invalid playback profile: {name}")
+			continue
+		# User profiles start from "balanced", so switching to one always sets
+		# every option the built-in profiles touch
+		profiles[name] = dict(BUILTIN_PROFILES[DEFAULT_PROFILE])
+		profiles[name].update({str(key): str(value) for key, value in options.items()})
+	return profiles
+
+def profiles_to_config(profiles):
+	"""
+	Render profiles as an mpv config file.
+
+	Args:
+		profiles (dict): Profile name to mpv options.
+
+	Returns:
+		str: Config file contents with one [ipmpv-<name>] section per profile.
+	"""
+	lines = []
+	for name, options in profiles.items():
+		lines.append(f"[{MPV_PROFILE_PREFIX}{name}]")
+		for key, value in options.items():
+			lines.append(f"{key}={value}")
+		lines.append("")
+	return "\n".join(lines)
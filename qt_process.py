@@ -2,11 +2,12 @@
 """Qt process for IPMPV OSD."""
 
 import sys
-from PyQt5.QtWidgets import QApplication
-from PyQt5.QtCore import QTimer
-from osd import OsdWidget
-from volume_osd import VolumeOsdWidget
-from utils import is_wayland
+import time
+from utils import is_wayland, get_process_stats
+
+# PyQt5 and the OSD widgets are only imported inside qt_process(), so that
+# importing this module (and pickling its entry point for a spawned child)
+# does not pull a GUI toolkit into the web/player process.
 
 def qt_process(to_qt_queue, from_qt_queue):
 	"""
@@ -16,13 +17,35 @@ def qt_process(to_qt_queue, from_qt_queue):
 		to_qt_queue: Queue for messages to Qt process
 		from_qt_queue: Queue for messages from Qt process
 	"""
+	import_start = time.monotonic()
+	from PyQt5.QtWidgets import QApplication
+	from PyQt5.QtCore import QTimer
+	from osd import OsdWidget
+	from volume_osd import VolumeOsdWidget
+	from timeshift_osd import TimeshiftOsdWidget
+	import_seconds = time.monotonic() - import_start
+
 	app = QApplication(sys.argv)
+
+	# Report the OSD process footprint back to the web process
+	def report_stats(requested=False):
+		from_qt_queue.put({
+			'action': 'process_stats',
+			'requested': requested,
+			'import_ms': round(import_seconds * 1000),
+			'widgets': len(app.allWidgets()),
+			'top_level_widgets': len(app.topLevelWidgets()),
+			**get_process_stats()
+		})
+
+	report_stats()
 	osd = None
 	volume_osd = None
+	timeshift_osd = None
 
 	# Check the queue periodically for commands
 	def check_queue():
-		nonlocal osd, volume_osd
+		nonlocal osd, volume_osd, timeshift_osd
 		if not to_qt_queue.empty():
 			command = to_qt_queue.get()
 			
@@ -77,6 +100,25 @@ def qt_process(to_qt_queue, from_qt_queue):
 				if volume_osd is not None:
 					volume_osd.close_widget()
 					volume_osd = None
+
+			# Timeshift OSD commands
+			elif command['action'] == 'show_timeshift_osd':
+				if timeshift_osd is not None and timeshift_osd.isVisible():
+					timeshift_osd.update_position(command)
+				else:
+					if timeshift_osd is not None:
+						timeshift_osd.close_widget()
+					timeshift_osd = TimeshiftOsdWidget(command)
+					if is_wayland:
+						timeshift_osd.showFullScreen()
+					else:
+						timeshift_osd.show()
+				# Stay on screen while paused
+				timeshift_osd.start_close_timer(3600 if command['paused'] else None)
+
+			# Diagnostics
+			elif command['action'] == 'report_stats':
+				report_stats(requested=True)
 					
 		# Schedule next check
 		QTimer.singleShot(100, check_queue)
@@ -0,0 +1,552 @@
+#!/usr/bin/python
+"""Scheduled recording for IPMPV."""
+
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import requests
+from state import SAVED_CHANNEL_FIELDS
+from timeshift import TS_PACKET_SIZE, ts_sync_offset
+
+# PMT stream types of video elementary streams: MPEG-1/2, MPEG-4, H.264, HEVC, AVS, VC-1
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1b, 0x24, 0x42, 0xea}
+
+class RateBudget:
+	"""
+	Byte rate shared by several consumers.
+
+	Consumers book their bytes in turn and sleep until their booking is
+	due, so the total never exceeds `rate` for longer than `burst_secs`.
+	"""
+
+	def __init__(self, rate=None, burst_secs=2):
+		"""
+		Initialize the budget.
+
+		Args:
+			rate (float, optional): Bytes per second. Unlimited if None or 0.
+			burst_secs (float): Seconds of unused budget that may be caught up on.
+		"""
+		self.rate = rate
+		self.burst_secs = burst_secs
+		self.lock = threading.Lock()
+		self.next_free = 0
+
+	def consume(self, count):
+		"""Wait until `count` bytes fit in the budget."""
+		if not self.rate:
+			return
+		with self.lock:
+			now = time.monotonic()
+			start = max(now - self.burst_secs, self.next_free)
+			self.next_free = start + count / self.rate
+		if start > now:
+			time.sleep(start - now)
+
+def existing_segments(directory):
+	"""
+	List the segments already in a recording directory.
+
+	Args:
+		directory (str): Recording directory.
+
+	Returns:
+		list: Paths of the segment files, in order.
+	"""
+	if not os.path.isdir(directory):
+		return []
+	return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+			if name.startswith("segment-") and name.endswith(".ts")]
+
+def next_segment_number(segments):
+	"""
+	Get the number the next segment of a recording is written under.
+
+	Args:
+		segments (list): Paths of the existing segment files.
+
+	Returns:
+		int: One past the highest existing segment number.
+	"""
+	numbers = [0]
+	for path in segments:
+		try:
+			numbers.append(int(os.path.basename(path)[len("segment-"):-len(".ts")]) + 1)
+		except ValueError:
+			pass
+	return max(numbers)
+
+class TsSegmenter:
+	"""
+	Write an MPEG-TS stream to a series of files, without re-encoding.
+
+	A new file is started at the first random access point (a keyframe
+	flagged in the adaptation field) once the current file is
+	`segment_secs` long, and begins with the latest PAT and PMT so every
+	file plays on its own. Only the video PIDs listed in the PMT are cut
+	on, so a cut never lands on an audio frame between keyframes; streams
+	without video are cut at any random access point. Writes go out in blocks, paced by an I/O budget.
+	"""
+
+	def __init__(self, directory, segment_secs=600, io_budget=None, block_size=1024 * 1024):
+		"""
+		Initialize the segmenter.
+
+		Args:
+			directory (str): Directory the segment files are written to.
+			segment_secs (float): Target duration of a segment.
+			io_budget (RateBudget, optional): Budget for disk writes.
+			block_size (int): Bytes per write.
+		"""
+		self.directory = directory
+		self.segment_secs = segment_secs
+		self.io_budget = io_budget or RateBudget()
+		self.block_size = block_size
+		self.remainder = b''
+		self.pending = bytearray()
+		self.file = None
+		self.segment_started = None
+		# A recording resumed after a restart continues after its earlier segments
+		self.segments = existing_segments(directory)
+		self.bytes = sum(os.path.getsize(path) for path in self.segments)
+		self.next_number = next_segment_number(self.segments)
+		self.pat = None
+		self.pmt_pids = set()
+		self.pmts = {}
+		self.video_pids = {}
+		self.cut_pids = None
+		os.makedirs(directory, exist_ok=True)
+
+	def _open_segment(self):
+		"""Close the current segment and start the next one."""
+		self._close_segment()
+		path = os.path.join(self.directory, f"segment-{self.next_number:04d}.ts")
+		self.next_number += 1
+		self.file = open(path, 'xb')
+		self.segments.append(path)
+		self.segment_started = time.monotonic()
+		# Let the segment be decoded without the previous one
+		if self.pat is not None:
+			self.pending += self.pat
+			for pmt in self.pmts.values():
+				self.pending += pmt
+
+	def _close_segment(self):
+		"""Flush and close the current segment."""
+		if self.file is None:
+			return
+		self._write(len(self.pending))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		try:
+			# The recording won't be read back soon: keep it out of the page cache
+			os.posix_fadvise(self.file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+		except (AttributeError, OSError):
+			pass
+		self.file.close()
+		self.file = None
+
+	def _write(self, count):
+		"""Write out the first `count` pending bytes."""
+		if count:
+			self.io_budget.consume(count)
+			self.file.write(self.pending[:count])
+			del self.pending[:count]
+
+	def _remember_tables(self, packet):
+		"""Keep the latest PAT and PMT packets, and learn the PMT PIDs from the PAT."""
+		pid = (packet[1] & 0x1f) << 8 | packet[2]
+		if pid == 0 and packet[1] & 0x40:
+			self.pat = bytes(packet)
+			# Program loop of a single-packet PAT section
+			section = 5 + packet[4]
+			length = (packet[section + 1] & 0x0f) << 8 | packet[section + 2]
+			end = min(section + 3 + length - 4, TS_PACKET_SIZE)
+			pmt_pids = set()
+			for entry in range(section + 8, end - 3, 4):
+				if packet[entry] << 8 | packet[entry + 1]:
+					pmt_pids.add((packet[entry + 2] & 0x1f) << 8 | packet[entry + 3])
+			self.pmt_pids = pmt_pids
+		elif pid in self.pmt_pids and packet[1] & 0x40:
+			self.pmts[pid] = bytes(packet)
+			# Elementary stream loop of a single-packet PMT section
+			section = 5 + packet[4]
+			length = (packet[section + 1] & 0x0f) << 8 | packet[section + 2]
+			end = min(section + 3 + length - 4, TS_PACKET_SIZE)
+			entry = section + 12 + ((packet[section + 10] & 0x0f) << 8 | packet[section + 11])
+			video_pids = set()
+			while entry + 5 <= end:
+				if packet[entry] in VIDEO_STREAM_TYPES:
+					video_pids.add((packet[entry + 1] & 0x1f) << 8 | packet[entry + 2])
+				entry += 5 + ((packet[entry + 3] & 0x0f) << 8 | packet[entry + 4])
+			self.video_pids[pid] = video_pids
+			self.cut_pids = set().union(*self.video_pids.values())
+
+	def _is_random_access(self, packet):
+		"""Check whether a segment can start at a packet: a video keyframe, once the PMT is known."""
+		if not (packet[3] & 0x20 and packet[4] > 0 and packet[5] & 0x40):
+			return False
+		if self.cut_pids is None:
+			return False
+		return not self.cut_pids or (packet[1] & 0x1f) << 8 | packet[2] in self.cut_pids
+
+	def feed(self, data):
+		"""
+		Add stream data.
+
+		Args:
+			data (bytes): Next part of the stream, cut anywhere.
+		"""
+		if self.file is None:
+			sync = ts_sync_offset(data)
+			if sync < 0:
+				return
+			data = data[sync:]
+			self._open_segment()
+		data = self.remainder + data
+		usable = len(data) - len(data) % TS_PACKET_SIZE
+		self.remainder = data[usable:]
+		self.bytes += usable
+
+		age = time.monotonic() - self.segment_started
+		if age < self.segment_secs:
+			# Tables are only needed around a cut; the stream repeats them several times a second
+			if age > self.segment_secs - 1:
+				for offset in range(0, usable, TS_PACKET_SIZE):
+					self._remember_tables(data[offset:offset + TS_PACKET_SIZE])
+			self.pending += data[:usable]
+		else:
+			cut = None
+			for offset in range(0, usable, TS_PACKET_SIZE):
+				packet = data[offset:offset + TS_PACKET_SIZE]
+				self._remember_tables(packet)
+				if self._is_random_access(packet) or age > 2 * self.segment_secs:
+					cut = offset
+					break
+			if cut is None:
+				self.pending += data[:usable]
+			else:
+				self.pending += data[:cut]
+				self._open_segment()
+				self.pending += data[cut:usable]
+
+		if len(self.pending) >= self.block_size:
+			self._write(len(self.pending) - len(self.pending) % self.block_size)
+
+	def close(self):
+		"""Write out everything and close the last segment."""
+		self._close_segment()
+
+class RecordingScheduler:
+	"""
+	Record catalog channels by time window.
+
+	Each recording downloads its channel on its own thread and remuxes it
+	into segment files, without decoding. Downloads share a bandwidth
+	budget and disk writes share an I/O budget, and recordings hold back
+	while the player tunes or recovers a stream, so the channel being
+	watched keeps priority. At most `max_concurrent` recordings run at a
+	time; others wait for a free slot until their window ends.
+
+	MPEG-TS streams are segmented in process. HLS channels are handed to
+	ffmpeg (-c copy) at idle I/O priority, if it is installed; the budgets
+	can't be applied to it.
+	"""
+
+	def __init__(self, player, directory, max_concurrent=2, bandwidth=None, io_rate=None,
+				 segment_secs=600, schedule_file=None, yield_secs=5):
+		"""
+		Initialize the scheduler.
+
+		Args:
+			player (Player, optional): Player whose tunes take priority over recordings.
+			directory (str): Directory recordings are written to, local or on a NAS mount.
+			max_concurrent (int): Maximum number of recordings running at once.
+			bandwidth (float, optional): Download budget in bytes per second for all recordings.
+			io_rate (float, optional): Disk write budget in bytes per second for all recordings.
+			segment_secs (float): Target duration of each file.
+			schedule_file (str, optional): JSON file the schedule is kept in across restarts.
+			yield_secs (float): Longest a recording holds back for the player at a time.
+		"""
+		self.player = player
+		self.directory = directory
+		self.max_concurrent = max_concurrent
+		self.bandwidth = RateBudget(bandwidth)
+		self.io_budget = RateBudget(io_rate)
+		self.segment_secs = segment_secs
+		self.schedule_file = schedule_file
+		self.yield_secs = yield_secs
+
+		self.lock = threading.Lock()
+		self.recordings = {}
+		self.ids = itertools.count(1)
+		self.running = False
+		self.session = requests.Session()
+		self.counters = {"started": 0, "completed": 0, "failed": 0, "reconnects": 0, "yields": 0}
+		self._load()
+
+	def _load(self):
+		"""Read the schedule saved by a previous run."""
+		if not self.schedule_file or not os.path.exists(self.schedule_file):
+			return
+		try:
+			with open(self.schedule_file, 'r', encoding='utf-8') as f:
+				recordings = json.load(f)
+		except (OSError, ValueError) as e:
+			print(f"Error loading recording schedule: {e}")
+			return
+		for recording in recordings:
+			if recording["state"] == "recording":
+				# Interrupted by the restart: pick it up again if its window is still open
+				recording["state"] = "scheduled"
+			self.recordings[recording["id"]] = recording
+		self.ids = itertools.count(max(self.recordings, default=0) + 1)
+
+	def _save(self):
+		"""Write the schedule to disk."""
+		if not self.schedule_file:
+			return
+		with self.lock:
+			data = json.dumps(list(self.recordings.values()), indent=1)
+		try:
+			tmp_file = self.schedule_file + ".tmp"
+			with open(tmp_file, 'w', encoding='utf-8') as f:
+				f.write(data)
+			os.replace(tmp_file, self.schedule_file)
+		except OSError as e:
+			print(f"Error saving recording schedule: {e}")
+
+	def schedule(self, channel, start, stop, title=None):
+		"""
+		Schedule a recording.
+
+		Args:
+			channel (dict): Channel dictionary.
+			start (float): Unix time to start at. May be in the past to start now.
+			stop (float): Unix time to stop at.
+			title (str, optional): Name of the recording.
+
+		Returns:
+			dict: The recording.
+
+		Raises:
+			ValueError: If the window is empty or already over.
+		"""
+		if stop <= start or stop <= time.time():
+			raise ValueError("the recording window is empty or over")
+		recording = {
+			"id": next(self.ids),
+			"channel": {field: channel.get(field) for field in SAVED_CHANNEL_FIELDS},
+			"title": title or channel["name"],
+			"start": start,
+			"stop": stop,
+			"state": "scheduled",
+			"path": None,
+			"segments": 0,
+			"bytes": 0,
+			"error": None
+		}
+		with self.lock:
+			self.recordings[recording["id"]] = recording
+		self._save()
+		print(f"Recording {recording['id']} scheduled: {recording['title']} on {channel['name']}, "
+			  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(start))} to "
+			  f"{time.strftime('%H:%M', time.localtime(stop))}")
+		return recording
+
+	def cancel(self, recording_id):
+		"""
+		Cancel a scheduled recording, or stop a running one.
+
+		Returns:
+			bool: Whether the recording exists.
+		"""
+		with self.lock:
+			recording = self.recordings.get(recording_id)
+			if recording is None:
+				return False
+			if recording["state"] in ("scheduled", "recording"):
+				recording["state"] = "cancelled"
+		self._save()
+		return True
+
+	def list(self):
+		"""Get every recording, most recent first."""
+		with self.lock:
+			return sorted((dict(recording) for recording in self.recordings.values()),
+						  key=lambda recording: recording["start"], reverse=True)
+
+	def start(self):
+		"""Start the scheduler in the background."""
+		if self.running:
+			return
+		self.running = True
+		threading.Thread(target=self._loop, name="recorder", daemon=True).start()
+
+	def _loop(self):
+		"""Start recordings as their windows open."""
+		while self.running:
+			now = time.time()
+			changed = False
+			with self.lock:
+				running = sum(1 for recording in self.recordings.values() if recording["state"] == "recording")
+				for recording in sorted(self.recordings.values(), key=lambda recording: recording["start"]):
+					if recording["state"] != "scheduled":
+						continue
+					if recording["stop"] <= now:
+						recording["state"] = "missed"
+						changed = True
+					elif recording["start"] <= now and running < self.max_concurrent:
+						recording["state"] = "recording"
+						running += 1
+						changed = True
+						threading.Thread(target=self._record, args=(recording,),
+										 name=f"record-{recording['id']}", daemon=True).start()
+			if changed:
+				self._save()
+			time.sleep(1)
+
+	def _directory_for(self, recording):
+		"""Get the directory of a recording's segments."""
+		stamp = time.strftime('%Y%m%d-%H%M', time.localtime(recording["start"]))
+		name = re.sub(r'[^\w.-]+', '_', recording["title"]).strip('_')[:60] or "recording"
+		return os.path.join(self.directory, f"{stamp}-{name}-{recording['id']}")
+
+	def _active(self, recording):
+		"""Check whether a recording should keep going."""
+		return recording["state"] == "recording" and time.time() < recording["stop"]
+
+	def _record(self, recording):
+		"""Record a channel until the end of its window."""
+		self.counters["started"] += 1
+		recording["path"] = self._directory_for(recording)
+		print(f"Recording {recording['id']} started: {recording['title']} to {recording['path']}")
+		try:
+			if ".m3u8" in recording["channel"]["url"].lower():
+				self._record_ffmpeg(recording)
+			else:
+				self._record_ts(recording)
+		except Exception as e:
+			recording["error"] = str(e)
+			print(f"\033[91mRecording {recording['id']} failed: {e}\033[0m")
+		with self.lock:
+			if recording["state"] == "recording":
+				recording["state"] = "failed" if recording["error"] and not recording["bytes"] else "completed"
+		if recording["state"] in ("failed", "completed"):
+			self.counters[recording["state"]] += 1
+		self._save()
+		print(f"Recording {recording['id']} {recording['state']}: {recording['segments']} segments, "
+			  f"{recording['bytes'] // (1024 * 1024)} MiB")
+
+	def _yield_to_player(self):
+		"""Hold back while the player tunes or recovers a stream, for a bounded time."""
+		player = self.player
+		if player is None:
+			return
+		deadline = time.monotonic() + self.yield_secs
+		monitor = player.health_monitor
+		if player.tuning or (monitor is not None and monitor.recovering):
+			self.counters["yields"] += 1
+		while time.monotonic() < deadline and (player.tuning or (monitor is not None and monitor.recovering)):
+			time.sleep(0.2)
+
+	def _record_ts(self, recording):
+		"""Download an MPEG-TS channel and segment it in process."""
+		channel = recording["channel"]
+		options = channel.get("options") or {}
+		headers = {}
+		if options.get("user-agent"):
+			headers["User-Agent"] = options["user-agent"]
+		if options.get("referrer"):
+			headers["Referer"] = options["referrer"]
+		segmenter = TsSegmenter(recording["path"], self.segment_secs, self.io_budget)
+		try:
+			while self._active(recording):
+				try:
+					with self.session.get(channel["url"], headers=headers, stream=True, timeout=10) as response:
+						response.raise_for_status()
+						for chunk in response.iter_content(65536):
+							if not self._active(recording):
+								break
+							self._yield_to_player()
+							self.bandwidth.consume(len(chunk))
+							segmenter.feed(chunk)
+							recording["bytes"] = segmenter.bytes
+							recording["segments"] = len(segmenter.segments)
+				except requests.RequestException as e:
+					recording["error"] = str(e)
+				if self._active(recording):
+					# The stream dropped: reconnect, and start a new segment on the new stream
+					self.counters["reconnects"] += 1
+					segmenter.close()
+					segmenter.remainder = b''
+					time.sleep(2)
+		finally:
+			segmenter.close()
+			recording["segments"] = len(segmenter.segments)
+
+	def _record_ffmpeg(self, recording):
+		"""Remux an HLS channel with ffmpeg."""
+		ffmpeg = shutil.which("ffmpeg")
+		if ffmpeg is None:
+			raise RuntimeError("HLS channels need ffmpeg to be recorded")
+		os.makedirs(recording["path"], exist_ok=True)
+		channel = recording["channel"]
+		options = channel.get("options") or {}
+		command = [ffmpeg, "-nostdin", "-loglevel", "error"]
+		if options.get("user-agent"):
+			command += ["-user_agent", options["user-agent"]]
+		if options.get("referrer"):
+			command += ["-referer", options["referrer"]]
+		command += ["-i", channel["url"], "-map", "0", "-c", "copy", "-f", "segment",
+					"-segment_time", str(self.segment_secs), "-reset_timestamps", "1",
+					"-segment_start_number", str(next_segment_number(existing_segments(recording["path"]))),
+					os.path.join(recording["path"], "segment-%04d.ts")]
+		# Idle I/O class and low CPU priority, so the live player goes first
+		if shutil.which("ionice"):
+			command = ["ionice", "-c", "3"] + command
+		if shutil.which("nice"):
+			command = ["nice", "-n", "10"] + command
+		# stderr goes to a file: an undrained pipe would fill up and stall ffmpeg
+		log_path = os.path.join(recording["path"], "ffmpeg.log")
+		with open(log_path, 'ab') as log:
+			start = log.tell()
+			process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=log)
+		try:
+			while self._active(recording) and process.poll() is None:
+				time.sleep(1)
+				segments = existing_segments(recording["path"])
+				recording["segments"] = len(segments)
+				recording["bytes"] = sum(os.path.getsize(path) for path in segments)
+		finally:
+			if process.poll() is None:
+				# Let ffmpeg finish the segment it is writing
+				process.terminate()
+				try:
+					process.wait(timeout=10)
+				except subprocess.TimeoutExpired:
+					process.kill()
+					process.wait()
+		if process.returncode not in (0, -15, 255) and self._active(recording):
+			with open(log_path, 'rb') as log:
+				log.seek(start)
+				errors = log.read()[-2000:].decode('utf-8', 'replace').strip()
+			raise RuntimeError(errors.splitlines()[-1] if errors else f"ffmpeg exited with {process.returncode}")
+
+	def metrics(self):
+		"""Get the scheduler state."""
+		with self.lock:
+			states = [recording["state"] for recording in self.recordings.values()]
+		return {
+			"recording": states.count("recording"),
+			"scheduled": states.count("scheduled"),
+			"max_concurrent": self.max_concurrent,
+			"bandwidth": self.bandwidth.rate,
+			"io_rate": self.io_budget.rate,
+			"counters": dict(self.counters)
+		}
@@ -18,6 +18,8 @@ source ./.venv/bin/activate
 # Install required packages
 pip install -r requirements.txt
 
-# Run the application
+# Run the application. IPMPV writes and rotates its own log; the console
+# file only gets what is printed before logging starts and hard crashes.
 echo "Starting..."
-python main.py &> ipmpv.log
+export IPMPV_LOG_FILE="${IPMPV_LOG_FILE:-ipmpv.log}"
+python main.py &> ipmpv-console.log
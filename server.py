@@ -1,19 +1,31 @@
 #!/usr/bin/python
 """Flask server for IPMPV."""
 
+import hashlib
+import json
 import os
+import queue
 import re
-import subprocess
 import threading
+import time
 import flask
-from flask import request, jsonify, send_from_directory, redirect, url_for, make_response
+from werkzeug.serving import make_server
+from flask import request, jsonify, redirect, url_for, make_response, Response
 from localization import localization, _
-from utils import is_valid_url, change_resolution, get_current_resolution, is_wayland, get_or_create_secret_key
+from assets import StaticAssets
+from events import events
+from logs import logs
+from profiles import DEFAULT_PROFILE
+from supervisor import ProcessSupervisor
+from utils import is_valid_url, is_wayland, get_or_create_secret_key, get_process_stats, diagnostics_enabled
+
+# Words accepted for the boolean fields of batch commands
+BATCH_FLAGS = {"true": True, "on": True, "1": True, "false": False, "off": False, "0": False}
 
 class IPMPVServer:
 	"""Flask server for IPMPV web interface."""
 
-	def __init__(self, channels, player, to_qt_queue, from_qt_queue, resolution, ipmpv_retroarch_cmd, volume_control=None):
+	def __init__(self, channels, player, to_qt_queue, from_qt_queue, display, ipmpv_retroarch_cmd, volume_control=None, startup=None):
 		"""Initialize the server."""
 		self.app = flask.Flask(__name__,
 							  static_folder='static',
@@ -22,18 +34,100 @@ class IPMPVServer:
 		self.player = player
 		self.to_qt_queue = to_qt_queue
 		self.from_qt_queue = from_qt_queue
-		self.resolution = resolution
+		self.display = display
 		self.ipmpv_retroarch_cmd = ipmpv_retroarch_cmd
-		self.retroarch_p = None
 		self.volume_control = volume_control
+		self.startup = startup
+		self.osd_stats = None
+		self.osd_stats_event = threading.Event()
+		self.profile_lock = threading.Lock()
+		self.memory_tracker = None
+		self.prober = None
+		self.state = None
+		self.control = None
+		self.fleet = None
+		self.recorder = None
+
+		# Static files and the service worker are served from memory
+		self.assets = StaticAssets(os.path.join(os.path.dirname(__file__), 'static'))
+		self._build_service_worker()
+
+		# Supervise RetroArch, adopting an instance left by a previous run
+		retroarch_env = os.environ.copy()
+		retroarch_env["MESA_GL_VERSION_OVERRIDE"] = "3.3"
+		self.retroarch = ProcessSupervisor(
+			"RetroArch",
+			re.split("\\s", ipmpv_retroarch_cmd if ipmpv_retroarch_cmd is not None else 'retroarch'),
+			env=retroarch_env,
+			pidfile=os.path.join(os.path.dirname(__file__), '.retroarch.pid')
+		)
+		self.retroarch.add_listener(lambda event, supervisor: events.publish(
+			'retroarch', state=supervisor.is_running()))
+		self.retroarch.add_listener(self._yield_player)
 
 		# Register routes
 		self._register_routes()
 
+		# Listen for messages coming back from the Qt process
+		threading.Thread(target=self._qt_listener, daemon=True).start()
+
+	def _build_service_worker(self):
+		"""Fill in the service worker template with the current asset URLs."""
+		precache_urls = self.assets.urls()
+		with open(os.path.join(os.path.dirname(__file__), 'templates', 'sw.js'), 'r', encoding='utf-8') as f:
+			sw = f.read()
+		sw = sw.replace("%PRECACHE_URLS%", json.dumps(precache_urls))
+		sw = sw.replace("%CACHE_VERSION%", hashlib.sha256(sw.encode('utf-8')).hexdigest()[:12])
+		self.assets.add('sw.js', sw.encode('utf-8'))
+
+	def _yield_player(self, event, supervisor):
+		"""Release the decoder while RetroArch runs and resume playback afterwards."""
+		if self.player is None:
+			return
+		if event == "started":
+			self.player.suspend()
+		elif event == "exited":
+			self.player.resume(self.channels)
+		else:
+			return
+		events.publish('player', suspended=self.player.suspended_index is not None,
+					   **self.player.yield_timings)
+
+	def _qt_listener(self):
+		"""Collect messages sent back by the Qt process."""
+		while True:
+			message = self.from_qt_queue.get()
+			if message.get('action') == 'process_stats':
+				self.osd_stats = message
+				self.osd_stats_event.set()
+				if not message.get('requested'):
+					print(f"OSD process: RSS {message['rss_kb']} KiB, Qt import {message['import_ms']} ms")
+
 
 	def run(self, host="0.0.0.0", port=5000):
 		"""Run the Flask server."""
-		self.app.run(host=host, port=port)
+		# Bind the socket first so the remote can connect while the
+		# remaining subsystems are still starting up.
+		http_server = make_server(host, port, self.app, threaded=True)
+		if self.startup is not None:
+			self.startup.mark("http")
+		print(f"Listening on http://{host}:{port}")
+		http_server.serve_forever()
+
+	def _not_ready(self, *subsystems):
+		"""
+		Check whether the given subsystems have finished starting up.
+
+		Returns:
+			A 503 response if any of them is not ready yet, None otherwise.
+		"""
+		if self.startup is None:
+			return None
+		for name in subsystems:
+			if not self.startup.is_ready(name):
+				return jsonify(error=f"{name} is not ready", health=self.startup.status()), 503
+		return None
+
 	def _register_routes(self):
 		"""Register Flask routes."""
 
@@ -43,6 +137,18 @@ class IPMPVServer:
 			localization.set_language(language, response)
 			return response
 
+		@self.app.route("/locales/<language>.json")
+		def locale_bundle(language):
+			return self._handle_locale_bundle(language)
+
+		@self.app.route("/health")
+		def health():
+			return self._handle_health()
+
+		@self.app.route("/events")
+		def event_stream():
+			return self._handle_events()
+
 		@self.app.route("/")
 		def index():
 			return self._handle_index()
@@ -79,10 +185,66 @@ class IPMPVServer:
 		def toggle_latency():
 			return self._handle_toggle_latency()
 
+		@self.app.route("/profile")
+		def profile():
+			return self._handle_profile()
+
+		@self.app.route("/api/diag/profile")
+		def diag_profile():
+			return self._handle_diag_profile()
+
+		@self.app.route("/api/diag/memory")
+		def diag_memory():
+			return self._handle_diag_memory()
+
+		@self.app.route("/api/diag/threads")
+		def diag_threads():
+			return self._handle_diag_threads()
+
+		@self.app.route("/api/diag/osd")
+		def diag_osd():
+			return self._handle_diag_osd()
+
+		@self.app.route("/api/logs")
+		def api_logs():
+			return self._handle_logs()
+
+		@self.app.route("/api/favourites")
+		def favourites():
+			return self._handle_favourites()
+
+		@self.app.route("/toggle_favourite")
+		def toggle_favourite():
+			return self._handle_toggle_favourite()
+
+		@self.app.route("/api/epg")
+		def epg():
+			return self._handle_epg()
+
+		@self.app.route("/api/liveness")
+		def liveness():
+			return self._handle_liveness()
+
+		@self.app.route("/api/tuning")
+		def tuning():
+			return self._handle_tuning()
+
+		@self.app.route("/api/stream_health")
+		def stream_health():
+			return self._handle_stream_health()
+
+		@self.app.route("/api/buffering")
+		def buffering():
+			return self._handle_buffering()
+
 		@self.app.route("/toggle_resolution")
 		def toggle_resolution():
 			return self._handle_toggle_resolution()
 
+		@self.app.route("/mode_override")
+		def mode_override():
+			return self._handle_mode_override()
+
 		@self.app.route("/volume_up")
 		def volume_up():
 			return self._handle_volume_up()
@@ -91,6 +253,66 @@ class IPMPVServer:
 		def volume_down():
 			return self._handle_volume_down()
 
+		@self.app.route("/set_volume")
+		def set_volume():
+			return self._handle_set_volume()
+
+		@self.app.route("/set_deinterlace")
+		def set_deinterlace():
+			return self._handle_set_deinterlace()
+
+		@self.app.route("/fleet/catalog")
+		def fleet_catalog():
+			return self._handle_fleet_catalog()
+
+		@self.app.route("/fleet/logo/<key>")
+		def fleet_logo(key):
+			return self._handle_fleet_logo(key)
+
+		@self.app.route("/fleet/epg")
+		def fleet_epg():
+			return self._handle_fleet_epg()
+
+		@self.app.route("/api/fleet")
+		def fleet_metrics():
+			return self._handle_fleet_metrics()
+
+		@self.app.route("/timeshift/pause")
+		def timeshift_pause():
+			return self._handle_timeshift_pause()
+
+		@self.app.route("/timeshift/seek")
+		def timeshift_seek():
+			return self._handle_timeshift_seek()
+
+		@self.app.route("/timeshift/live")
+		def timeshift_live():
+			return self._handle_timeshift_live()
+
+		@self.app.route("/timeshift/stop")
+		def timeshift_stop():
+			return self._handle_timeshift_stop()
+
+		@self.app.route("/api/timeshift")
+		def timeshift_status():
+			return self._handle_timeshift_status()
+
+		@self.app.route("/api/recordings", methods=["GET", "POST"])
+		def recordings():
+			return self._handle_recordings()
+
+		@self.app.route("/api/recordings/<int:recording_id>", methods=["DELETE"])
+		def cancel_recording(recording_id):
+			return self._handle_cancel_recording(recording_id)
+
+		@self.app.route("/api/control")
+		def control_metrics():
+			return self._handle_control_metrics()
+
+		@self.app.route("/api/batch", methods=["POST"])
+		def batch():
+			return self._handle_batch()
+
 		@self.app.route("/toggle_mute")
 		def toggle_mute():
 			return self._handle_toggle_mute()
@@ -103,33 +325,40 @@ class IPMPVServer:
 		def channel_down():
 			return self._handle_channel_down()
 
+		@self.app.route('/assets/<path:filename>')
+		def serve_asset(filename):
+			return self.assets.serve_fingerprinted(filename)
+
+		@self.app.route('/sw.js')
+		def serve_service_worker():
+			return self.assets.serve('sw.js')
+
+		# Unversioned URLs kept for installed PWAs and crawlers
 		@self.app.route('/manifest.json')
 		def serve_manifest():
-			return send_from_directory("static", 'manifest.json',
-								  mimetype='application/manifest+json')
+			return self.assets.serve('manifest.json')
 
 		@self.app.route('/icon512_rounded.png')
 		def serve_rounded_icon():
-			return send_from_directory("static", 'icon512_rounded.png',
-								  mimetype='image/png')
+			return self.assets.serve('icon512_rounded.png')
 
 		@self.app.route('/icon512_maskable.png')
 		def serve_maskable_icon():
-			return send_from_directory("static", 'icon512_maskable.png',
-								  mimetype='image/png')
+			return self.assets.serve('icon512_maskable.png')
 
 		@self.app.route('/screenshot1.png')
 		def serve_screenshot_1():
-			return send_from_directory("static", 'screenshot1.png',
-								  mimetype='image/png')
+			return self.assets.serve('screenshot1.png')
 
 		@self.app.route('/favicon.ico')
 		def serve_favicon():
-			return send_from_directory("static", 'favicon.ico',
-								  mimetype='image/vnd.microsoft.icon')
+			return self.assets.serve('favicon.ico')
+
 	def _handle_index(self):
 		"""Handle the index route."""
 		from channels import group_channels
+
+		render_start = time.perf_counter()
 		
 		grouped_channels = group_channels(self.channels)
 		flat_channel_list = [channel for channel in self.channels]
@@ -142,8 +371,9 @@ class IPMPVServer:
 			channel_groups_html += f'<div class="group">{translated_group}'
 			for channel in ch_list:
 				index = flat_channel_list.index(channel)  # Get correct global index
+				dead = ' dead' if self.prober is not None and self.prober.is_dead(channel['url']) else ''
 				channel_groups_html += f'''
-					<div class="channel">
+					<div class="channel{dead}">
 						<img src="{channel['logo']}" onerror="this.style.display='none'">
 						<button onclick="changeChannel({index})">{channel['name']}</button>
 					</div>
@@ -155,31 +385,33 @@ class IPMPVServer:
 		languages = {
 			'en': 'English',
 			'es': 'Español'
-			# Add more languages here as you support them
+			# Add more language names here as you support them
 		}
 		
 		language_selector_html = ""
-		for code, name in languages.items():
+		for code in localization.available_languages:
+			name = languages.get(code, code)
 			selected = ' selected' if code == current_language else ''
 			language_selector_html += f'<option value="{code}"{selected}>{name}</option>'
 		
+		player = self.player
+
 		# Replace placeholders with actual values, using translation
 		html = open("templates/index.html").read()
 		html = html.replace("%WELCOME_TEXT%", _("welcome_to_ipmpv"))
 		html = html.replace("%CURRENT_CHANNEL_LABEL%", _("current_channel"))
 		html = html.replace("%CURRENT_CHANNEL%", 
-						  self.channels[self.player.current_index]['name'] 
-						  if self.player.current_index is not None else "None")
-		html = html.replace("%RETROARCH_STATE%", 
-						  "ON" if self.retroarch_p and self.retroarch_p.poll() is None else "OFF")
-		html = html.replace("%RETROARCH_LABEL%", 
-						  _("stop_retroarch") if self.retroarch_p and self.retroarch_p.poll() is None else _("start_retroarch"))
+						  self.channels[player.current_index]['name']
+						  if player is not None and player.current_index is not None else "None")
+		retroarch_running = self.retroarch.is_running()
+		html = html.replace("%RETROARCH_STATE%", "ON" if retroarch_running else "OFF")
+		html = html.replace("%RETROARCH_LABEL%", _("stop_retroarch") if retroarch_running else _("start_retroarch"))
 		html = html.replace("%DEINTERLACE_LABEL%", _("deinterlacing"))
-		html = html.replace("%DEINTERLACE_STATE%", _("on") if self.player.deinterlace else _("off"))
+		html = html.replace("%DEINTERLACE_STATE%", _("on") if player is not None and player.deinterlace else _("off"))
 		html = html.replace("%RESOLUTION_LABEL%", _("resolution"))
-		html = html.replace("%RESOLUTION%", self.resolution)
-		html = html.replace("%LATENCY_STATE%", "ON" if self.player.low_latency else "OFF")
-		html = html.replace("%LATENCY_LABEL%", _("latency_low") if self.player.low_latency else _("latency_high"))
+		html = html.replace("%RESOLUTION%", self.display.get_mode() if self.display is not None else "UNK")
+		html = html.replace("%LATENCY_STATE%", "ON" if player is not None and player.low_latency else "OFF")
+		html = html.replace("%LATENCY_LABEL%", _("latency_low") if player is not None and player.low_latency else _("latency_high"))
 		html = html.replace("%CHANNEL_GROUPS%", channel_groups_html)
 		html = html.replace("%VOLUME_LABEL%", _("volume"))
 		html = html.replace("%MUTE_LABEL%", _("mute"))
@@ -193,33 +425,78 @@ class IPMPVServer:
 		html = html.replace("%STOP_LABEL%", _("stop"))
 		html = html.replace("%LANGUAGE_SELECTOR%", language_selector_html)
 
-		html = html.replace("%JS_LOADING%", _("loading"))
-		html = html.replace("%JS_NOW_PLAYING%", _("now_playing"))
-		html = html.replace("%JS_ERROR%", _("error"))
-		html = html.replace("%JS_CONNECTION_ERROR%", _("connection_error"))
-		html = html.replace("%JS_LOADING_CHANNEL%", _("loading_channel"))
-		html = html.replace("%JS_ERROR_LOADING_CHANNEL%", _("error_loading_channel"))
-		html = html.replace("%JS_VOLUME_LEVEL%", _("volume_level"))
-		html = html.replace("%JS_MUTED_YES%", _("muted_yes"))
-		html = html.replace("%JS_MUTED_NO%", _("muted_no"))
-		html = html.replace("%JS_LATENCY_LOW%", _("latency_low"))
-		html = html.replace("%JS_LATENCY_HIGH%", _("latency_high"))
-		html = html.replace("%JS_STOP_RETROARCH%", _("stop_retroarch"))
-		html = html.replace("%JS_START_RETROARCH%", _("start_retroarch"))
-		html = html.replace("%JS_ON_LABEL%", _("on"))
-		html = html.replace("%JS_OFF_LABEL%", _("off"))
-		
-		return html
+		html = html.replace("%LOCALE_BUNDLE_URL%", localization.get_bundle_url(current_language))
+		html = html.replace("%MANIFEST_URL%", self.assets.url_for('manifest.json'))
+		html = html.replace("%FAVICON_URL%", self.assets.url_for('favicon.ico'))
+		html = html.replace("%TOUCH_ICON_URL%", self.assets.url_for('icon512_rounded.png'))
+
+		response = make_response(html)
+		# Expose the render cost to the browser's devtools
+		response.headers['Server-Timing'] = (f'render;dur={(time.perf_counter() - render_start) * 1000:.2f}, '
+											 f'languages;desc="{len(localization.available_languages)}"')
+		return response
+
+	def _handle_events(self):
+		"""Handle the events route, streaming state changes as server-sent events."""
+		subscriber = events.subscribe()
+
+		def stream():
+			try:
+				while True:
+					try:
+						message = subscriber.get(timeout=15)
+					except queue.Empty:
+						# Keep the connection alive through proxies
+						yield ": keepalive\n\n"
+						continue
+					yield f"data: {json.dumps(message)}\n\n"
+			finally:
+				events.unsubscribe(subscriber)
+
+		return Response(stream(), mimetype='text/event-stream',
+						headers={'Cache-Control': 'no-cache'})
+
+	def _handle_locale_bundle(self, language):
+		"""Handle the locale bundle route."""
+		bundle, version = localization.get_bundle(language)
+		if bundle is None:
+			return jsonify(error=f"Unknown language: {language}"), 404
+
+		etag = f'"{version}"'
+		if request.headers.get('If-None-Match') == etag:
+			response = make_response("", 304)
+		else:
+			response = jsonify(bundle)
+		response.headers['ETag'] = etag
+		if request.args.get('v') == version:
+			# The version is part of the URL, so this exact bundle never changes
+			response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+		else:
+			response.headers['Cache-Control'] = 'no-cache'
+		return response
+
+	def _handle_health(self):
+		"""Handle the health route."""
+		if self.startup is None:
+			return jsonify(ready=True, stages={})
+		status = self.startup.status()
+		status["processes"] = {
+			"main": get_process_stats(),
+			"osd": self.osd_stats
+		}
+		return jsonify(status), 200 if status["ready"] else 503
 
 	def _handle_play_custom(self):
 		"""Handle the play_custom route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
 		url = request.args.get("url")
 
 		if not url or not is_valid_url(url):
 			return jsonify(success=False, error=_("invalid_url"))
 
-		self.player.player.loadfile(url)
-		self.player.current_index = None
+		self.player.play_url(url)
 		return jsonify(success=True)
 
 	def _handle_hide_osd(self):
@@ -231,16 +508,13 @@ class IPMPVServer:
 
 	def _handle_show_osd(self):
 		"""Handle the show_osd route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
 		if self.player.current_index is not None:
-			channel_info = {
-				"name": self.channels[self.player.current_index]["name"],
-				"deinterlace": self.player.deinterlace,
-				"low_latency": self.player.low_latency,
-				"logo": self.channels[self.player.current_index]["logo"]
-			}
 			self.to_qt_queue.put({
 				'action': 'show_osd',
-				'channel_info': channel_info
+				'channel_info': self.player.channel_info(self.channels[self.player.current_index])
 			})
 			self.to_qt_queue.put({
 				'action': 'update_codecs',
@@ -253,6 +527,9 @@ class IPMPVServer:
 
 	def _handle_switch_channel(self):
 		"""Handle the switch_channel route."""
+		busy = self._not_ready("player", "catalog")
+		if busy:
+			return busy
 		self.player.stop()
 		index = int(request.args.get("index", self.player.current_index))
 		thread = threading.Thread(
@@ -263,9 +540,34 @@ class IPMPVServer:
 		thread.start()
 		return "", 204
 
+	def _next_live_index(self, step, current=None):
+		"""
+		Get the next channel in the given direction, skipping channels the prober found dead.
+
+		Args:
+			step (int): 1 for channel up, -1 for channel down.
+			current (int, optional): Channel to start from. Defaults to the playing one.
+
+		Returns:
+			int: Channel index. The adjacent channel if every channel looks dead.
+		"""
+		if current is None:
+			current = self.player.current_index
+		first = current + step if current is not None else (0 if step > 0 else -1)
+		if self.prober is None or not self.channels:
+			return first
+		for offset in range(len(self.channels)):
+			index = (first + offset * step) % len(self.channels)
+			if not self.prober.is_dead(self.channels[index]['url']):
+				return index
+		return first
+
 	def _handle_channel_up(self):
 		"""Handle the channel_up route."""
-		index = self.player.current_index + 1 if self.player.current_index is not None else 0;
+		busy = self._not_ready("player", "catalog")
+		if busy:
+			return busy
+		index = self._next_live_index(1)
 		thread = threading.Thread(
 			target=self.player.play_channel,
 			args=(index,self.channels),
@@ -276,7 +578,10 @@ class IPMPVServer:
 
 	def _handle_channel_down(self):
 		"""Handle the channel_down route."""
-		index = self.player.current_index - 1 if self.player.current_index is not None else -1;
+		busy = self._not_ready("player", "catalog")
+		if busy:
+			return busy
+		index = self._next_live_index(-1)
 		thread = threading.Thread(
 			target=self.player.play_channel,
 			args=(index,self.channels),
@@ -287,11 +592,17 @@ class IPMPVServer:
 
 	def _handle_toggle_deinterlace(self):
 		"""Handle the toggle_deinterlace route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
 		state = self.player.toggle_deinterlace()
 		return jsonify(state=state)
 
 	def _handle_stop_player(self):
 		"""Handle the stop_player route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
 		self.to_qt_queue.put({
 			'action': 'close_osd',
 		})
@@ -300,58 +611,582 @@ class IPMPVServer:
 
 	def _handle_toggle_retroarch(self):
 		"""Handle the toggle_retroarch route."""
-		retroarch_pid = subprocess.run(["pgrep", "-fx", "retroarch"], stdout=subprocess.PIPE).stdout.strip()
-		if retroarch_pid:
-			print("Retroarch already open. Trying to close it.")
-			subprocess.run(["kill", retroarch_pid])
-			if self.retroarch_p:
-				self.retroarch_p.terminate()
+		if self.retroarch.is_running():
+			# Stopping may take up to the SIGKILL timeout, don't hold the request
+			threading.Thread(target=self.retroarch.stop, daemon=True).start()
 			return jsonify(state=False)
-		else:
-			print("Launching RetroArch")
-			retroarch_env = os.environ.copy()
-			retroarch_env["MESA_GL_VERSION_OVERRIDE"] = "3.3"
-			self.retroarch_p = subprocess.Popen(re.split("\\s", self.ipmpv_retroarch_cmd
-													   if self.ipmpv_retroarch_cmd is not None
-													   else 'retroarch'), env=retroarch_env)
-			return jsonify(state=True)
+		return jsonify(state=self.retroarch.start())
 
 	def _handle_toggle_latency(self):
 		"""Handle the toggle_latency route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
 		state = self.player.toggle_latency()
-		return jsonify(state=state)
+		return jsonify(state=state, profile=self.player.profile)
+
+	def _handle_profile(self):
+		"""Handle the profile route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
+		name = request.args.get("name")
+		if name is not None and not self.player.set_profile(name):
+			return jsonify(error=f"Unknown profile: {name}"), 404
+		return jsonify(
+			profile=self.player.profile,
+			profiles=sorted(self.player.profiles),
+			low_latency=self.player.low_latency,
+			timings_ms=self.player.profile_timings
+		)
+
+	def _handle_diag_profile(self):
+		"""Handle the diag/profile route."""
+		if not diagnostics_enabled:
+			return jsonify(error="Diagnostics are not enabled"), 404
+		from diagnostics import sample_profile
+		try:
+			seconds = min(60.0, float(request.args.get("seconds", "5")))
+			interval = max(1.0, float(request.args.get("interval_ms", "5"))) / 1000
+		except ValueError:
+			return jsonify(error="Invalid seconds or interval_ms"), 400
+		if not self.profile_lock.acquire(blocking=False):
+			return jsonify(error="A profile is already running"), 409
+		try:
+			stacks, samples = sample_profile(seconds, interval)
+		finally:
+			self.profile_lock.release()
+		lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+		response = make_response("\n".join(lines) + "\n")
+		response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+		response.headers['X-Samples'] = str(samples)
+		return response
+
+	def _handle_diag_memory(self):
+		"""Handle the diag/memory route."""
+		if not diagnostics_enabled:
+			return jsonify(error="Diagnostics are not enabled"), 404
+		from diagnostics import MemoryTracker
+		if self.memory_tracker is None:
+			self.memory_tracker = MemoryTracker()
+		if request.args.get("stop"):
+			self.memory_tracker.stop()
+			return jsonify(tracing=False)
+		group_by = request.args.get("group_by", "lineno")
+		if group_by not in ("lineno", "filename", "traceback"):
+			return jsonify(error=f"Unknown group_by: {group_by}"), 400
+		limit = request.args.get("limit", "20")
+		snapshot = self.memory_tracker.snapshot(
+			limit=int(limit) if limit.isdigit() else 20,
+			diff=bool(request.args.get("diff")),
+			group_by=group_by
+		)
+		return jsonify(process=get_process_stats(), **snapshot)
+
+	def _handle_diag_threads(self):
+		"""Handle the diag/threads route."""
+		if not diagnostics_enabled:
+			return jsonify(error="Diagnostics are not enabled"), 404
+		from diagnostics import thread_stats
+		return jsonify(process=get_process_stats(), **thread_stats())
+
+	def _handle_diag_osd(self):
+		"""Handle the diag/osd route."""
+		if not diagnostics_enabled:
+			return jsonify(error="Diagnostics are not enabled"), 404
+		busy = self._not_ready("osd")
+		if busy:
+			return busy
+		# Ask the OSD process for fresh numbers over the command queue
+		self.osd_stats_event.clear()
+		self.to_qt_queue.put({'action': 'report_stats'})
+		fresh = self.osd_stats_event.wait(2)
+		return jsonify(fresh=fresh, **(self.osd_stats or {}))
+
+	def _handle_logs(self):
+		"""Handle the logs route."""
+		limit = request.args.get("limit", "200")
+		limit = int(limit) if limit.isdigit() else 200
+		return jsonify(
+			stats=logs.stats(),
+			entries=logs.recent(limit, level=request.args.get("level"), source=request.args.get("source"))
+		)
+
+	def _handle_favourites(self):
+		"""Handle the favourites route."""
+		from channels import channel_key
+		busy = self._not_ready("catalog", "state")
+		if busy:
+			return busy
+		favourites = set(self.state.get("favourites", []))
+		mru = self.state.get("mru", [])
+		keys = [channel_key(channel) for channel in self.channels]
+		return jsonify(
+			favourites=[index for index, key in enumerate(keys) if key in favourites],
+			recent=[keys.index(key) for key in mru if key in keys]
+		)
+
+	def _handle_toggle_favourite(self):
+		"""Handle the toggle_favourite route."""
+		busy = self._not_ready("player", "catalog", "state")
+		if busy:
+			return busy
+		try:
+			channel = self.channels[int(request.args.get("index", self.player.current_index))]
+		except (TypeError, ValueError, IndexError):
+			return jsonify(error="Invalid channel index"), 400
+		return jsonify(name=channel["name"], favourite=self.state.toggle_favourite(channel))
+
+	def _handle_epg(self):
+		"""Handle the epg route."""
+		busy = self._not_ready("player", "catalog")
+		if busy:
+			return busy
+		if self.player.epg is None:
+			return jsonify(error="No EPG configured"), 404
+		index = request.args.get("index", self.player.current_index)
+		programmes = None
+		if index is not None:
+			try:
+				channel = self.channels[int(index)]
+			except (ValueError, IndexError):
+				return jsonify(error="Invalid channel index"), 400
+			programmes = dict(self.player.epg.now_next(channel), name=channel["name"])
+		return jsonify(stats=self.player.epg.stats, channel=programmes)
+
+	def _handle_liveness(self):
+		"""Handle the liveness route."""
+		busy = self._not_ready("catalog")
+		if busy:
+			return busy
+		if self.prober is None:
+			return jsonify(error="Channel probing is not enabled"), 404
+		return jsonify(self.prober.metrics(self.channels))
+
+	def _handle_tuning(self):
+		"""Handle the tuning route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
+		return jsonify(timeout_secs=self.player.tune_timeout, tuning=self.player.tuning,
+					   channels=self.player.tune_stats)
+
+	def _handle_stream_health(self):
+		"""Handle the stream_health route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
+		if self.player.health_monitor is None:
+			return jsonify(error="Stream health monitoring is not enabled"), 404
+		return jsonify(self.player.health_monitor.metrics())
+
+	def _handle_buffering(self):
+		"""Handle the buffering route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
+		if self.player.buffer_controller is None:
+			return jsonify(error="Adaptive buffering is not enabled"), 404
+		return jsonify(self.player.buffer_controller.metrics())
 
 	def _handle_toggle_resolution(self):
 		"""Handle the toggle_resolution route."""
-		self.resolution = change_resolution(self.resolution)
-		return jsonify(res=self.resolution)
+		busy = self._not_ready("display")
+		if busy:
+			return busy
+		# The switch runs in the background; report the requested mode right away
+		mode = self.display.toggle()
+		return jsonify(res=mode, pending=self.display.pending_mode is not None)
+
+	def _handle_mode_override(self):
+		"""Handle the mode_override route."""
+		busy = self._not_ready("player", "catalog")
+		if busy:
+			return busy
+		policy = self.player.mode_policy
+		if policy is None:
+			return jsonify(error="Automatic mode matching is not enabled"), 404
+		if self.player.current_index is None:
+			return jsonify(error="No channel is playing"), 400
+		channel_name = self.channels[self.player.current_index]["name"]
+		# "auto" clears the override, "off" disables switching for this channel
+		mode = request.args.get("mode", "auto")
+		if not policy.set_override(channel_name, None if mode == "auto" else mode):
+			return jsonify(error=f"Unknown mode: {mode}"), 400
+		return jsonify(channel=channel_name, mode=mode)
 
 	def _handle_volume_up(self):
 		"""Handle the volume_up route."""
+		busy = self._not_ready("mixer")
+		if busy:
+			return busy
 		if self.volume_control:
 			step = request.args.get("step")
 			step = int(step) if step and step.isdigit() else None
 			new_volume = self.volume_control.volume_up(step)
+			self._remember_volume()
 			return jsonify(volume=new_volume, muted=self.volume_control.is_muted())
 		return jsonify(error="Volume control not available"), 404
 
 	def _handle_volume_down(self):
 		"""Handle the volume_down route."""
+		busy = self._not_ready("mixer")
+		if busy:
+			return busy
 		if self.volume_control:
 			step = request.args.get("step")
 			step = int(step) if step and step.isdigit() else None
 			new_volume = self.volume_control.volume_down(step)
+			self._remember_volume()
 			return jsonify(volume=new_volume, muted=self.volume_control.is_muted())
 		return jsonify(error="Volume control not available"), 404
 
+	def _handle_set_volume(self):
+		"""Handle the set_volume route."""
+		busy = self._not_ready("mixer")
+		if busy:
+			return busy
+		level = request.args.get("level")
+		muted = request.args.get("muted")
+		if level is not None and not level.isdigit():
+			return jsonify(error="Invalid volume level"), 400
+		volume, is_muted = self.volume_control.set_volume(
+			int(level) if level is not None else None,
+			muted.lower() in ("1", "true", "yes", "on") if muted is not None else None
+		)
+		self._remember_volume()
+		return jsonify(volume=volume, muted=is_muted)
+
+	def _handle_set_deinterlace(self):
+		"""Handle the set_deinterlace route."""
+		busy = self._not_ready("player")
+		if busy:
+			return busy
+		state = request.args.get("state", "on").lower() in ("1", "true", "yes", "on")
+		return jsonify(state=self.player.set_deinterlace(state))
+
+	def _fleet_origin(self):
+		"""Get the fleet origin, or None if this node isn't one."""
+		return self.fleet if self.fleet is not None and self.fleet.role == "origin" else None
+
+	def _handle_fleet_catalog(self):
+		"""Handle the fleet catalog route."""
+		origin = self._fleet_origin()
+		if origin is None:
+			return jsonify(error="Not a fleet origin"), 404
+		version, body = origin.snapshot(request.args.get("since"))
+		if version is None:
+			return jsonify(error="catalog is not ready"), 503
+		if body is None:
+			return "", 304
+		return Response(body, mimetype='application/json', headers={
+			'Content-Encoding': 'gzip',
+			'ETag': f'"{version}"',
+			'Cache-Control': 'no-cache'
+		})
+
+	def _handle_fleet_logo(self, key):
+		"""Handle the fleet logo route."""
+		origin = self._fleet_origin()
+		if origin is None:
+			return jsonify(error="Not a fleet origin"), 404
+		data, content_type = origin.logo(key)
+		if data is None:
+			return jsonify(error="Logo not available"), 404
+		# The key is a hash of the logo URL, so a new logo gets a new key. Logos come
+		# from the provider: an SVG opened directly mustn't run script in this origin
+		return Response(data, mimetype=content_type, headers={
+			'Cache-Control': 'public, max-age=86400',
+			'Content-Security-Policy': "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+			'X-Content-Type-Options': 'nosniff'
+		})
+
+	def _handle_fleet_epg(self):
+		"""Handle the fleet EPG route."""
+		origin = self._fleet_origin()
+		if origin is None:
+			return jsonify(error="Not a fleet origin"), 404
+		version, body = origin.epg_snapshot()
+		if body is None:
+			return jsonify(error="No programme guide"), 404
+		etag = f'"{version}"'
+		if request.headers.get('If-None-Match') == etag:
+			return "", 304
+		return Response(body, mimetype='application/json', headers={'Content-Encoding': 'gzip', 'ETag': etag})
+
+	def _handle_fleet_metrics(self):
+		"""Handle the fleet metrics route."""
+		if self.fleet is None:
+			return jsonify(error="Fleet mode disabled"), 404
+		return jsonify(self.fleet.metrics())
+
+	def _timeshift(self):
+		"""
+		Get the timeshift subsystem.
+
+		Returns:
+			tuple: (Timeshift, None), or (None, error response) if it isn't available.
+		"""
+		busy = self._not_ready("player")
+		if busy:
+			return None, busy
+		if self.player.timeshift is None:
+			return None, (jsonify(error="Timeshift disabled"), 404)
+		return self.player.timeshift, None
+
+	def _handle_timeshift_pause(self):
+		"""Handle the timeshift pause route."""
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		if self.player.current_index is None and not timeshift.active:
+			return jsonify(error="No channel playing"), 409
+		channel = self.channels[self.player.current_index] if self.player.current_index is not None else None
+		paused = timeshift.toggle_pause(channel)
+		if not timeshift.active:
+			return jsonify(error=timeshift.error), 409
+		return jsonify(paused=paused, **timeshift.status())
+
+	def _handle_timeshift_seek(self):
+		"""Handle the timeshift seek route."""
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		try:
+			seconds = float(request.args.get("secs", "-30"))
+		except ValueError:
+			return jsonify(error="Invalid seconds"), 400
+		if not timeshift.seek(seconds):
+			return jsonify(error="Timeshift not active"), 409
+		return jsonify(timeshift.status())
+
+	def _handle_timeshift_live(self):
+		"""Handle the timeshift live route."""
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		if not timeshift.jump_live():
+			return jsonify(error="Timeshift not active"), 409
+		return jsonify(timeshift.status())
+
+	def _handle_timeshift_stop(self):
+		"""Handle the timeshift stop route."""
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		timeshift.stop(resume_live=True)
+		return jsonify(timeshift.status())
+
+	def _handle_timeshift_status(self):
+		"""Handle the timeshift status route."""
+		timeshift, error = self._timeshift()
+		if error:
+			return error
+		return jsonify(timeshift.status())
+
+	def _handle_recordings(self):
+		"""Handle the recordings route: list recordings, or schedule one."""
+		if self.recorder is None:
+			return jsonify(error="Recording disabled"), 404
+		if request.method == "GET":
+			return jsonify(recordings=self.recorder.list(), **self.recorder.metrics())
+
+		busy = self._not_ready("catalog")
+		if busy:
+			return busy
+		payload = request.get_json(silent=True) or {}
+		try:
+			channel = self.channels[int(payload["index"])]
+			title = payload.get("title")
+			if payload.get("programme") in ("now", "next"):
+				# Record a programme from the guide
+				if self.player.epg is None:
+					return jsonify(error="No programme guide"), 404
+				programme = self.player.epg.now_next(channel)[payload["programme"]]
+				if programme is None:
+					return jsonify(error="Programme not in the guide"), 404
+				start, stop = programme["start"], programme["stop"]
+				title = title or programme["title"]
+			else:
+				start = float(payload.get("start", time.time()))
+				stop = float(payload["stop"]) if "stop" in payload else start + float(payload["duration"]) * 60
+			recording = self.recorder.schedule(channel, start, stop, title)
+		except (KeyError, IndexError, TypeError, ValueError) as e:
+			return jsonify(error=f"Invalid recording: {e}"), 400
+		return jsonify(recording), 201
+
+	def _handle_cancel_recording(self, recording_id):
+		"""Handle the cancel recording route."""
+		if self.recorder is None:
+			return jsonify(error="Recording disabled"), 404
+		if not self.recorder.cancel(recording_id):
+			return jsonify(error="Unknown recording"), 404
+		return "", 204
+
+	def _handle_control_metrics(self):
+		"""Handle the control socket metrics route."""
+		if self.control is None:
+			return jsonify(error="Control socket disabled"), 404
+		return jsonify(self.control.metrics())
+
+	def _batch_int(self, command, key, default=None):
+		"""
+		Read an integer field of a batch command.
+
+		Raises:
+			KeyError: If the field is missing and there is no default.
+			TypeError: If the field isn't an integer or a string of one.
+		"""
+		value = command[key] if default is None else command.get(key, default)
+		if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+			return int(value)
+		if isinstance(value, int) and not isinstance(value, bool):
+			return value
+		raise TypeError(key)
+
+	def _batch_flag(self, command, key, default=True):
+		"""
+		Read a boolean field of a batch command.
+
+		Raises:
+			TypeError: If the field isn't a boolean, 0/1 or a boolean word.
+		"""
+		value = command.get(key, default)
+		if isinstance(value, bool):
+			return value
+		if isinstance(value, int) and value in (0, 1):
+			return bool(value)
+		if isinstance(value, str) and value.strip().lower() in BATCH_FLAGS:
+			return BATCH_FLAGS[value.strip().lower()]
+		raise TypeError(key)
+
+	def _plan_batch(self, commands):
+		"""
+		Work out the state a list of commands ends in, without applying anything.
+
+		Args:
+			commands (list): Command dictionaries, e.g. {"cmd": "volume_up", "step": 5}.
+
+		Returns:
+			dict: The final channel, volume, mute, profile, deinterlace and OSD
+				state. Keys that no command touches are left out.
+
+		Raises:
+			ValueError: If a command is unknown or malformed.
+		"""
+		plan = {}
+		for position, command in enumerate(commands):
+			if not isinstance(command, dict):
+				raise ValueError(f"command {position} is not an object")
+			name = command.get("cmd")
+			if not isinstance(name, str):
+				raise ValueError(f"command {position} has no cmd string")
+			try:
+				if name == "channel":
+					plan["channel"] = self._batch_int(command, "index")
+				elif name in ("channel_up", "channel_down"):
+					current = plan.get("channel", self.player.current_index)
+					plan["channel"] = self._next_live_index(1 if name == "channel_up" else -1, current)
+				elif name == "volume":
+					plan["volume"] = max(0, min(100, self._batch_int(command, "level")))
+				elif name in ("volume_up", "volume_down"):
+					step = self._batch_int(command, "step", self.volume_control.step)
+					volume = plan.get("volume", self.volume_control.get_volume())
+					plan["volume"] = max(0, min(100, volume + (step if name == "volume_up" else -step)))
+					if name == "volume_up":
+						plan["muted"] = False
+				elif name == "mute":
+					plan["muted"] = self._batch_flag(command, "state")
+				elif name == "toggle_mute":
+					plan["muted"] = not plan.get("muted", self.volume_control.is_muted())
+				elif name == "profile":
+					if not isinstance(command["name"], str):
+						raise TypeError("name")
+					if command["name"] not in self.player.profiles:
+						raise ValueError(f"command {position} ({name}) has an unknown profile {command['name']!r}")
+					plan["profile"] = command["name"]
+				elif name == "toggle_latency":
+					low_latency = plan.get("profile", self.player.profile) == "low-latency"
+					plan["profile"] = DEFAULT_PROFILE if low_latency else "low-latency"
+				elif name == "deinterlace":
+					plan["deinterlace"] = self._batch_flag(command, "state")
+				elif name == "toggle_deinterlace":
+					plan["deinterlace"] = not plan.get("deinterlace", self.player.deinterlace)
+				elif name in ("show_osd", "hide_osd"):
+					plan["osd"] = name == "show_osd"
+				else:
+					raise ValueError(f"command {position} is unknown: {name!r}")
+			except (KeyError, TypeError) as e:
+				raise ValueError(f"command {position} ({name}) is missing or has an invalid {e}")
+		return plan
+
+	def _handle_batch(self):
+		"""Handle the batch route."""
+		payload = request.get_json(silent=True)
+		commands = payload.get("commands") if isinstance(payload, dict) else payload
+		if not isinstance(commands, list):
+			return jsonify(error="Expected a JSON list of commands"), 400
+		names = {command.get("cmd") for command in commands
+				 if isinstance(command, dict) and isinstance(command.get("cmd"), str)}
+		needed = ["player"]
+		if names & {"channel", "channel_up", "channel_down"}:
+			needed.append("catalog")
+		if names & {"volume", "volume_up", "volume_down", "mute", "toggle_mute"}:
+			needed.append("mixer")
+		busy = self._not_ready(*needed)
+		if busy:
+			return busy
+		try:
+			plan = self._plan_batch(commands)
+		except ValueError as e:
+			return jsonify(error=str(e)), 400
+		if "channel" in plan and not self.channels:
+			return jsonify(error="No channels loaded"), 400
+
+		# Apply the end state only: settings first, so the tune uses them
+		if "profile" in plan:
+			self.player.set_profile(plan["profile"])
+		if "deinterlace" in plan:
+			self.player.set_deinterlace(plan["deinterlace"])
+		if "volume" in plan or "muted" in plan:
+			self.volume_control.set_volume(plan.get("volume"), plan.get("muted"))
+			self._remember_volume()
+		if "channel" in plan:
+			threading.Thread(
+				target=self.player.play_channel,
+				args=(plan["channel"], self.channels),
+				daemon=True
+			).start()
+		elif plan.get("osd") and self.player.current_index is not None:
+			self._handle_show_osd()
+		elif plan.get("osd") is False:
+			self._handle_hide_osd()
+
+		result = dict(plan)
+		result["profile"] = self.player.profile
+		result["deinterlace"] = self.player.deinterlace
+		if "channel" in plan:
+			result["channel"] = plan["channel"] % len(self.channels)
+		return jsonify(commands=len(commands), state=result)
+
 	def _handle_toggle_mute(self):
 		"""Handle the toggle_mute route."""
+		busy = self._not_ready("mixer")
+		if busy:
+			return busy
 		if self.volume_control:
 			is_muted = self.volume_control.toggle_mute()
 			volume = self.volume_control.get_volume()
+			self._remember_volume()
 			return jsonify(muted=is_muted, volume=volume)
 		return jsonify(error="Volume control not available"), 404
 
+	def _remember_volume(self):
+		"""Save the volume so it is restored after a restart."""
+		if self.state is not None:
+			self.state.set("volume", self.volume_control.get_volume())
+			self.state.set("muted", self.volume_control.is_muted())
+
 	def _handle_get_volume(self):
 		"""Handle the get_volume route."""
 		if self.volume_control:
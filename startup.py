@@ -0,0 +1,178 @@
+#!/usr/bin/python
+"""Staged startup for IPMPV."""
+
+import threading
+import time
+import traceback
+from utils import get_process_stats
+
+# Stage states
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+class StagedStartup:
+	"""
+	Run named initialization stages concurrently and track their state.
+
+	Each stage runs in its own daemon thread as soon as the stages it depends
+	on are ready, so the HTTP server can start listening before the slow
+	subsystems (catalog, player, mixer, OSD) have finished loading.
+	"""
+
+	def __init__(self, t0=None):
+		"""
+		Initialize the startup tracker.
+
+		Args:
+			t0 (float, optional): time.monotonic() value that timings are relative to.
+				Defaults to now.
+		"""
+		self.t0 = t0 if t0 is not None else time.monotonic()
+		self.stages = {}
+		self.lock = threading.Lock()
+		self.all_done = threading.Event()
+
+	def add(self, name, func, after=()):
+		"""
+		Register a stage.
+
+		Args:
+			name (str): Name of the stage, as reported by status().
+			func (callable): Function that performs the stage. Its return value is kept.
+			after (tuple): Names of stages that must be ready before this one starts.
+		"""
+		self.stages[name] = {
+			"func": func,
+			"after": tuple(after),
+			"state": PENDING,
+			"started": None,
+			"finished": None,
+			"result": None,
+			"error": None,
+			"event": threading.Event()
+		}
+
+	def mark(self, name, started=None):
+		"""
+		Record a stage that happened outside of start(), such as the HTTP
+		server binding its socket.
+
+		Args:
+			name (str): Name of the stage.
+			started (float, optional): time.monotonic() value when the stage began.
+				Defaults to now, for an instantaneous stage.
+		"""
+		now = time.monotonic()
+		with self.lock:
+			self.stages[name] = {
+				"func": None,
+				"after": (),
+				"state": READY,
+				"started": started if started is not None else now,
+				"finished": now,
+				"result": None,
+				"error": None,
+				"event": threading.Event()
+			}
+		self.stages[name]["event"].set()
+		print(f"Startup: {name} {READY} (+{(now - self.t0) * 1000:.0f} ms since start)")
+
+	def start(self):
+		"""Start every registered stage in the background."""
+		for name, stage in list(self.stages.items()):
+			if stage["func"] is not None:
+				threading.Thread(target=self._run, args=(name,), name=f"startup-{name}", daemon=True).start()
+
+	def _run(self, name):
+		"""Run a single stage once its dependencies are ready."""
+		stage = self.stages[name]
+		for dependency in stage["after"]:
+			self.stages[dependency]["event"].wait()
+			if self.stages[dependency]["state"] != READY:
+				self._finish(name, FAILED, error=f"dependency '{dependency}' failed")
+				return
+
+		with self.lock:
+			stage["state"] = STARTING
+			stage["started"] = time.monotonic()
+
+		try:
+			result = stage["func"]()
+		except Exception as e:
+			print(f"\033[91mStartup stage '{name}' failed: {e}\033[0m")
+			traceback.print_exc()
+			self._finish(name, FAILED, error=str(e))
+			return
+		self._finish(name, READY, result=result)
+
+	def _finish(self, name, state, result=None, error=None):
+		"""Record the outcome of a stage and wake up anyone waiting on it."""
+		stage = self.stages[name]
+		with self.lock:
+			stage["state"] = state
+			stage["finished"] = time.monotonic()
+			stage["result"] = result
+			stage["error"] = error
+			done = all(s["finished"] is not None for s in self.stages.values())
+		stage["event"].set()
+
+		duration = stage["finished"] - (stage["started"] or stage["finished"])
+		print(f"Startup: {name} {state} in {duration * 1000:.0f} ms "
+			  f"(+{(stage['finished'] - self.t0) * 1000:.0f} ms since start)")
+
+		if done:
+			self.all_done.set()
+			self.print_summary()
+
+	def is_ready(self, name):
+		"""Check whether a stage has finished successfully."""
+		stage = self.stages.get(name)
+		return stage is not None and stage["state"] == READY
+
+	def wait(self, name, timeout=None):
+		"""
+		Wait for a stage to finish.
+
+		Returns:
+			bool: True if the stage is ready, False if it failed or timed out.
+		"""
+		stage = self.stages[name]
+		stage["event"].wait(timeout)
+		return stage["state"] == READY
+
+	def status(self):
+		"""
+		Get the state of every stage.
+
+		Returns:
+			dict: Per-stage state, with start offset and duration in milliseconds.
+		"""
+		now = time.monotonic()
+		stages = {}
+		with self.lock:
+			for name, stage in self.stages.items():
+				info = {"state": stage["state"]}
+				if stage["started"] is not None:
+					info["started_ms"] = round((stage["started"] - self.t0) * 1000)
+					info["duration_ms"] = round(((stage["finished"] or now) - stage["started"]) * 1000)
+				if stage["error"]:
+					info["error"] = stage["error"]
+				stages[name] = info
+		return {
+			"ready": all(s["state"] == READY for s in stages.values()),
+			"uptime_ms": round((now - self.t0) * 1000),
+			"stages": stages
+		}
+
+	def print_summary(self):
+		"""Print a per-stage breakdown of the startup time."""
+		status = self.status()
+		print("=== Startup summary ===")
+		for name, info in status["stages"].items():
+			print(f"  {name:<10} {info['state']:<8} start +{info.get('started_ms', 0):>6} ms"
+				  f"  took {info.get('duration_ms', 0):>6} ms")
+		print(f"  total      {status['uptime_ms']} ms")
+		stats = get_process_stats()
+		print(f"  main process RSS {stats['rss_kb']} KiB, {stats['modules']} modules, Qt loaded: {stats['qt_loaded']}")
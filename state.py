@@ -0,0 +1,137 @@
+#!/usr/bin/python
+"""Persistent session state for IPMPV."""
+
+import json
+import os
+import threading
+from channels import channel_key
+
+# Channel fields needed to tune a channel again before the catalog is loaded
+SAVED_CHANNEL_FIELDS = ("name", "url", "logo", "group", "tvg_id", "options")
+
+class StateStore:
+	"""
+	Small JSON store for what should survive a restart.
+
+	Changes are written in the background, at most once per `debounce`
+	seconds, to a temporary file that is synced and then renamed over the
+	store, so a crash or power cut leaves either the old or the new state.
+	"""
+
+	def __init__(self, path, debounce=1.0, mru_size=10):
+		"""
+		Initialize the store.
+
+		Args:
+			path (str): JSON file the state is kept in.
+			debounce (float): Seconds to wait for more changes before writing.
+			mru_size (int): Number of recently watched channels to remember.
+		"""
+		self.path = path
+		self.debounce = debounce
+		self.mru_size = mru_size
+		self.lock = threading.Lock()
+		self.write_lock = threading.Lock()
+		self.timer = None
+		self.state = {"last_channel": None, "favourites": [], "mru": []}
+		self._load()
+
+	def _load(self):
+		"""Read the state from disk."""
+		if not os.path.exists(self.path):
+			return
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				self.state.update(json.load(f))
+		except (OSError, ValueError) as e:
+			print(f"Error loading saved state: {e}")
+
+	def _schedule_save(self):
+		"""Write the state after the debounce delay. Must be called with the lock held."""
+		if self.timer is None:
+			self.timer = threading.Timer(self.debounce, self.flush)
+			self.timer.daemon = True
+			self.timer.start()
+
+	def flush(self):
+		"""Write the state to disk now."""
+		with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			data = json.dumps(self.state, indent=1)
+		with self.write_lock:
+			try:
+				tmp_file = self.path + ".tmp"
+				with open(tmp_file, 'w', encoding='utf-8') as f:
+					f.write(data)
+					f.flush()
+					os.fsync(f.fileno())
+				os.replace(tmp_file, self.path)
+			except OSError as e:
+				print(f"Error saving state: {e}")
+
+	def get(self, key, default=None):
+		"""Get a stored value."""
+		return self.state.get(key, default)
+
+	def set(self, key, value):
+		"""Store a value."""
+		with self.lock:
+			if self.state.get(key) == value:
+				return
+			self.state[key] = value
+			self._schedule_save()
+
+	def record_channel(self, channel):
+		"""
+		Remember the channel that is playing.
+
+		Args:
+			channel (dict): Channel dictionary.
+		"""
+		key = channel_key(channel)
+		with self.lock:
+			self.state["last_channel"] = {field: channel.get(field) for field in SAVED_CHANNEL_FIELDS}
+			self.state["mru"] = ([key] + [k for k in self.state["mru"] if k != key])[:self.mru_size]
+			self._schedule_save()
+
+	def toggle_favourite(self, channel):
+		"""
+		Add a channel to the favourites, or remove it.
+
+		Args:
+			channel (dict): Channel dictionary.
+
+		Returns:
+			bool: Whether the channel is a favourite now.
+		"""
+		key = channel_key(channel)
+		with self.lock:
+			favourites = self.state["favourites"]
+			if key in favourites:
+				favourites.remove(key)
+			else:
+				favourites.append(key)
+			self._schedule_save()
+			return key in favourites
+
+	def find_channel(self, channels, saved):
+		"""
+		Find a saved channel in the catalog.
+
+		Args:
+			channels (list): List of channel dictionaries.
+			saved (dict): Channel saved by record_channel().
+
+		Returns:
+			int: Index of the channel, or None if the catalog doesn't have it any more.
+		"""
+		key = channel_key(saved)
+		fallback = None
+		for index, channel in enumerate(channels):
+			if channel["url"] == saved["url"]:
+				return index
+			if fallback is None and channel_key(channel) == key:
+				fallback = index
+		return fallback
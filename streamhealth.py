@@ -0,0 +1,296 @@
+#!/usr/bin/python
+"""Stream health monitoring and failover for IPMPV."""
+
+import threading
+import time
+from channels import channel_key, build_alternates
+from events import events
+
+class StreamHealthMonitor:
+	"""
+	Watch the playing stream and recover it when it stops.
+
+	A stream is considered failed when it stays stalled on an empty cache,
+	stops advancing, ends with an error, keeps hitting EOF, or drops frames
+	massively for longer than `stall_secs`. The monitor first reconnects to
+	the same URL with backoff, then fails over to the next alternate URL
+	known for the same channel identity, preferring URLs that failed least
+	(and, with a prober, the ones that answer fastest).
+	The player keeps its channel index throughout.
+	"""
+
+	def __init__(self, player, stall_secs=6, retry_delays=(0.5, 2), interval=0.5):
+		"""
+		Initialize the monitor.
+
+		Args:
+			player (Player): Player to watch.
+			stall_secs (float): Seconds a stall may last before the stream counts as failed.
+			retry_delays (tuple): Backoff delays for reconnecting to the same URL.
+			interval (float): Seconds between health checks.
+		"""
+		self.player = player
+		self.stall_secs = stall_secs
+		self.retry_delays = retry_delays
+		self.interval = interval
+
+		# Optional ChannelProber whose results rank the alternate URLs
+		self.prober = None
+
+		self.lock = threading.Lock()
+		self.alternates = {}
+		self.url_options = {}
+		self.url_failures = {}
+		self.channel = None
+		self.url = None
+		self.attempt = 0
+		self.tried_urls = []
+		self.recovering = False
+		self.recover_busy = False
+		self.recover_started = None
+		self.load_started = None
+		self.stalled_since = None
+		self.dropping_since = None
+		self.last_pos = None
+		self.last_progress = None
+		self.last_drop_count = None
+		self.eofs = []
+		self.failovers = []
+		self.counters = {"stalls": 0, "errors": 0, "eofs": 0, "drop_bursts": 0, "reconnects": 0, "failovers": 0}
+
+		self.player.add_event_listener(self._on_event)
+		self.player.player.observe_property('paused-for-cache', self._paused_for_cache_observer)
+		threading.Thread(target=self._loop, name="stream-health", daemon=True).start()
+
+	def set_catalog(self, channels):
+		"""
+		Learn the alternate URLs of every channel.
+
+		Args:
+			channels (list): List of channel dictionaries.
+		"""
+		alternates = build_alternates(channels)
+		url_options = {channel["url"]: channel.get("options") or {} for channel in channels}
+		with self.lock:
+			self.alternates = alternates
+			self.url_options = url_options
+		with_alternates = sum(1 for urls in alternates.values() if len(urls) > 1)
+		print(f"Stream health: {with_alternates} channels have alternate URLs")
+
+	def watch(self, channel):
+		"""
+		Start watching a freshly tuned channel.
+
+		Args:
+			channel (dict): Channel dictionary of the playing channel.
+		"""
+		with self.lock:
+			self.channel = channel
+			self.url = channel["url"]
+			self.attempt = 0
+			self.tried_urls = [channel["url"]]
+			self._reset_signals()
+			if self.recovering:
+				self._recovered()
+
+	def unwatch(self):
+		"""Stop watching, e.g. because the user is changing channels."""
+		with self.lock:
+			self.channel = None
+			self.url = None
+			self.recovering = False
+
+	def _reset_signals(self):
+		"""Forget the failure signals of the previous stream. Must be called with the lock held."""
+		now = time.monotonic()
+		self.stalled_since = None
+		self.dropping_since = None
+		self.last_pos = None
+		self.last_progress = now
+		self.last_drop_count = None
+		self.eofs = []
+
+	def _on_event(self, name, data):
+		"""Handle mpv events."""
+		if self.channel is None:
+			return
+		if name == 'end-file':
+			reason = data.get('reason')
+			if reason == 'error':
+				self.counters["errors"] += 1
+				self._fail("playback error", reconnect=False)
+			elif reason == 'eof':
+				# loop-playlist reconnects on EOF by itself, but repeated EOFs mean a dead source
+				now = time.monotonic()
+				self.counters["eofs"] += 1
+				self.eofs = [t for t in self.eofs if now - t < 30] + [now]
+				if len(self.eofs) >= 3:
+					self._fail("repeated EOF")
+		elif name == 'playback-restart' and self.recovering:
+			with self.lock:
+				self._recovered()
+
+	def _paused_for_cache_observer(self, name, value):
+		"""Note when playback stalls on an empty cache."""
+		if value:
+			if self.stalled_since is None:
+				self.stalled_since = time.monotonic()
+		else:
+			self.stalled_since = None
+
+	def _loop(self):
+		"""Check the health of the playing stream periodically."""
+		while True:
+			time.sleep(self.interval)
+			if self.channel is None or self.player.tuning:
+				continue
+			now = time.monotonic()
+			if self.recovering:
+				# The last attempt didn't bring the stream back in time
+				if not self.recover_busy and now - self.load_started > self.stall_secs:
+					self._next_attempt()
+				continue
+
+			try:
+				pos = self.player.player.time_pos
+				paused = self.player.player.pause
+				drop_count = self.player.player.frame_drop_count
+			except Exception:
+				continue
+
+			if pos is not None and pos != self.last_pos:
+				self.last_pos = pos
+				self.last_progress = now
+
+			if self.stalled_since is not None and now - self.stalled_since > self.stall_secs:
+				self.counters["stalls"] += 1
+				self._fail(f"stalled for {self.stall_secs} s")
+			elif not paused and now - self.last_progress > self.stall_secs:
+				self.counters["stalls"] += 1
+				self._fail(f"no progress for {self.stall_secs} s")
+			elif drop_count is not None:
+				# Dropping more than half of a 25 fps stream means corrupt or undecodable input
+				if self.last_drop_count is not None and drop_count - self.last_drop_count > 12 * self.interval:
+					if self.dropping_since is None:
+						self.dropping_since = now
+						self.counters["drop_bursts"] += 1
+					elif now - self.dropping_since > self.stall_secs:
+						self._fail(f"dropping frames for {self.stall_secs} s")
+				else:
+					self.dropping_since = None
+				self.last_drop_count = drop_count
+
+	def _fail(self, reason, reconnect=True):
+		"""
+		Start recovering the current stream, or move on if it is already being recovered.
+
+		Args:
+			reason (str): Why the stream counts as failed, for the logs.
+			reconnect (bool): Whether reconnecting to the same URL is worth trying.
+				Hard errors go straight to an alternate URL when there is one.
+		"""
+		with self.lock:
+			if self.channel is None:
+				return
+			if not self.recovering:
+				self.recovering = True
+				self.recover_started = time.monotonic()
+			if not reconnect and len(self.alternates.get(channel_key(self.channel), ())) > 1:
+				self.attempt = len(self.retry_delays)
+			self.url_failures[self.url] = self.url_failures.get(self.url, 0) + 1
+		print(f"Stream health: {self.channel['name']} failed on {self.url} ({reason}), recovering")
+		self._next_attempt()
+
+	def _next_attempt(self):
+		"""Run the next recovery step in the background."""
+		with self.lock:
+			if self.recover_busy:
+				return
+			self.recover_busy = True
+			self.load_started = time.monotonic()
+		threading.Thread(target=self._recover, daemon=True).start()
+
+	def _recover(self):
+		"""Reconnect with backoff, then fail over to an alternate URL."""
+		try:
+			self._recover_step()
+		finally:
+			with self.lock:
+				self.recover_busy = False
+				self.load_started = time.monotonic()
+
+	def _recover_step(self):
+		"""Take one recovery step."""
+		channel = self.channel
+		if channel is None:
+			return
+
+		# Reconnect to the same URL first
+		if self.attempt < len(self.retry_delays):
+			delay = self.retry_delays[self.attempt]
+			self.attempt += 1
+			time.sleep(delay)
+			if self.channel is not channel:
+				return
+			self.counters["reconnects"] += 1
+			print(f"Stream health: reconnecting to {self.url} (attempt {self.attempt})")
+			self._load(self.url)
+			return
+
+		# Then move on to the alternate that failed least
+		urls = self.alternates.get(channel_key(channel), [channel["url"]])
+		candidates = [url for url in urls if url not in self.tried_urls] or [url for url in urls if url != self.url]
+		if not candidates:
+			print(f"Stream health: no alternate URL for {channel['name']}, retrying")
+			self.attempt = 0
+			self._load(self.url)
+			return
+		prober = self.prober
+		candidates.sort(key=lambda url: (self.url_failures.get(url, 0), prober.rank_key(url) if prober else 0))
+		url = candidates[0]
+		with self.lock:
+			self.url = url
+			self.attempt = 0
+			self.tried_urls.append(url)
+		self.counters["failovers"] += 1
+		print(f"Stream health: failing over {channel['name']} to {url}")
+		self._load(url)
+
+	def _load(self, url):
+		"""Load a URL, then give the new stream a fresh chance."""
+		with self.lock:
+			self._reset_signals()
+		with self.player.config_lock:
+			self.player.player.loadfile(url, **self.url_options.get(url, {}))
+
+	def _recovered(self):
+		"""Record a successful recovery. Must be called with the lock held."""
+		self.recovering = False
+		elapsed_ms = round((time.monotonic() - self.recover_started) * 1000)
+		self.url_failures[self.url] = max(0, self.url_failures.get(self.url, 0) - 1)
+		record = {
+			"time": time.time(),
+			"channel": self.channel["name"] if self.channel else None,
+			"url": self.url,
+			"recovery_ms": elapsed_ms
+		}
+		self.failovers.append(record)
+		del self.failovers[:-20]
+		print(f"Stream health: recovered on {self.url} in {elapsed_ms} ms")
+		events.publish('stream_recovered', **record)
+
+	def metrics(self):
+		"""
+		Get the monitor state.
+
+		Returns:
+			dict: Current URL, counters, per-URL failures and recent recoveries.
+		"""
+		return {
+			"channel": self.channel["name"] if self.channel else None,
+			"url": self.url,
+			"recovering": self.recovering,
+			"counters": dict(self.counters),
+			"url_failures": {url: count for url, count in self.url_failures.items() if count},
+			"recoveries": list(self.failovers)
+		}
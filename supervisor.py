@@ -0,0 +1,300 @@
+#!/usr/bin/python
+"""Child process supervision for IPMPV."""
+
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+import traceback
+
+class ProcessSupervisor:
+	"""
+	Supervise a single external process, such as RetroArch.
+
+	The process is tracked through a pidfd, so its exit is noticed as soon as
+	it happens without polling or scanning the process table. The PID and its
+	start time are kept in a pidfile, which lets a restarted web process adopt
+	an instance that is still running. A process is only adopted or signalled
+	if its command line matches ours and its start time the recorded one, so
+	a recycled PID is never mistaken for the program. Listeners are called
+	with "started" and "exited" events.
+	"""
+
+	def __init__(self, name, command, env=None, pidfile=None, stop_timeout=5):
+		"""
+		Initialize the supervisor.
+
+		Args:
+			name (str): Name of the supervised program, used in logs.
+			command (list): Command line to start the program.
+			env (dict, optional): Environment for the program. Defaults to ours.
+			pidfile (str, optional): File to record the PID in across restarts.
+			stop_timeout (float): Seconds to wait after SIGTERM before sending SIGKILL.
+		"""
+		self.name = name
+		self.command = command
+		self.env = env
+		self.pidfile = pidfile
+		self.stop_timeout = stop_timeout
+		self.pid = None
+		self.start_time = None
+		self.process = None
+		self.started_at = None
+		self.lock = threading.Lock()
+		self.exited = threading.Event()
+		self.exited.set()
+		self.listeners = []
+		self._adopt()
+
+	def add_listener(self, callback):
+		"""
+		Register a callback for state changes.
+
+		Args:
+			callback (callable): Called as callback(event, supervisor) where
+				event is "started" or "exited".
+		"""
+		self.listeners.append(callback)
+
+	def _notify(self, event):
+		"""Call every listener, keeping one failing listener from affecting the others."""
+		for callback in self.listeners:
+			try:
+				callback(event, self)
+			except Exception as e:
+				print(f"Error in {self.name} {event} listener: {e}")
+				traceback.print_exc()
+
+	def is_running(self):
+		"""Check whether the program is running. Never blocks or forks."""
+		return self.pid is not None
+
+	def state(self):
+		"""
+		Get the state of the supervised program.
+
+		Returns:
+			dict: Running flag, PID and uptime in seconds.
+		"""
+		pid = self.pid
+		return {
+			"running": pid is not None,
+			"pid": pid,
+			"uptime": round(time.monotonic() - self.started_at) if pid is not None and self.started_at else None
+		}
+
+	def start(self):
+		"""
+		Start the program if it is not running.
+
+		Returns:
+			bool: True if the program is running afterwards.
+		"""
+		with self.lock:
+			if self.pid is not None:
+				return True
+			print(f"Launching {self.name}")
+			try:
+				self.process = subprocess.Popen(self.command, env=self.env, start_new_session=True)
+			except OSError as e:
+				print(f"Error launching {self.name}: {e}")
+				return False
+			self._track(self.process.pid)
+		self._notify("started")
+		return True
+
+	def stop(self, timeout=None):
+		"""
+		Stop the program, first with SIGTERM and then with SIGKILL.
+
+		Args:
+			timeout (float, optional): Seconds to wait before SIGKILL. Defaults to stop_timeout.
+
+		Returns:
+			bool: True if the program is no longer running.
+		"""
+		pid = self.pid
+		if pid is None:
+			return True
+		timeout = self.stop_timeout if timeout is None else timeout
+		print(f"Stopping {self.name} (pid {pid})")
+		self._signal(pid, signal.SIGTERM)
+		if not self.exited.wait(timeout):
+			print(f"{self.name} did not exit after {timeout} s, killing it")
+			self._signal(pid, signal.SIGKILL)
+			self.exited.wait(1)
+		return self.pid is None
+
+	def toggle(self):
+		"""
+		Start the program if it is stopped, stop it otherwise.
+
+		Returns:
+			bool: Whether the program is running afterwards.
+		"""
+		if self.is_running():
+			self.stop()
+			return False
+		return self.start()
+
+	def _signal(self, pid, sig):
+		"""Send a signal to the program's process group, falling back to the process itself."""
+		if self._start_time(pid) != self.start_time:
+			# Exited, and the PID may already belong to another process
+			return
+		try:
+			os.killpg(pid, sig)
+		except (ProcessLookupError, PermissionError):
+			try:
+				os.kill(pid, sig)
+			except ProcessLookupError:
+				pass
+
+	def _track(self, pid):
+		"""Start watching a PID for exit. Must be called with the lock held."""
+		self.pid = pid
+		self.start_time = self._start_time(pid)
+		self.started_at = time.monotonic()
+		self.exited.clear()
+		self._write_pidfile(pid, self.start_time)
+		threading.Thread(target=self._wait_for_exit, args=(pid,), name=f"{self.name}-watch", daemon=True).start()
+
+	def _wait_for_exit(self, pid):
+		"""Block until the process exits, then record it."""
+		try:
+			if self.process is not None and self.process.pid == pid:
+				# Our own child: reap it so it does not linger as a zombie
+				self.process.wait()
+			else:
+				self._wait_pidfd(pid)
+		except Exception as e:
+			print(f"Error watching {self.name}: {e}")
+		with self.lock:
+			if self.pid != pid:
+				return
+			self.pid = None
+			self.start_time = None
+			self.process = None
+			self.started_at = None
+			self._write_pidfile(None)
+			self.exited.set()
+		print(f"{self.name} exited")
+		self._notify("exited")
+
+	def _wait_pidfd(self, pid):
+		"""Wait for a process that is not our child, such as an adopted one."""
+		try:
+			pidfd = os.pidfd_open(pid)
+		except ProcessLookupError:
+			return
+		except (AttributeError, OSError):
+			# No pidfd support: fall back to checking the PID once per second
+			start_time = self._start_time(pid)
+			while self._pid_alive(pid) and self._start_time(pid) == start_time:
+				time.sleep(1)
+			return
+		try:
+			poller = select.poll()
+			poller.register(pidfd, select.POLLIN)
+			poller.poll()
+		finally:
+			os.close(pidfd)
+
+	def _pid_alive(self, pid):
+		"""Check whether a PID exists."""
+		try:
+			os.kill(pid, 0)
+		except ProcessLookupError:
+			return False
+		except PermissionError:
+			return True
+		return True
+
+	def _adopt(self):
+		"""Adopt an instance left running by a previous web process, if any."""
+		pid, start_time = self._read_pidfile()
+		if pid is not None and not (self._matches_command(pid) and self._start_time(pid) == start_time):
+			self._write_pidfile(None)
+			pid = None
+		if pid is None:
+			# Instances launched outside IPMPV are only looked up once, here
+			pid = self._find_running()
+		if pid is None:
+			return
+		print(f"Adopting running {self.name} (pid {pid})")
+		with self.lock:
+			self._track(pid)
+
+	def _find_running(self):
+		"""Look for a running instance of the program in /proc."""
+		try:
+			entries = os.listdir("/proc")
+		except OSError:
+			return None
+		own_pid = os.getpid()
+		for entry in entries:
+			if entry.isdigit() and int(entry) != own_pid and self._matches_command(int(entry)):
+				return int(entry)
+		return None
+
+	def _matches_command(self, pid):
+		"""Check that a PID runs our command line: the same program, with the same arguments."""
+		try:
+			with open(f"/proc/{pid}/cmdline", "rb") as f:
+				cmdline = f.read().rstrip(b"\0").split(b"\0")
+		except OSError:
+			return False
+		command = [os.fsencode(arg) for arg in self.command if arg]
+		# The program may have been started through a different path
+		return (len(cmdline) == len(command) and os.path.basename(cmdline[0]) == os.path.basename(command[0])
+				and cmdline[1:] == command[1:])
+
+	def _start_time(self, pid):
+		"""
+		Get the start time of a process, which tells it apart from a later one with the same PID.
+
+		Returns:
+			int: Clock ticks after boot, from field 22 of /proc/<pid>/stat, or None if it isn't running.
+		"""
+		try:
+			with open(f"/proc/{pid}/stat", "rb") as f:
+				stat = f.read()
+		except OSError:
+			return None
+		try:
+			# The command name in field 2 may contain spaces and parentheses
+			return int(stat[stat.rindex(b")") + 2:].split()[19])
+		except (ValueError, IndexError):
+			return None
+
+	def _read_pidfile(self):
+		"""
+		Read the PID recorded by a previous run.
+
+		Returns:
+			tuple: (PID, start time), or (None, None) if nothing usable is recorded.
+		"""
+		if not self.pidfile:
+			return None, None
+		try:
+			with open(self.pidfile, 'r') as f:
+				pid, start_time = f.read().split()
+			return int(pid), int(start_time)
+		except (OSError, ValueError):
+			return None, None
+
+	def _write_pidfile(self, pid, start_time=None):
+		"""Record the PID and its start time, or remove the pidfile when pid is None."""
+		if not self.pidfile:
+			return
+		try:
+			if pid is None:
+				if os.path.exists(self.pidfile):
+					os.remove(self.pidfile)
+			else:
+				with open(self.pidfile, 'w') as f:
+					f.write(f"{pid} {start_time}")
+		except OSError as e:
+			print(f"Error writing {self.pidfile}: {e}")
@@ -0,0 +1,96 @@
+// Service worker for the IPMPV remote.
+//
+// Fingerprinted assets and versioned locale bundles never change, so they
+// are served straight from the cache. The page itself carries live state
+// (current channel, toggles, channel list), so it is fetched from the
+// network and the cached copy is only used when the box can't be reached
+// in time. Control and API requests always go to the network.
+
+const CACHE = 'ipmpv-%CACHE_VERSION%';
+const PRECACHE = %PRECACHE_URLS%;
+const SHELL = '/';
+const NETWORK_TIMEOUT = 3000;
+
+self.addEventListener('install', event => {
+	event.waitUntil(
+		caches.open(CACHE)
+			.then(cache => cache.addAll(PRECACHE))
+			.then(() => self.skipWaiting())
+	);
+});
+
+self.addEventListener('activate', event => {
+	// Drop caches from previous versions
+	event.waitUntil(
+		caches.keys()
+			.then(keys => Promise.all(keys.filter(key => key !== CACHE).map(key => caches.delete(key))))
+			.then(() => self.clients.claim())
+	);
+});
+
+function cacheFirst(request) {
+	return caches.match(request).then(cached => {
+		if (cached) {
+			return cached;
+		}
+		return fetch(request).then(response => {
+			if (response.ok) {
+				const copy = response.clone();
+				caches.open(CACHE).then(cache => cache.put(request, copy));
+			}
+			return response;
+		});
+	});
+}
+
+function networkFirst(request) {
+	return new Promise(resolve => {
+		let settled = false;
+		const fallback = () => {
+			if (settled) return;
+			caches.match(SHELL).then(cached => {
+				if (cached && !settled) {
+					settled = true;
+					resolve(cached);
+				}
+			});
+		};
+		const timer = setTimeout(fallback, NETWORK_TIMEOUT);
+
+		fetch(request).then(response => {
+			clearTimeout(timer);
+			if (response.ok) {
+				const copy = response.clone();
+				caches.open(CACHE).then(cache => cache.put(SHELL, copy));
+			}
+			if (!settled) {
+				settled = true;
+				resolve(response);
+			}
+		}).catch(() => {
+			clearTimeout(timer);
+			caches.match(SHELL).then(cached => {
+				if (!settled) {
+					settled = true;
+					resolve(cached || Response.error());
+				}
+			});
+		});
+	});
+}
+
+self.addEventListener('fetch', event => {
+	const request = event.request;
+	if (request.method !== 'GET') return;
+
+	const url = new URL(request.url);
+	if (url.origin !== self.location.origin) return;
+
+	if (url.pathname.startsWith('/assets/') ||
+		(url.pathname.startsWith('/locales/') && url.searchParams.has('v'))) {
+		event.respondWith(cacheFirst(request));
+	} else if (request.mode === 'navigate' && url.pathname === SHELL) {
+		event.respondWith(networkFirst(request));
+	}
+	// Everything else (live state, channel data and commands) goes to the network
+});
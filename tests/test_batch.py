@@ -0,0 +1,90 @@
+import queue
+
+import pytest
+
+from server import IPMPVServer
+
+
+class FakePlayer:
+	def __init__(self):
+		self.current_index = 0
+		self.profiles = {"default": {}, "low-latency": {}}
+		self.profile = "default"
+		self.deinterlace = False
+		self.played = []
+
+	def set_profile(self, name):
+		self.profile = name
+		return True
+
+	def set_deinterlace(self, state):
+		self.deinterlace = state
+
+	def play_channel(self, index, channels):
+		self.played.append(index)
+
+
+class FakeVolume:
+	def __init__(self):
+		self.step = 5
+		self.volume = 50
+		self.muted = False
+
+	def get_volume(self):
+		return self.volume
+
+	def is_muted(self):
+		return self.muted
+
+	def set_volume(self, volume=None, muted=None):
+		if volume is not None:
+			self.volume = volume
+		if muted is not None:
+			self.muted = muted
+
+
+@pytest.fixture
+def ipmpv():
+	channels = [{"name": f"Channel {n}", "url": f"http://streams.example/{n}.ts"} for n in range(3)]
+	return IPMPVServer(channels, FakePlayer(), queue.Queue(), queue.Queue(), None, None, volume_control=FakeVolume())
+
+
+def test_batch_applies_the_end_state(ipmpv):
+	client = ipmpv.app.test_client()
+	response = client.post("/api/batch", json=[
+		{"cmd": "volume_up", "step": "10"},
+		{"cmd": "mute", "state": "false"},
+		{"cmd": "deinterlace", "state": 0},
+		{"cmd": "toggle_deinterlace"},
+		{"cmd": "toggle_latency"},
+	])
+	assert response.status_code == 200
+	state = response.get_json()["state"]
+	assert state["volume"] == 60 and state["muted"] is False
+	assert state["deinterlace"] is True and ipmpv.player.deinterlace
+	assert state["profile"] == "low-latency"
+	assert (ipmpv.volume_control.volume, ipmpv.volume_control.muted) == (60, False)
+
+
+@pytest.mark.parametrize("command", [
+	{"cmd": ["volume_up"]},
+	{"cmd": {"name": "mute"}},
+	{"cmd": 7},
+	{"level": 20},
+	{"cmd": "mute", "state": "maybe"},
+	{"cmd": "mute", "state": 2},
+	{"cmd": "deinterlace", "state": [True]},
+	{"cmd": "volume", "level": 12.5},
+	{"cmd": "volume", "level": True},
+	{"cmd": "volume_up", "step": "five"},
+	{"cmd": "channel", "index": None},
+	{"cmd": "profile", "name": ["default"]},
+	{"cmd": "rewind"},
+])
+def test_malformed_commands_are_rejected(ipmpv, command):
+	client = ipmpv.app.test_client()
+	response = client.post("/api/batch", json=[{"cmd": "volume", "level": 30}, command])
+	assert response.status_code == 400
+	assert response.get_json()["error"].startswith("command 1")
+	# Nothing is applied when any command is rejected
+	assert ipmpv.volume_control.volume == 50
@@ -0,0 +1,40 @@
+import threading
+from types import SimpleNamespace
+
+from buffering import AdaptiveBuffer
+
+
+class FakeMPV(dict):
+	def observe_property(self, name, callback):
+		pass
+
+
+def make_player(low_latency):
+	return SimpleNamespace(player=FakeMPV(), config_lock=threading.Lock(), low_latency=low_latency, current_index=None)
+
+
+def test_apply_sets_the_buffer_properties():
+	player = make_player(low_latency=False)
+	controller = AdaptiveBuffer(player, initial_secs=2.0)
+	controller.start_channel("Channel 1")
+
+	assert player.player == {'demuxer-readahead-secs': '2.0', 'cache-pause-wait': '2.0', 'audio-buffer': '0.5'}
+	assert controller.decisions[-1]["reason"] == "tuned Channel 1"
+
+
+def test_apply_keeps_the_low_latency_profile_settings():
+	player = make_player(low_latency=True)
+	# As applied by the low-latency profile
+	player.player.update({'audio-buffer': '0', 'cache-pause': 'no', 'cache-pause-wait': '1'})
+	controller = AdaptiveBuffer(player, initial_secs=2.0)
+	controller.start_channel("Channel 1")
+	controller.reapply()
+
+	assert player.player == {'audio-buffer': '0', 'cache-pause': 'no', 'cache-pause-wait': '1',
+							 'demuxer-readahead-secs': '2.0'}
+
+	# Back on a buffered profile, the controller owns them again
+	player.low_latency = False
+	controller.reapply()
+	assert player.player['audio-buffer'] == '0.5'
+	assert player.player['cache-pause-wait'] == '2.0'
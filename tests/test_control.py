@@ -0,0 +1,58 @@
+import os
+import socket
+
+import pytest
+
+from control import ControlSocket
+
+
+class FakeServer:
+	startup = None
+	player = None
+	volume_control = None
+	channels = []
+
+
+def test_stale_socket_is_replaced(tmp_path):
+	path = str(tmp_path / "ipmpv.sock")
+	stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	stale.bind(path)
+	stale.close()
+	control = ControlSocket(FakeServer(), path)
+	control.start()
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		client.connect(path)
+		client.sendall(b"ping\n")
+		assert client.makefile('rb').readline() == b"OK pong\n"
+
+
+def test_live_socket_is_left_alone(tmp_path):
+	path = str(tmp_path / "ipmpv.sock")
+	ControlSocket(FakeServer(), path).start()
+	with pytest.raises(OSError):
+		ControlSocket(FakeServer(), path).start()
+	assert os.path.exists(path)
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		client.connect(path)
+
+
+def test_other_files_are_left_alone(tmp_path):
+	path = tmp_path / "ipmpv.sock"
+	path.write_text("not a socket")
+	with pytest.raises(OSError):
+		ControlSocket(FakeServer(), str(path)).start()
+	assert path.read_text() == "not a socket"
+
+
+def test_failing_command_is_reported(tmp_path):
+	class BrokenServer(FakeServer):
+		@property
+		def channels(self):
+			raise RuntimeError("catalog is gone")
+
+	control = ControlSocket(BrokenServer(), str(tmp_path / "ipmpv.sock"))
+	control.server.player = object()
+	reply = control.execute("ch 1")
+	assert reply.startswith("ERR ch: RuntimeError")
+	assert control.counters["errors"] == 1
+	assert control.execute("ping") == "OK pong"
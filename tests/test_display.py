@@ -0,0 +1,161 @@
+import time
+
+import pytest
+
+import display
+from display import DisplayBackend
+
+
+def write_connector(root, name, status="connected", enabled="enabled", modes="720x480i\n720x240\n"):
+	path = root / f"card0-{name}"
+	path.mkdir(exist_ok=True)
+	(path / "status").write_text(status + "\n")
+	(path / "enabled").write_text(enabled + "\n")
+	(path / "modes").write_text(modes)
+	return path
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+	write_connector(tmp_path, "HDMI-A-1", status="disconnected", modes="")
+	write_connector(tmp_path, "Composite-1")
+	# Not a connector: no status file
+	(tmp_path / "card0").mkdir()
+	return tmp_path
+
+
+def write_state(root, mode, connector="Composite-1"):
+	"""Write a DRM atomic state dump with the connector driven at a mode."""
+	card = root / "0"
+	card.mkdir(exist_ok=True)
+	(card / "state").write_text(
+		"plane[31]: plane-0\n"
+		"\tcrtc=crtc-0\n"
+		"crtc[33]: crtc-0\n"
+		"\tenable=1\n"
+		"\tactive=1\n"
+		f'\tmode: "{mode}": 60 13500 720 736 798 858 480 486 492 525 0x40 0x1a\n'
+		f"connector[35]: {connector}\n"
+		"\tcrtc=crtc-0\n"
+		"connector[37]: HDMI-A-1\n"
+		"\tcrtc=(null)\n"
+	)
+
+
+@pytest.fixture
+def debugfs(tmp_path):
+	root = tmp_path / "dri"
+	root.mkdir()
+	write_state(root, "720x480i")
+	return root
+
+
+@pytest.fixture
+def xrandr(monkeypatch):
+	"""Stand-in xrandr reporting the current size of Composite-1, counting calls."""
+	state = {"size": "720x480", "calls": 0}
+
+	def check_output(args, **kwargs):
+		assert args == ["xrandr"]
+		state["calls"] += 1
+		return ("Screen 0: minimum 320 x 200, current 720 x 480, maximum 8192 x 8192\n"
+				"HDMI-A-1 disconnected (normal left inverted right x axis y axis)\n"
+				f"Composite-1 connected primary {state['size']}+0+0 (normal left inverted right x axis y axis)\n"
+				f"   {state['size']}i  59.94*\n")
+
+	monkeypatch.setattr(display.subprocess, "check_output", check_output)
+	return state
+
+
+def test_discovers_connected_composite_connector(sysfs):
+	backend = DisplayBackend(sysfs_root=str(sysfs), connector="", wayland=False)
+
+	assert sorted(backend.connectors()) == ["Composite-1", "HDMI-A-1"]
+	assert backend.supported_modes() == ["720x480i", "720x240"]
+	assert backend.connector == "Composite-1"
+	assert backend._mode_string("480i") == "720x480i"
+
+
+def test_refresh_reads_mode_and_connector_state(sysfs, debugfs, xrandr):
+	backend = DisplayBackend(sysfs_root=str(sysfs), debugfs_root=str(debugfs), connector="Composite-1", wayland=False)
+	assert backend.get_mode() == "UNK"
+
+	assert backend.refresh() == "480i"
+	assert backend.get_mode() == "480i"
+	assert backend._signature[:2] == ("connected", "enabled")
+	assert backend._signature[2].startswith('"720x480i"')
+
+	xrandr["size"] = "720x240"
+	assert backend.refresh() == "240p"
+	assert backend.get_mode() == "240p"
+	assert xrandr["calls"] == 2
+
+
+def test_check_for_changes_observes_an_external_mode_switch(sysfs, debugfs, xrandr):
+	backend = DisplayBackend(sysfs_root=str(sysfs), debugfs_root=str(debugfs), connector="Composite-1", wayland=False)
+	backend.refresh()
+
+	assert not backend.check_for_changes()
+	assert xrandr["calls"] == 1
+
+	# Another program switches the mode: only the CRTC's mode changes, sysfs stays the same
+	xrandr["size"] = "720x240"
+	write_state(debugfs, "720x240")
+	assert backend.check_for_changes()
+	assert backend.get_mode() == "240p"
+	assert xrandr["calls"] == 2
+
+	assert not backend.check_for_changes()
+	assert xrandr["calls"] == 2
+
+	write_connector(sysfs, "Composite-1", status="disconnected")
+	assert backend.check_for_changes()
+	assert xrandr["calls"] == 3
+
+
+def test_watcher_picks_up_external_switches(sysfs, debugfs, xrandr):
+	backend = DisplayBackend(sysfs_root=str(sysfs), debugfs_root=str(debugfs), connector="Composite-1",
+							 wayland=False, poll_interval=0.02, refresh_interval=0.1)
+	backend.refresh()
+	backend.start_watcher()
+
+	xrandr["size"] = "720x240"
+	write_state(debugfs, "720x240")
+	deadline = time.monotonic() + 2
+	while backend.get_mode() != "240p" and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert backend.get_mode() == "240p"
+
+	# The mode is observable, so there are no periodic queries
+	calls = xrandr["calls"]
+	time.sleep(0.3)
+	assert xrandr["calls"] == calls
+
+	# A switch in progress is left alone until it completes
+	backend.pending_mode = "576i"
+	xrandr["size"] = "720x576"
+	write_state(debugfs, "720x576i")
+	time.sleep(0.2)
+	assert xrandr["calls"] == calls
+	backend.pending_mode = None
+	deadline = time.monotonic() + 2
+	while backend.get_mode() != "576i" and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert backend.get_mode() == "576i"
+	assert xrandr["calls"] == calls + 1
+
+
+def test_watcher_refreshes_periodically_without_debugfs(sysfs, tmp_path, xrandr):
+	backend = DisplayBackend(sysfs_root=str(sysfs), debugfs_root=str(tmp_path / "missing"), connector="Composite-1",
+							 wayland=False, poll_interval=0.02, refresh_interval=0.2)
+	backend.refresh()
+	assert backend._signature[2] is None
+	backend.start_watcher()
+
+	# Nothing on disk changes when another program switches the mode
+	xrandr["size"] = "720x240"
+	deadline = time.monotonic() + 2
+	while backend.get_mode() != "240p" and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert backend.get_mode() == "240p"
+	assert xrandr["calls"] == 2
@@ -0,0 +1,62 @@
+import gzip
+import time
+import tracemalloc
+
+import pytest
+
+from epg import EPG
+
+
+def xmltv_time(stamp):
+	return time.strftime("%Y%m%d%H%M%S +0000", time.gmtime(stamp))
+
+
+@pytest.fixture
+def guide_file(tmp_path):
+	"""A gzipped XMLTV file: 50 channels with a programme every half hour around now."""
+	now = int(time.time()) // 1800 * 1800
+	parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n']
+	for n in range(50):
+		parts.append(f'<channel id="ch{n}.example"><display-name>Channel {n}</display-name></channel>\n')
+	for n in range(50):
+		for slot in range(-8, 16):
+			start = now + slot * 1800
+			parts.append(f'<programme start="{xmltv_time(start)}" stop="{xmltv_time(start + 1800)}" '
+						 f'channel="ch{n}.example"><title>Show {n}.{slot}</title></programme>\n')
+	parts.append('</tv>\n')
+	path = tmp_path / "guide.xml.gz"
+	path.write_bytes(gzip.compress(''.join(parts).encode('utf-8')))
+	return str(path), now
+
+
+def test_ingest_builds_now_next(guide_file):
+	path, now = guide_file
+	guide = EPG(path)
+	guide.ingest()
+
+	assert guide.stats["channels"] == 50
+	# Programmes that ended over an hour ago are dropped
+	assert guide.stats["programmes"] == 50 * 18
+	listing = guide.now_next({"name": "Channel 3"}, now + 60)
+	assert listing["now"]["title"] == "Show 3.0"
+	assert listing["next"]["title"] == "Show 3.1"
+	assert guide.now_next({"name": "Unknown", "tvg_id": "ch7.example"}, now)["now"]["title"] == "Show 7.0"
+
+
+def test_ingest_measures_its_own_allocations(guide_file):
+	path, _ = guide_file
+	guide = EPG(path)
+	guide.ingest()
+	assert guide.stats["peak_kb"] >= guide.stats["retained_kb"] > 0
+	assert not tracemalloc.is_tracing()
+
+	# Allocations made before the ingest don't count towards its peak
+	tracemalloc.start()
+	try:
+		ballast = bytearray(32 * 1024 * 1024)
+		del ballast
+		guide.ingest()
+		assert tracemalloc.is_tracing()
+		assert guide.stats["peak_kb"] < 16 * 1024
+	finally:
+		tracemalloc.stop()
@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+from werkzeug.serving import make_server
+
+from epg import EPG
+from fleet import FleetOrigin, FleetPeer, catalog_version, logo_key
+from server import IPMPVServer
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(document.cookie)</script></svg>'
+
+
+def serve(handler, **attributes):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+	server.daemon_threads = True
+	for name, value in attributes.items():
+		setattr(server, name, value)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+	"""Stand-in provider serving logos, slowly, counting requests."""
+
+	def do_GET(self):
+		self.server.requests.append(self.path)
+		time.sleep(0.2)
+		svg = self.path.endswith(".svg")
+		self.send_response(200)
+		self.send_header("Content-Type", "image/svg+xml" if svg else "image/png")
+		self.end_headers()
+		self.wfile.write(SVG if svg else PNG)
+
+	def log_message(self, *args):
+		pass
+
+
+def make_channels(count, provider_url, suffix=""):
+	return [{"name": f"Channel {n}{suffix if n % 10 == 0 else ''}", "url": f"http://streams.example/{n}.ts",
+			 "logo": f"{provider_url}/logos/{n}.png", "group": "All"} for n in range(count)]
+
+
+@pytest.fixture
+def provider():
+	server = serve(ProviderHandler, requests=[])
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def origin(tmp_path, provider):
+	"""A FleetOrigin behind the fleet routes of a running IPMPV server."""
+	provider_url = f"http://127.0.0.1:{provider.server_address[1]}"
+	player = SimpleNamespace(epg=None, current_index=None, suspended_index=None, health_monitor=None)
+	ipmpv = IPMPVServer(make_channels(50, provider_url), player, queue.Queue(), queue.Queue(), None, None)
+	fleet_origin = FleetOrigin(ipmpv, cache_dir=str(tmp_path / "logos"), history=2)
+	fleet_origin.publish(ipmpv.channels)
+	ipmpv.fleet = fleet_origin
+	http_server = make_server("127.0.0.1", 0, ipmpv.app, threaded=True)
+	threading.Thread(target=http_server.serve_forever, daemon=True).start()
+	fleet_origin.url = f"http://127.0.0.1:{http_server.server_port}"
+	fleet_origin.provider_url = provider_url
+	yield fleet_origin
+	http_server.shutdown()
+	http_server.server_close()
+
+
+def test_peers_follow_the_catalog_with_deltas(origin):
+	peers = [FleetPeer(origin.url) for _ in range(3)]
+	for peer in peers:
+		channels = peer.fetch()
+		assert len(channels) == 50
+		assert channels[1]["logo"] == f"{origin.url}/fleet/logo/{logo_key(origin.server.channels[1]['logo'])}"
+		assert peer.fetch() is None
+
+	changed = make_channels(50, origin.provider_url, suffix=" HD")
+	assert origin.publish(changed)
+	for peer in peers:
+		assert [channel["name"] for channel in peer.fetch()] == [channel["name"] for channel in changed]
+		assert peer.version == catalog_version(changed)
+		assert peer.metrics()["counters"] == {"full": 1, "deltas": 1}
+
+	counters = origin.metrics()["counters"]
+	assert counters["full"] == 3
+	assert counters["deltas"] == 3
+	assert counters["not_modified"] == 3
+	# Every peer got the same delta, compressed once
+	assert origin.metrics()["cached_bodies"] == 2
+
+	response = requests.get(f"{origin.url}/fleet/catalog", timeout=5)
+	assert response.headers["ETag"] == f'"{catalog_version(changed)}"'
+	assert response.headers["Content-Encoding"] == "gzip"
+	assert requests.get(f"{origin.url}/fleet/catalog", params={"since": catalog_version(changed)},
+						timeout=5).status_code == 304
+
+
+def test_peer_too_far_behind_gets_a_full_snapshot(origin):
+	peer = FleetPeer(origin.url)
+	peer.fetch()
+	for suffix in (" HD", " FHD", " UHD"):
+		origin.publish(make_channels(50, origin.provider_url, suffix=suffix))
+	# Only the last two versions are kept: there is no delta from the first one
+	assert len(peer.fetch()) == 50
+	assert peer.metrics()["counters"] == {"full": 2}
+
+
+def test_logo_is_fetched_once_for_many_peers(origin, provider):
+	key = logo_key(origin.server.channels[3]["logo"])
+	results = []
+
+	def fetch():
+		results.append(FleetPeer(origin.url).session.get(f"{origin.url}/fleet/logo/{key}", timeout=5))
+
+	threads = [threading.Thread(target=fetch) for _ in range(6)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert [response.content for response in results] == [PNG] * 6
+	assert {response.headers["Content-Type"] for response in results} == {"image/png"}
+	assert provider.requests == ["/logos/3.png"]
+	counters = origin.metrics()["counters"]
+	assert counters["logo_misses"] == 1
+	assert counters["logo_hits"] == 5
+
+
+def test_logos_cannot_run_script_in_the_ui_origin(origin):
+	channels = make_channels(50, origin.provider_url)
+	channels[5]["logo"] = f"{origin.provider_url}/logos/5.svg"
+	origin.publish(channels)
+	session = FleetPeer(origin.url).session
+
+	response = session.get(f"{origin.url}/fleet/logo/{logo_key(channels[5]['logo'])}", timeout=5)
+	assert response.content == SVG
+	assert response.headers["Content-Type"].startswith("image/svg+xml")
+	assert "sandbox" in response.headers["Content-Security-Policy"]
+	assert "default-src 'none'" in response.headers["Content-Security-Policy"]
+	assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+	response = session.get(f"{origin.url}/fleet/logo/{logo_key(channels[4]['logo'])}", timeout=5)
+	assert response.headers["Content-Type"] == "image/png"
+	assert "sandbox" in response.headers["Content-Security-Policy"]
+
+
+def test_unknown_logo_is_not_fetched(origin, provider):
+	response = FleetPeer(origin.url).session.get(f"{origin.url}/fleet/logo/0123456789abcdef", timeout=5)
+	assert response.status_code == 404
+	assert provider.requests == []
+
+
+def test_peers_take_the_guide_from_the_origin(origin):
+	peer_guide = EPG("http://guide.example/xmltv.xml", origin=origin.url)
+	# No guide on the origin yet: the peer falls back to the source
+	assert not peer_guide._pull_origin()
+
+	now = int(time.time())
+	guide = EPG("http://guide.example/xmltv.xml")
+	guide.load_snapshot({
+		"loaded_at": now,
+		"names": {"channel 1": "ch1.example"},
+		"guides": {"ch1.example": [[now - 600, now + 1200], [now + 1200, now + 3000], ["News", "Film"]]}
+	})
+	origin.server.player.epg = guide
+
+	for _ in range(2):
+		peer_guide = EPG("http://guide.example/xmltv.xml", origin=origin.url)
+		assert peer_guide._pull_origin()
+		assert peer_guide.snapshot()["guides"] == guide.snapshot()["guides"]
+		assert peer_guide.loaded_at == now
+	assert origin.metrics()["counters"]["epg"] == 2
+
+	response = requests.get(f"{origin.url}/fleet/epg", timeout=5)
+	assert response.headers["ETag"] == f'"{now}"'
+	assert requests.get(f"{origin.url}/fleet/epg", headers={"If-None-Match": f'"{now}"'}, timeout=5).status_code == 304
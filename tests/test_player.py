@@ -0,0 +1,135 @@
+import importlib
+import queue
+import sys
+import types
+
+import pytest
+
+
+class FakeMPV:
+	"""Stand-in for mpv.MPV that records what the player does with it."""
+
+	def __init__(self, **options):
+		self.options = dict(options)
+		self.commands = []
+		self.observers = {}
+		self.event_callbacks = []
+
+	def __setitem__(self, key, value):
+		self.options[key] = value
+
+	def __getitem__(self, key):
+		return self.options[key]
+
+	def command(self, *args):
+		self.commands.append(args)
+
+	def observe_property(self, name, callback):
+		self.observers[name] = callback
+
+	def register_event_callback(self, callback):
+		self.event_callbacks.append(callback)
+
+	def stop(self):
+		self.commands.append(('stop',))
+
+	@staticmethod
+	def _encode_options(options):
+		return ','.join(f'{key}={value}' for key, value in options.items())
+
+
+@pytest.fixture
+def player_module(monkeypatch):
+	"""The player module, imported against a fake mpv module."""
+	monkeypatch.setitem(sys.modules, 'mpv', types.SimpleNamespace(MPV=FakeMPV))
+	monkeypatch.delitem(sys.modules, 'player', raising=False)
+	module = importlib.import_module('player')
+	yield module
+	sys.modules.pop('player', None)
+
+
+def test_player_constructs_and_applies_the_default_profile(player_module):
+	player = player_module.Player(queue.Queue())
+
+	assert player.profile == player_module.DEFAULT_PROFILE
+	assert not player.low_latency
+	assert player.profile_timings[player_module.DEFAULT_PROFILE] >= 0
+	if player.profiles_registered:
+		assert player.player.commands[-1] == ('apply-profile', player_module.MPV_PROFILE_PREFIX + player_module.DEFAULT_PROFILE)
+	for name in ('buffer_controller', 'state', 'health_monitor', 'timeshift', 'epg', 'mode_policy'):
+		assert getattr(player, name) is None
+	assert player.player.event_callbacks == [player._dispatch_event]
+
+
+def test_profile_switch_reaches_attached_collaborators(player_module):
+	player = player_module.Player(queue.Queue())
+	reapplied = []
+	player.buffer_controller = types.SimpleNamespace(reapply=lambda: reapplied.append(player.profile))
+
+	assert player.toggle_latency()
+	assert player.profile == 'low-latency'
+	assert reapplied == ['low-latency']
+	assert not player.set_profile('no-such-profile')
+
+
+def test_profile_is_remembered_across_restarts(player_module, tmp_path):
+	from state import StateStore
+
+	path = str(tmp_path / "state.json")
+	player = player_module.Player(queue.Queue())
+	player.state = StateStore(path, debounce=0)
+	player.set_profile('low-latency')
+	player.state.flush()
+
+	# As main.py does on startup: attach the store, then apply the saved profile
+	restarted = player_module.Player(queue.Queue())
+	restarted.state = StateStore(path)
+	assert restarted.profile == player_module.DEFAULT_PROFILE
+	assert restarted.set_profile(restarted.state.get('profile'))
+	assert restarted.low_latency
+
+
+class FakeEvent:
+	"""Stand-in for python-mpv's MpvEvent, counting decodes."""
+
+	decoded = 0
+
+	def __init__(self, event_id, data):
+		self.event_id = types.SimpleNamespace(value=event_id)
+		self.data = data
+
+	def as_dict(self):
+		FakeEvent.decoded += 1
+		return self.data
+
+
+def test_only_listened_events_are_decoded(player_module):
+	player = player_module.Player(queue.Queue())
+	received = []
+	player.add_event_listener(lambda name, data: received.append((name, data.get('reason'))))
+	FakeEvent.decoded = 0
+
+	for _ in range(100):
+		# Log messages and property changes are dropped undecoded
+		player._dispatch_event(FakeEvent(2, {'event': 'log-message', 'text': 'chatter'}))
+		player._dispatch_event(FakeEvent(22, {'event': 'property-change', 'name': 'time-pos'}))
+	player._dispatch_event(FakeEvent(7, {'event': 'end-file', 'reason': 4}))
+	# Older python-mpv versions pass dictionaries
+	player._dispatch_event({'event': 'log-message', 'text': 'chatter'})
+	player._dispatch_event({'event': 'playback-restart'})
+
+	assert FakeEvent.decoded == 1
+	assert received == [('end-file', 'error'), ('playback-restart', None)]
+
+
+def test_mpv_filters_log_messages_per_component(player_module, monkeypatch):
+	monkeypatch.setattr(player_module.logs, 'mpv_levels', player_module.logs.mpv_levels)
+	player_module.logs.configure(mpv_levels="ffmpeg=error,all=warn,cplayer=v")
+	player = player_module.Player(queue.Queue())
+
+	# mpv applies the levels itself rather than sending everything at the most verbose one
+	assert player.player.options['loglevel'] == 'terminal-default'
+	assert player.player.options['msg_level'] == 'all=warn,ffmpeg=error,cplayer=v'
+
+	player_module.logs.configure(mpv_levels="all=no")
+	assert player_module.logs.mpv_loglevel() == 'no'
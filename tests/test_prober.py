@@ -0,0 +1,112 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import prober
+from prober import ChannelProber, probe_url
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+	"""Stand-in provider: /live/* streams forever, anything else is a 404."""
+
+	def do_GET(self):
+		self.server.requests.append((time.monotonic(), self.path))
+		if not self.path.startswith("/live/"):
+			self.send_error(404)
+			return
+		self.send_response(200)
+		self.send_header("Content-Type", "video/mp2t")
+		self.end_headers()
+		try:
+			while True:
+				self.wfile.write(b"\x47" + b"\xff" * 187)
+				self.server.sent += 188
+				time.sleep(0.001)
+		except OSError:
+			pass
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def provider():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), StreamHandler)
+	server.daemon_threads = True
+	server.requests = []
+	server.sent = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server, f"http://127.0.0.1:{server.server_port}"
+	server.shutdown()
+	server.server_close()
+
+
+class FakeMpv:
+	video_bitrate = None
+	audio_bitrate = None
+
+
+class FakePlayer:
+	def __init__(self):
+		self.tuning = False
+		self.current_index = None
+		self.resumed_channel = None
+		self.player = FakeMpv()
+
+
+def test_probe_reads_only_the_first_chunk(provider):
+	server, base = provider
+	result = probe_url(f"{base}/live/1.ts", timeout=2)
+	assert result["alive"] is True
+	assert result["status"] == 200
+	assert result["ttfb_ms"] is not None
+	time.sleep(0.2)
+	# The stream never ends; the probe hung up after its first chunk
+	assert server.sent < prober.PROBE_BYTES * 4
+
+
+def test_probe_reports_dead_and_unsupported_urls(provider):
+	_, base = provider
+	assert probe_url(f"{base}/gone.ts", timeout=2)["alive"] is False
+	assert probe_url("rtp://239.0.0.1:5000")["alive"] is None
+
+
+def test_sweep_runs_at_full_rate_when_idle(provider):
+	_, base = provider
+	channel_prober = ChannelProber(FakePlayer(), workers=2, timeout=2, rate=50)
+	channel_prober.set_catalog([{"url": f"{base}/live/{n}.ts"} for n in range(5)])
+	start = time.monotonic()
+	channel_prober.sweep()
+	assert time.monotonic() - start < 2
+	assert channel_prober.summary() == {"alive": 5, "dead": 0, "unknown": 0}
+
+
+def test_sweep_is_paced_by_the_live_bitrate(provider):
+	server, base = provider
+	player = FakePlayer()
+	player.current_index = 0
+	# 10% of this bitrate is one probe every 0.25 s
+	player.player.video_bitrate = prober.PROBE_BYTES * 8 / 0.25 / 0.1
+	channel_prober = ChannelProber(player, workers=4, timeout=2, rate=50, live_share=0.1)
+	channel_prober.set_catalog([{"url": f"{base}/live/{n}.ts"} for n in range(4)])
+	channel_prober.sweep()
+	starts = [when for when, _ in server.requests]
+	assert len(starts) == 4
+	assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.2
+
+
+def test_probes_wait_for_a_tune(provider):
+	server, base = provider
+	player = FakePlayer()
+	player.tuning = True
+	channel_prober = ChannelProber(player, timeout=2, rate=50)
+	channel_prober.set_catalog([{"url": f"{base}/live/1.ts"}])
+	sweep = threading.Thread(target=channel_prober.sweep)
+	sweep.start()
+	time.sleep(0.7)
+	assert server.requests == []
+	player.tuning = False
+	sweep.join(5)
+	assert len(server.requests) == 1
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from recorder import RateBudget, RecordingScheduler, TsSegmenter
+from timeshift import TS_PACKET_SIZE
+
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+PMT_PID = 0x1000
+
+
+def packet(pid, payload=b'', start=False, random_access=False):
+	"""Build a TS packet, with an adaptation field flagging a random access point if asked."""
+	header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xff])
+	if random_access:
+		data = header + b'\x30\x07\x40' + b'\x00' * 6 + payload
+	else:
+		data = header + b'\x10' + payload
+	return data + b'\xff' * (TS_PACKET_SIZE - len(data))
+
+
+def section(table_id, body):
+	"""Wrap a table body in a section with a dummy CRC, behind a zero pointer field."""
+	length = len(body) + 4
+	return b'\x00' + bytes([table_id, 0xb0 | length >> 8, length & 0xff]) + body + b'\x00' * 4
+
+
+PAT = packet(0, section(0x00, b'\x00\x01\xc1\x00\x00' + b'\x00\x01' + bytes([0xe0 | PMT_PID >> 8, PMT_PID & 0xff])), start=True)
+
+
+def pmt(streams):
+	"""Build a PMT packet listing (stream type, PID) pairs."""
+	body = b'\x00\x01\xc1\x00\x00' + bytes([0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff]) + b'\xf0\x00'
+	for stream_type, pid in streams:
+		body += bytes([stream_type, 0xe0 | pid >> 8, pid & 0xff, 0xf0, 0x00])
+	return packet(PMT_PID, section(0x02, body), start=True)
+
+
+PMT = pmt([(0x1b, VIDEO_PID), (0x0f, AUDIO_PID)])
+KEYFRAME = packet(VIDEO_PID, start=True, random_access=True)
+AUDIO_FRAME = packet(AUDIO_PID, start=True, random_access=True)
+VIDEO = packet(VIDEO_PID)
+
+
+def read_segments(segmenter):
+	return [open(path, 'rb').read() for path in segmenter.segments]
+
+
+def test_segmenter_cuts_on_video_keyframe(tmp_path):
+	segmenter = TsSegmenter(str(tmp_path), segment_secs=1)
+	segmenter.feed(PAT + PMT + KEYFRAME + VIDEO * 10)
+	# Past the target duration, but not so far a cut is forced
+	segmenter.segment_started -= 1.5
+	segmenter.feed(PAT + PMT + VIDEO + AUDIO_FRAME + VIDEO)
+	assert len(segmenter.segments) == 1
+	segmenter.feed(KEYFRAME + VIDEO)
+	segmenter.close()
+
+	first, second = read_segments(segmenter)
+	assert first == PAT + PMT + KEYFRAME + VIDEO * 10 + PAT + PMT + VIDEO + AUDIO_FRAME + VIDEO
+	# The new segment starts with the tables, then the keyframe
+	assert second == PAT + PMT + KEYFRAME + VIDEO
+	assert segmenter.bytes == len(first) + len(second) - 2 * TS_PACKET_SIZE
+
+
+def test_segmenter_waits_for_pmt_then_forces_a_cut(tmp_path):
+	segmenter = TsSegmenter(str(tmp_path), segment_secs=1)
+	segmenter.feed(VIDEO * 4)
+	segmenter.segment_started -= 1.5
+	# No PMT seen yet: a flagged packet can't be known to be video
+	segmenter.feed(KEYFRAME + VIDEO)
+	assert len(segmenter.segments) == 1
+	segmenter.segment_started -= 1
+	segmenter.feed(VIDEO * 2)
+	segmenter.close()
+	assert len(segmenter.segments) == 2
+	assert read_segments(segmenter)[1] == VIDEO * 2
+
+
+def test_segmenter_cuts_audio_only_streams_anywhere(tmp_path):
+	segmenter = TsSegmenter(str(tmp_path), segment_secs=1)
+	audio_pmt = pmt([(0x0f, AUDIO_PID)])
+	segmenter.feed(PAT + audio_pmt + AUDIO_FRAME)
+	segmenter.segment_started -= 1.5
+	segmenter.feed(PAT + audio_pmt + packet(AUDIO_PID) + AUDIO_FRAME)
+	segmenter.close()
+	assert read_segments(segmenter)[1] == PAT + audio_pmt + AUDIO_FRAME
+
+
+def test_segmenter_continues_after_existing_segments(tmp_path):
+	(tmp_path / "segment-0000.ts").write_bytes(VIDEO)
+	(tmp_path / "segment-0003.ts").write_bytes(VIDEO * 2)
+	segmenter = TsSegmenter(str(tmp_path), segment_secs=1)
+	assert segmenter.bytes == 3 * TS_PACKET_SIZE
+	segmenter.feed(PAT + PMT + KEYFRAME)
+	segmenter.close()
+	assert segmenter.segments[-1] == str(tmp_path / "segment-0004.ts")
+	assert (tmp_path / "segment-0003.ts").read_bytes() == VIDEO * 2
+
+
+def test_rate_budget_is_shared_between_consumers():
+	budget = RateBudget(100000, burst_secs=0)
+
+	def consume():
+		for _ in range(5):
+			budget.consume(10000)
+
+	start = time.monotonic()
+	threads = [threading.Thread(target=consume) for _ in range(2)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	# 100 kB at 100 kB/s, the first booking being free
+	assert 0.85 <= time.monotonic() - start < 1.5
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+	"""Stand-in provider: a synthetic MPEG-TS stream at a fixed bitrate, a keyframe a second."""
+
+	def do_GET(self):
+		self.server.connections += 1
+		self.send_response(200)
+		self.send_header("Content-Type", "video/mp2t")
+		self.end_headers()
+		# A tenth of a second at 4 Mbit/s
+		tick = PAT + PMT + KEYFRAME + VIDEO * 263
+		start = time.monotonic()
+		sent = 0
+		try:
+			while True:
+				self.wfile.write(tick)
+				sent += 1
+				time.sleep(max(0, start + sent / 10 - time.monotonic()))
+		except OSError:
+			pass
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def provider():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+	server.daemon_threads = True
+	server.connections = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+def test_scheduler_caps_concurrency_and_bandwidth(tmp_path, provider):
+	bandwidth = 200000
+	scheduler = RecordingScheduler(None, str(tmp_path), max_concurrent=2, bandwidth=bandwidth,
+								   io_rate=1000000, segment_secs=1)
+	url = f"http://127.0.0.1:{provider.server_address[1]}/live.ts"
+	now = time.time()
+	for i in range(3):
+		scheduler.schedule({"name": f"Stand-in {i}", "url": url}, now, now + 3)
+	scheduler.start()
+
+	most = 0
+	while time.time() < now + 5 and scheduler.metrics()["recording"] + scheduler.metrics()["scheduled"]:
+		most = max(most, scheduler.metrics()["recording"])
+		time.sleep(0.05)
+	scheduler.running = False
+
+	recordings = scheduler.list()
+	assert most == 2
+	assert provider.connections == 2
+	assert sorted(recording["state"] for recording in recordings) == ["completed", "completed", "missed"]
+	total = sum(recording["bytes"] for recording in recordings)
+	# Both recordings share the budget: 3 seconds plus the burst allowance, give or take a chunk each
+	assert 0 < total <= bandwidth * (3 + scheduler.bandwidth.burst_secs) + 2 * 65536
+	for recording in recordings:
+		if recording["state"] == "completed":
+			assert recording["segments"] >= 2
+			assert sorted(os.listdir(recording["path"]))[0] == "segment-0000.ts"
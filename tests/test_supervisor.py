@@ -0,0 +1,77 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from supervisor import ProcessSupervisor
+
+
+@pytest.fixture
+def sleeper():
+	"""A process launched outside the supervisor, with arguments no other test uses."""
+	processes = []
+
+	def launch(*args):
+		process = subprocess.Popen(["sleep", *args])
+		processes.append(process)
+		# Popen can return before the child has exec'd sleep
+		deadline = time.monotonic() + 2
+		while time.monotonic() < deadline:
+			with open(f"/proc/{process.pid}/cmdline", "rb") as f:
+				if f.read().startswith(b"sleep\0"):
+					break
+			time.sleep(0.01)
+		return process
+
+	yield launch
+	for process in processes:
+		process.kill()
+		process.wait()
+
+
+def test_adopts_the_recorded_instance(tmp_path):
+	pidfile = str(tmp_path / "sleep.pid")
+	supervisor = ProcessSupervisor("sleep", ["sleep", "301.5"], pidfile=pidfile)
+	assert supervisor.start()
+	pid, start_time = supervisor.pid, supervisor.start_time
+	assert open(pidfile).read() == f"{pid} {start_time}"
+
+	# A restarted web process picks the instance up again
+	adopted = ProcessSupervisor("sleep", ["sleep", "301.5"], pidfile=pidfile)
+	assert adopted.pid == pid
+	assert adopted.stop(timeout=2)
+	deadline = time.monotonic() + 2
+	while supervisor.is_running() and time.monotonic() < deadline:
+		time.sleep(0.05)
+	assert not supervisor.is_running()
+	assert not os.path.exists(pidfile)
+
+
+def test_recycled_pid_is_not_adopted(tmp_path, sleeper):
+	pidfile = str(tmp_path / "sleep.pid")
+	process = sleeper("302.5")
+	# Same PID and command line, but the recorded process started at another time
+	with open(pidfile, "w") as f:
+		f.write(f"{process.pid} 1")
+	supervisor = ProcessSupervisor("sleep", ["sleep", "302.5"], pidfile=pidfile)
+	# Found by the /proc scan instead, with its real start time
+	assert supervisor.pid == process.pid
+	assert open(pidfile).read() != f"{process.pid} 1"
+
+	# Once that process is gone, its PID isn't signalled any more
+	supervisor.start_time = 1
+	supervisor.stop(timeout=0.2)
+	assert process.poll() is None
+
+
+def test_other_command_lines_are_not_adopted(tmp_path, sleeper):
+	pidfile = str(tmp_path / "sleep.pid")
+	process = sleeper("303.5")
+	with open(pidfile, "w") as f:
+		f.write(f"{process.pid} 0")
+	# Same program, other arguments: neither the pidfile nor the /proc scan match
+	supervisor = ProcessSupervisor("sleep", ["sleep", "303.25"], pidfile=pidfile)
+	assert supervisor.pid is None
+	assert not os.path.exists(pidfile)
+	assert process.poll() is None
@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import timeshift
+from timeshift import TS_PACKET_SIZE, RingBuffer, Timeshift, ts_sync_offset
+
+
+def packets(first, count):
+	"""Numbered TS packets, so data read back can be checked against its stream offset."""
+	return b''.join(b'\x47' + (first + n).to_bytes(4, 'big') + b'\x00' * (TS_PACKET_SIZE - 5) for n in range(count))
+
+
+def test_ts_sync_offset():
+	stream = packets(0, 3)
+	assert ts_sync_offset(stream) == 0
+	assert ts_sync_offset(b'\x00\x01' + stream) == 2
+	# A lone 0x47 that isn't followed by another one a packet later is skipped
+	assert ts_sync_offset(b'\x47\x00\x00' + stream) == 3
+	assert ts_sync_offset(b'\x00' * 400) == -1
+
+
+def test_ring_reads_from_memory_then_disk(tmp_path):
+	ring = RingBuffer(str(tmp_path / "ring.ts"), 4096, block_size=1024)
+	ring.append(b'a' * 1000)
+	assert ring.end == 1000
+	assert ring.written == 0
+	assert ring.read(10, 5) == b'aaaaa'
+	assert ring.read(1000, 5) == b''
+
+	ring.append(b'b' * 100)
+	assert ring.written == 1024
+	# Reads from the file stop at the end of the written blocks
+	assert ring.read(1000, 100) == b'b' * 24
+	assert ring.read(1024, 100) == b'b' * 76
+	ring.close()
+
+
+def test_ring_overwrites_the_oldest_blocks(tmp_path):
+	ring = RingBuffer(str(tmp_path / "ring.ts"), 4096, block_size=1024)
+	for n in range(10):
+		ring.append(bytes([n]) * 1024)
+	assert ring.end == 10240
+	# One block of margin is kept between readers and the writer
+	assert ring.start == 10240 - 4096 + 1024
+	assert ring.read(0, 10) is None
+	assert ring.read(ring.start - 1, 10) is None
+	assert ring.read(ring.start, 10) == bytes([7]) * 10
+	# Reads don't wrap past the end of the file
+	assert ring.read(7 * 1024 + 1000, 100) == bytes([7]) * 24
+	assert ring.read(8 * 1024 + 1000, 100) == bytes([8]) * 24 + bytes([9]) * 76
+	assert ring.read(9 * 1024, 1024) == bytes([9]) * 1024
+	ring.close()
+	assert ring.read(9 * 1024, 10) is None
+	assert not (tmp_path / "ring.ts").exists()
+
+
+def test_ring_keeps_the_file_open_for_reads_in_progress(tmp_path, monkeypatch):
+	ring = RingBuffer(str(tmp_path / "ring.ts"), 4096, block_size=1024)
+	ring.append(b'x' * 2048)
+	reading = threading.Event()
+	release = threading.Event()
+	pread = timeshift.os.pread
+
+	def slow_pread(fd, count, position):
+		reading.set()
+		release.wait(2)
+		return pread(fd, count, position)
+
+	monkeypatch.setattr(timeshift.os, "pread", slow_pread)
+	results = []
+	reader = threading.Thread(target=lambda: results.append(ring.read(0, 100)))
+	reader.start()
+	assert reading.wait(2)
+
+	ring.close()
+	# The descriptor can't be reused by another file while the read uses it
+	assert ring.fd is not None
+	release.set()
+	reader.join()
+	assert results == [None]
+	assert ring.fd is None
+
+
+def test_checkpoints_map_time_to_offsets(tmp_path):
+	shift = Timeshift(SimpleNamespace(), str(tmp_path), max_secs=60)
+	assert shift._offset_at(time.time()) == 0
+	shift.checkpoints.extend([(100.0, 0), (101.0, 5000), (102.0, 9000)])
+	assert shift._offset_at(100.5) == 0
+	assert shift._offset_at(101.0) == 5000
+	assert shift._offset_at(99.0) == 0
+	assert shift._offset_at(200.0) == 9000
+	assert shift._time_at(4999) == 100.0
+	assert shift._time_at(5000) == 101.0
+	assert shift._time_at(20000) == 102.0
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+	"""Stand-in provider: numbered packets, starting mid-packet, about 1 MB/s."""
+
+	def do_GET(self):
+		self.server.connections += 1
+		self.send_response(200)
+		self.send_header("Content-Type", "video/mp2t")
+		self.end_headers()
+		number = 0
+		try:
+			self.wfile.write(b'\x00\x00\x00')
+			while True:
+				self.wfile.write(packets(number, 50))
+				number += 50
+				time.sleep(0.01)
+		except OSError:
+			pass
+
+	def log_message(self, *args):
+		pass
+
+
+class FakeMPV:
+	def __init__(self):
+		self.loaded = []
+		self.pause = False
+		self.playback_time = None
+
+	def loadfile(self, url, **options):
+		self.loaded.append((url, options))
+
+
+@pytest.fixture
+def provider():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), ProviderHandler)
+	server.daemon_threads = True
+	server.connections = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+def test_pause_records_over_a_single_connection(tmp_path, provider):
+	player = SimpleNamespace(player=FakeMPV(), config_lock=threading.Lock(), health_monitor=None,
+							 to_qt_queue=queue.Queue())
+	shift = Timeshift(player, str(tmp_path), max_bytes=4 * 1024 * 1024, block_size=64 * 1024)
+	channel = {"name": "Stand-in", "url": f"http://127.0.0.1:{provider.server_address[1]}/live.ts"}
+
+	assert shift.toggle_pause(channel)
+	# mpv is moved onto the buffer, paused, so the recorder is the only upstream connection
+	url, options = player.player.loaded[-1]
+	assert url.startswith("http://127.0.0.1:") and "offset=0" in url
+	assert options["cache"] == "no"
+	assert player.player.pause and shift.paused
+
+	deadline = time.monotonic() + 5
+	while shift.ring.end < 200 * 1024 and time.monotonic() < deadline:
+		time.sleep(0.05)
+	assert provider.connections == 1
+	assert shift.status()["buffered_bytes"] >= 200 * 1024
+
+	# What mpv reads from the buffer is the stream from its first whole packet on
+	with requests.get(url, stream=True, timeout=5) as response:
+		data = b''
+		for chunk in response.iter_content(65536):
+			data += chunk
+			if len(data) >= 200 * 1024:
+				break
+	usable = len(data) - len(data) % TS_PACKET_SIZE
+	assert data[:usable] == packets(0, usable // TS_PACKET_SIZE)
+
+	# A buffer of another generation is gone
+	query = urllib.parse.urlparse(url).query.replace("g=", "g=9")
+	assert requests.get(url.split("?")[0] + "?" + query, timeout=5).status_code == 404
+
+	assert not shift.toggle_pause(channel)
+	assert not player.player.pause
+	shift.stop(resume_live=True)
+	assert player.player.loaded[-1] == (channel["url"], {})
+	assert not shift.active
+	assert provider.connections == 1
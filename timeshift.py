@@ -0,0 +1,473 @@
+#!/usr/bin/python
+"""Timeshift (pause live TV) for IPMPV."""
+
+import bisect
+import collections
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+TS_PACKET_SIZE = 188
+
+def ts_sync_offset(data):
+	"""
+	Find the first MPEG-TS packet boundary in a chunk of stream.
+
+	Args:
+		data (bytes): Stream data.
+
+	Returns:
+		int: Offset of a sync byte followed by another one a packet later, or -1.
+	"""
+	sync = data.find(b'\x47')
+	while 0 <= sync and sync + TS_PACKET_SIZE < len(data) and data[sync + TS_PACKET_SIZE] != 0x47:
+		sync = data.find(b'\x47', sync + 1)
+	return sync
+
+class RingBuffer:
+	"""
+	Fixed-size file holding the most recent part of a stream.
+
+	Data is addressed by its offset in the stream. It is written in blocks
+	of `block_size` bytes at block-aligned positions, always in order, so
+	the card only sees large sequential writes, and the file never grows.
+	The bytes of the block being filled are read from memory.
+	"""
+
+	def __init__(self, path, size, block_size=1024 * 1024):
+		"""
+		Create the buffer file.
+
+		Args:
+			path (str): File to keep the buffer in.
+			size (int): Bytes of stream kept. Rounded down to whole blocks.
+			block_size (int): Bytes per write.
+		"""
+		self.path = path
+		self.block_size = block_size
+		self.size = max(2, size // block_size) * block_size
+		self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+		try:
+			# Allocate the whole file up front, so it isn't fragmented as it fills
+			os.posix_fallocate(self.fd, 0, self.size)
+		except (AttributeError, OSError):
+			os.ftruncate(self.fd, self.size)
+		self.pending = bytearray()
+		self.written = 0
+		self.closed = False
+		# Reads in progress outside the lock: the file is closed after the last one
+		self.readers = 0
+		self.cond = threading.Condition()
+
+	@property
+	def end(self):
+		"""Offset just past the newest byte."""
+		return self.written + len(self.pending)
+
+	@property
+	def start(self):
+		"""Offset of the oldest byte that can still be read."""
+		# Keep a block of margin so readers never race the writer
+		return max(0, self.written - self.size + self.block_size)
+
+	def append(self, data):
+		"""Add stream data, writing every block that is complete."""
+		with self.cond:
+			self.pending += data
+			while len(self.pending) >= self.block_size:
+				os.pwrite(self.fd, self.pending[:self.block_size], self.written % self.size)
+				del self.pending[:self.block_size]
+				self.written += self.block_size
+			self.cond.notify_all()
+
+	def read(self, offset, count):
+		"""
+		Read stream data.
+
+		Args:
+			offset (int): Stream offset to read from.
+			count (int): Maximum number of bytes.
+
+		Returns:
+			bytes: The data, empty if nothing is there yet, or None if it has
+				been overwritten or the buffer is closed.
+		"""
+		with self.cond:
+			if self.closed or offset < self.start:
+				return None
+			if offset >= self.written:
+				return bytes(self.pending[offset - self.written:offset - self.written + count])
+			position = offset % self.size
+			count = min(count, self.written - offset, self.size - position)
+			self.readers += 1
+		try:
+			data = os.pread(self.fd, count, position)
+		finally:
+			with self.cond:
+				self.readers -= 1
+				if self.closed and not self.readers:
+					self._close_file()
+				# The writer may have gone round the ring during the read
+				if self.closed or offset < self.start:
+					data = None
+		return data
+
+	def wait(self, offset, timeout):
+		"""Wait until there is data at an offset, or the buffer is closed."""
+		with self.cond:
+			self.cond.wait_for(lambda: self.end > offset or self.closed, timeout)
+
+	def _close_file(self):
+		"""Close the file descriptor once. Must be called with the lock held."""
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+	def close(self):
+		"""Close and delete the buffer file, once no read is using it."""
+		with self.cond:
+			if self.closed:
+				return
+			self.closed = True
+			self.cond.notify_all()
+			if not self.readers:
+				self._close_file()
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+class Timeshift:
+	"""
+	Pause, rewind and jump back to live on the playing channel.
+
+	Pausing starts recording the channel into a RingBuffer on disk, bounded
+	by size and duration. While timeshifting, mpv plays the buffer through a
+	local HTTP server, at any offset, with its own cache kept small, so
+	memory use doesn't depend on how far behind live playback is. mpv is
+	moved onto the buffer as soon as it pauses, so the provider only sees
+	the recorder's connection. The buffer is dropped when the channel
+	changes or timeshift is stopped.
+
+	Only MPEG-TS streams can be timeshifted: they can be cut at any packet.
+	"""
+
+	def __init__(self, player, directory, max_bytes=1024 * 1024 * 1024, max_secs=3600, block_size=1024 * 1024):
+		"""
+		Initialize timeshift.
+
+		Args:
+			player (Player): Player to control.
+			directory (str): Directory the buffer file is created in. Should
+				be on disk, not on a tmpfs.
+			max_bytes (int): Size of the buffer file.
+			max_secs (float): How far back playback can go.
+			block_size (int): Bytes per write. A multiple of the flash erase
+				block size keeps write amplification down.
+		"""
+		self.player = player
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.max_secs = max_secs
+		self.block_size = block_size
+
+		self.lock = threading.RLock()
+		self.ring = None
+		self.channel = None
+		self.generation = 0
+		# (time, stream offset) once a second, to map between the two
+		self.checkpoints = collections.deque(maxlen=int(max_secs) + 60)
+		self.paused = False
+		self.load_time = None
+		self.error = None
+		self.http_server = None
+		self.osd_timer = None
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def active(self):
+		"""Whether the playing channel is being recorded."""
+		return self.ring is not None
+
+	def _serve(self):
+		"""Start the local HTTP server mpv reads the buffer from."""
+		if self.http_server is not None:
+			return
+		timeshift = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+				timeshift._stream(self, int(query.get("offset", ["0"])[0]), int(query.get("g", ["0"])[0]))
+
+			def log_message(self, format, *args):
+				pass
+
+		self.http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.http_server.daemon_threads = True
+		threading.Thread(target=self.http_server.serve_forever, name="timeshift-http", daemon=True).start()
+
+	def _stream(self, handler, offset, generation):
+		"""Send the buffer from an offset on, following the live edge."""
+		ring = self.ring
+		if ring is None or generation != self.generation:
+			handler.send_error(404)
+			return
+		handler.send_response(200)
+		handler.send_header("Content-Type", "video/mp2t")
+		handler.end_headers()
+		offset -= offset % TS_PACKET_SIZE
+		try:
+			while generation == self.generation:
+				data = ring.read(offset, 65536)
+				if data is None:
+					if ring.closed:
+						return
+					# Paused for longer than the buffer holds: continue from the oldest data
+					offset = ring.start + (-ring.start % TS_PACKET_SIZE)
+					continue
+				if not data:
+					ring.wait(offset, 1)
+					continue
+				handler.wfile.write(data)
+				offset += len(data)
+		except OSError:
+			# mpv went away, or the buffer was closed under the read
+			pass
+
+	def start(self, channel):
+		"""
+		Start recording a channel, with mpv paused at the start of the buffer.
+
+		Args:
+			channel (dict): Channel dictionary of the playing channel.
+
+		Returns:
+			bool: Whether recording started.
+		"""
+		with self.lock:
+			if self.ring is not None:
+				return True
+			if ".m3u8" in channel["url"].lower():
+				self.error = "HLS streams can't be timeshifted"
+				return False
+			self._serve()
+			self.generation += 1
+			self.channel = channel
+			self.checkpoints.clear()
+			self.ring = RingBuffer(os.path.join(self.directory, "timeshift.ts"), self.max_bytes, self.block_size)
+			self.error = None
+			# Drop mpv's own connection before the recorder opens one: the
+			# provider may allow only one, and mpv's cache would keep filling
+			self._play_from(0, paused=True)
+			threading.Thread(target=self._record, args=(self.ring, self.generation),
+							 name="timeshift-record", daemon=True).start()
+		if self.player.health_monitor is not None:
+			# Reconnecting to the channel would bypass the buffer
+			self.player.health_monitor.unwatch()
+		print(f"Timeshift: recording {channel['name']}")
+		return True
+
+	def _record(self, ring, generation):
+		"""Copy the live stream into the buffer."""
+		options = self.channel.get("options") or {}
+		headers = {}
+		if options.get("user-agent"):
+			headers["User-Agent"] = options["user-agent"]
+		if options.get("referrer"):
+			headers["Referer"] = options["referrer"]
+		try:
+			with requests.get(self.channel["url"], headers=headers, stream=True, timeout=10) as response:
+				response.raise_for_status()
+				synced = False
+				last_checkpoint = 0
+				for chunk in response.iter_content(65536):
+					if generation != self.generation:
+						return
+					if not synced:
+						# Start on a packet boundary
+						sync = ts_sync_offset(chunk)
+						if sync < 0:
+							continue
+						chunk = chunk[sync:]
+						synced = True
+					now = time.time()
+					if now - last_checkpoint >= 1:
+						self.checkpoints.append((now, ring.end))
+						last_checkpoint = now
+					ring.append(chunk)
+		except Exception as e:
+			if generation == self.generation:
+				self.error = str(e)
+				print(f"\033[91mTimeshift: recording {self.channel['name']} failed: {e}\033[0m")
+		else:
+			if generation == self.generation:
+				self.error = "stream ended"
+
+	def stop(self, resume_live=False):
+		"""
+		Stop timeshifting and drop the buffer.
+
+		Args:
+			resume_live (bool): Go back to playing the channel directly.
+		"""
+		with self.lock:
+			if self.ring is None:
+				return
+			ring, channel = self.ring, self.channel
+			self.ring = None
+			self.generation += 1
+			self.paused = False
+		ring.close()
+		print("Timeshift: stopped")
+		if resume_live:
+			with self.player.config_lock:
+				self.player.player.loadfile(channel["url"], **(channel.get("options") or {}))
+				self.player.player.pause = False
+			if self.player.health_monitor is not None:
+				self.player.health_monitor.watch(channel)
+		self._show_osd()
+
+	def _time_at(self, offset):
+		"""Get the time a stream offset was recorded at."""
+		checkpoints = list(self.checkpoints)
+		if not checkpoints:
+			return time.time()
+		i = bisect.bisect_right([entry[1] for entry in checkpoints], offset) - 1
+		return checkpoints[max(0, i)][0]
+
+	def _offset_at(self, when):
+		"""Get the stream offset recorded at a time."""
+		checkpoints = list(self.checkpoints)
+		if not checkpoints:
+			return 0
+		i = bisect.bisect_right([entry[0] for entry in checkpoints], when) - 1
+		return checkpoints[max(0, i)][1]
+
+	def _oldest_offset(self):
+		"""Get the oldest offset within both the size and the duration limit."""
+		return max(self.ring.start, self._offset_at(time.time() - self.max_secs))
+
+	def _play_from(self, offset, paused=False):
+		"""Play the buffer from an offset, or load it paused there."""
+		offset = max(offset, self._oldest_offset())
+		offset -= offset % TS_PACKET_SIZE
+		self.load_time = time.time() if offset >= self.ring.end - TS_PACKET_SIZE else self._time_at(offset)
+		url = f"http://127.0.0.1:{self.http_server.server_address[1]}/stream?offset={offset}&g={self.generation}"
+		with self.player.config_lock:
+			# The source is local and fast: keep mpv from caching ahead of playback in RAM
+			self.player.player.loadfile(url, cache='no', demuxer_max_back_bytes='0', demuxer_readahead_secs='1')
+			self.player.player.pause = paused
+		self.paused = paused
+
+	def playing_time(self):
+		"""Get the time the picture on screen was broadcast, or None when not timeshifting."""
+		if self.ring is None:
+			return None
+		try:
+			elapsed = self.player.player.playback_time or 0
+		except Exception:
+			elapsed = 0
+		return self.load_time + elapsed
+
+	def toggle_pause(self, channel):
+		"""
+		Pause or resume, starting to record on the first pause.
+
+		Args:
+			channel (dict): Channel dictionary of the playing channel.
+
+		Returns:
+			bool: Whether playback is paused now.
+		"""
+		with self.lock:
+			if self.ring is None:
+				if not self.start(channel):
+					return False
+			elif not self.paused:
+				self.player.player.pause = True
+				self.paused = True
+			else:
+				self.player.player.pause = False
+				self.paused = False
+		self._show_osd()
+		return self.paused
+
+	def seek(self, seconds):
+		"""
+		Move playback back or forward.
+
+		Args:
+			seconds (float): Seconds to move, negative to rewind.
+
+		Returns:
+			bool: Whether timeshift is active.
+		"""
+		with self.lock:
+			if self.ring is None:
+				return False
+			target = self.playing_time() + seconds
+			if target >= time.time() - 1:
+				self._play_from(self.ring.end)
+			else:
+				self._play_from(self._offset_at(target))
+		self._show_osd()
+		return True
+
+	def jump_live(self):
+		"""Play the live edge of the buffer. Rewinding stays possible."""
+		with self.lock:
+			if self.ring is None:
+				return False
+			self._play_from(self.ring.end)
+		self._show_osd()
+		return True
+
+	def status(self):
+		"""
+		Get the timeshift position.
+
+		Returns:
+			dict: Whether timeshift is active and paused, the delay behind live
+				and the seconds and bytes buffered.
+		"""
+		with self.lock:
+			ring = self.ring
+			if ring is None:
+				return {"active": False, "paused": False, "error": self.error}
+			now = time.time()
+			oldest = self._oldest_offset()
+			return {
+				"active": True,
+				"paused": self.paused,
+				"channel": self.channel["name"],
+				"delay": round(max(0, now - self.playing_time()), 1),
+				"buffered_secs": round(now - self._time_at(oldest), 1),
+				"buffered_bytes": ring.end - oldest,
+				"max_secs": self.max_secs,
+				"max_bytes": ring.size,
+				"error": self.error
+			}
+
+	def _show_osd(self):
+		"""Show the timeshift position on the OSD."""
+		status = self.status()
+		self.player.to_qt_queue.put({
+			'action': 'show_timeshift_osd',
+			'active': status["active"],
+			'paused': status["paused"],
+			'delay': status.get("delay", 0),
+			'buffered': status.get("buffered_secs", 0),
+			'max_secs': self.max_secs
+		})
+		if self.osd_timer is not None:
+			self.osd_timer.cancel()
+			self.osd_timer = None
+		if status["paused"]:
+			# Keep the growing delay on screen while paused
+			self.osd_timer = threading.Timer(1, self._show_osd)
+			self.osd_timer.daemon = True
+			self.osd_timer.start()
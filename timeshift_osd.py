@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""Timeshift on-screen display widget for IPMPV."""
+
+import traceback
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from volume_osd import VolumeOsdWidget
+
+def format_delay(seconds):
+	"""Format a delay behind live as "-m:ss" or "-h:mm:ss"."""
+	seconds = int(seconds)
+	hours, rest = divmod(seconds, 3600)
+	if hours:
+		return f"-{hours}:{rest // 60:02d}:{rest % 60:02d}"
+	return f"-{rest // 60}:{rest % 60:02d}"
+
+class TimeshiftOsdWidget(VolumeOsdWidget):
+	"""Widget showing how far behind live playback is, and how much is buffered."""
+
+	def __init__(self, position, width=360, height=80, close_time=3):
+		"""
+		Initialize the timeshift OSD widget.
+
+		Args:
+			position (dict): Timeshift position, see update_position().
+			width (int): Width of the widget
+			height (int): Height of the widget
+			close_time (int): Time in seconds before the widget closes
+		"""
+		self.position = position
+		super().__init__(0, width=width, height=height, close_time=close_time)
+		self.setWindowTitle("Timeshift OSD")
+
+	def update_position(self, position):
+		"""
+		Update the position displayed in the OSD.
+
+		Args:
+			position (dict): "active", "paused", "delay" and "buffered" seconds.
+		"""
+		self.position = position
+		self.update()  # Trigger repaint
+
+	def draw_osd_content(self, painter, x_offset, y_offset):
+		"""Draw the OSD content."""
+		try:
+			path = QPainterPath()
+			path.addRoundedRect(
+				x_offset, y_offset,
+				self.orig_width, self.orig_height,
+				self.corner_radius, self.corner_radius
+			)
+			painter.setPen(Qt.NoPen)
+			painter.setBrush(QColor(0, 50, 100, 200))  # RGBA
+			painter.drawPath(path)
+
+			position = self.position
+			delay = position.get('delay', 0)
+			buffered = position.get('buffered', 0)
+			if not position.get('active'):
+				label = "Live"
+			elif position.get('paused'):
+				label = "Paused"
+			else:
+				label = "Timeshift"
+
+			painter.setPen(QColor(255, 255, 255))
+			font = QFont("Fira Sans", 14)
+			font.setBold(True)
+			painter.setFont(font)
+			painter.drawText(x_offset + 20, y_offset + 30, label)
+
+			font.setPointSize(12)
+			painter.setFont(font)
+			delay_text = format_delay(delay) if position.get('active') and delay >= 1 else "Live"
+			painter.drawText(x_offset + self.orig_width - 90, y_offset + 30, delay_text)
+
+			# The bar spans the buffered part of the stream, live at the right end
+			bar_x = x_offset + 20
+			bar_y = y_offset + 40
+			bar_width = self.orig_width - 40
+			bar_height = 16
+
+			bg_path = QPainterPath()
+			bg_path.addRoundedRect(bar_x, bar_y, bar_width, bar_height, 8, 8)
+			painter.setPen(Qt.NoPen)
+			painter.setBrush(QColor(255, 255, 255, 70))
+			painter.drawPath(bg_path)
+
+			if position.get('active') and buffered > 0:
+				fill_width = max(bar_height, int(bar_width * max(0, buffered - delay) / buffered))
+				fill_path = QPainterPath()
+				fill_path.addRoundedRect(bar_x, bar_y, fill_width, bar_height, 8, 8)
+				painter.setBrush(QColor(255, 193, 7) if position.get('paused') else QColor(0, 200, 83))
+				painter.drawPath(fill_path)
+
+		except Exception as e:
+			print(f"Error in painting timeshift OSD: {e}")
+			traceback.print_exc()
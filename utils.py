@@ -3,16 +3,62 @@
 
 import os
 import re
-import subprocess
 import secrets
+import sys
 
 # Environment variables
 is_wayland = "WAYLAND_DISPLAY" in os.environ
 osd_corner_radius = os.environ.get("IPMPV_CORNER_RADIUS")
 ipmpv_retroarch_cmd = os.environ.get("IPMPV_RETROARCH_CMD")
 m3u_url = os.environ.get('IPMPV_M3U_URL')
+# Several playlists can be given, separated by whitespace, in order of precedence
+m3u_sources = m3u_url.split() if m3u_url else []
+m3u_timeout = float(os.environ.get('IPMPV_M3U_TIMEOUT', '30'))
+# Longest a playlist may take to load as a whole before it is left out
+m3u_deadline = float(os.environ.get('IPMPV_M3U_DEADLINE', '120'))
 hwdec = os.environ.get('IPMPV_HWDEC')
 ao = os.environ.get('IPMPV_AO')
+drm_connector = os.environ.get('IPMPV_DRM_CONNECTOR')
+auto_mode = os.environ.get('IPMPV_AUTO_MODE', '').lower() in ('1', 'yes', 'true')
+mode_overrides_file = os.environ.get('IPMPV_MODE_OVERRIDES')
+profiles_file = os.environ.get('IPMPV_PROFILES')
+adaptive_buffer = os.environ.get('IPMPV_ADAPTIVE_BUFFER', '').lower() in ('1', 'yes', 'true')
+buffer_min = float(os.environ.get('IPMPV_BUFFER_MIN', '0.2'))
+buffer_max = float(os.environ.get('IPMPV_BUFFER_MAX', '8'))
+buffer_state_file = os.environ.get('IPMPV_BUFFER_STATE')
+stream_health = os.environ.get('IPMPV_STREAM_HEALTH', 'yes').lower() in ('1', 'yes', 'true')
+stall_timeout = float(os.environ.get('IPMPV_STALL_TIMEOUT', '6'))
+tune_timeout = float(os.environ.get('IPMPV_TUNE_TIMEOUT', '8'))
+probe_channels = os.environ.get('IPMPV_PROBE', '').lower() in ('1', 'yes', 'true')
+probe_workers = int(os.environ.get('IPMPV_PROBE_WORKERS', '4'))
+probe_rate = float(os.environ.get('IPMPV_PROBE_RATE', '2'))
+probe_interval = float(os.environ.get('IPMPV_PROBE_INTERVAL', '900'))
+epg_url = os.environ.get('IPMPV_EPG_URL')
+epg_cache_file = os.environ.get('IPMPV_EPG_CACHE')
+state_file = os.environ.get('IPMPV_STATE_FILE', os.path.join(os.path.dirname(__file__), '.state.json'))
+resume_last_channel = os.environ.get('IPMPV_RESUME', 'yes').lower() in ('1', 'yes', 'true')
+log_file = os.environ.get('IPMPV_LOG_FILE')
+log_max_bytes = int(os.environ.get('IPMPV_LOG_MAX_BYTES', str(5 * 1024 * 1024)))
+log_backups = int(os.environ.get('IPMPV_LOG_BACKUPS', '3'))
+mpv_log_levels = os.environ.get('IPMPV_MPV_LOG', '')
+control_socket = os.environ.get('IPMPV_CONTROL_SOCKET', os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'ipmpv.sock'))
+control_udp = os.environ.get('IPMPV_CONTROL_UDP')
+fleet_role = os.environ.get('IPMPV_FLEET_ROLE', '').lower()
+fleet_origin = os.environ.get('IPMPV_FLEET_ORIGIN')
+fleet_interval = float(os.environ.get('IPMPV_FLEET_INTERVAL', '300'))
+fleet_refresh = float(os.environ.get('IPMPV_FLEET_REFRESH', '3600'))
+fleet_cache_dir = os.environ.get('IPMPV_FLEET_CACHE', os.path.join(os.path.dirname(__file__), '.fleet-cache'))
+timeshift_enabled = os.environ.get('IPMPV_TIMESHIFT', '').lower() in ('1', 'yes', 'true')
+timeshift_dir = os.environ.get('IPMPV_TIMESHIFT_DIR', os.path.join(os.path.dirname(__file__), '.timeshift'))
+timeshift_max_mb = int(os.environ.get('IPMPV_TIMESHIFT_MB', '1024'))
+timeshift_max_secs = float(os.environ.get('IPMPV_TIMESHIFT_SECS', '3600'))
+recordings_dir = os.environ.get('IPMPV_RECORDINGS_DIR')
+record_max_concurrent = int(os.environ.get('IPMPV_RECORD_MAX', '2'))
+record_bandwidth_mbps = float(os.environ.get('IPMPV_RECORD_BANDWIDTH', '0'))
+record_io_mbps = float(os.environ.get('IPMPV_RECORD_IO', '0'))
+record_segment_secs = float(os.environ.get('IPMPV_RECORD_SEGMENT', '600'))
+http_port = int(os.environ.get('IPMPV_PORT', '5000'))
+diagnostics_enabled = os.environ.get('IPMPV_DIAGNOSTICS', '').lower() in ('1', 'yes', 'true')
 
 def setup_environment():
     """Set up environment variables."""
@@ -23,82 +69,28 @@ def is_valid_url(url):
     """Check if a URL is valid."""
     return re.match(r"^(https?|rtmp|rtmps|udp|tcp):\/\/[\w\-]+(\.[\w\-]+)*(:\d+)?([\/?].*)?$", url) is not None
 
-def get_current_resolution():
-    """Get the current display resolution."""
-    try:
-        if is_wayland:
-            wlr_randr_env = os.environ.copy()
-            output = subprocess.check_output(["wlr-randr"], universal_newlines=True, env=wlr_randr_env)
-            if "Composite-1" in output.split("\n")[0]:
-                for line in output.split("\n"):
-                    if "720x480" in line and "current" in line:
-                        return "480i"
-                    elif "720x240" in line and "current" in line:
-                        return "240p"
-                    elif "720x576" in line and "current" in line:
-                        return "576i"
-                    elif "720x288" in line and "current" in line:
-                        return "288p"
-        else:
-            xrandr_env = os.environ.copy()
-            output = subprocess.check_output(["xrandr"], universal_newlines=True, env=xrandr_env)
-            for line in output.split("\n"):
-                if "Composite-1" in line:
-                    if "720x480" in line:
-                        return "480i"
-                    elif "720x240" in line:
-                        return "240p"
-                    elif "720x576" in line:
-                        return "576i"
-                    elif "720x288" in line:
-                        return "288p"
-    except subprocess.CalledProcessError:
-        if is_wayland:
-            print("Error: Cannot get display resolution. Is this a wl-roots compatible compositor?")
-        else:
-            print("Error: Cannot get display resolution. Is an X session running?")
-    except FileNotFoundError:
-        if is_wayland:
-            print("Error: Could not find wlr-randr, resolution will be unknown")
-        else:
-            print("Error: Could not find xrandr, resolution will be unknown")
-    return "UNK"
-
-def change_resolution(current_resolution):
-    """Change the display resolution."""
-    new_res = ""
-    if is_wayland:
-        if current_resolution == "480i":
-            new_res = "720x240"
-        elif current_resolution == "240p":
-            new_res = "720x480"
-        elif current_resolution == "576i":
-            new_res = "720x288"
-        elif current_resolution == "288p":
-            new_res = "720x576"
-    else:
-        if current_resolution == "480i":
-            new_res = "720x240"
-        elif current_resolution == "240p":
-            new_res = "720x480i"
-        elif current_resolution == "576i":
-            new_res = "720x288"
-        elif current_resolution == "288p":
-            new_res = "720x576i"
-
-    if new_res:
-        if is_wayland:
-            wlr_randr_env = os.environ.copy()
-            wlr_randr_env["DISPLAY"] = ":0"
-            subprocess.run(["wlr-randr", "--output", "Composite-1", "--mode", new_res], check=False, env=wlr_randr_env)
-            return get_current_resolution()
-        else:
-            xrandr_env = os.environ.copy()
-            xrandr_env["DISPLAY"] = ":0"
-            subprocess.run(["xrandr", "--output", "Composite-1", "--mode", new_res], check=False, env=xrandr_env)
-            return get_current_resolution()
+def get_process_stats():
+    """
+    Get memory and import statistics for the current process.
 
-    return current_resolution
+    Returns:
+        dict: Resident set size in KiB, number of loaded modules and whether Qt is loaded.
+    """
+    rss_kb = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    return {
+        "pid": os.getpid(),
+        "rss_kb": rss_kb,
+        "modules": len(sys.modules),
+        "qt_loaded": "PyQt5" in sys.modules
+    }
 
 def get_or_create_secret_key():
     """
@@ -144,6 +144,39 @@ class VolumeControl:
 			traceback.print_exc()
 			return self.is_muted()
 	
+	def set_volume(self, level=None, muted=None, show_osd=True):
+		"""
+		Set the volume and mute state to absolute values, with a single OSD update.
+		
+		Args:
+			level (int, optional): Volume percentage (0-100). Unchanged if None.
+			muted (bool, optional): Mute state. Unchanged if None.
+			show_osd (bool): Whether to show the volume OSD.
+			
+		Returns:
+			tuple: (volume level, mute state) after the change
+		"""
+		with self.volume_lock:
+			try:
+				if level is not None:
+					self.mixer.setvolume(max(0, min(100, int(level))))
+				if muted is not None:
+					self.mixer.setmute(1 if muted else 0)
+			except Exception as e:
+				print(f"Error setting volume: {e}")
+				traceback.print_exc()
+			volume = self.get_volume()
+			is_muted = self.is_muted()
+			
+			if show_osd and self.to_qt_queue is not None:
+				self.to_qt_queue.put({
+					'action': 'show_volume_osd',
+					'volume_level': 0 if is_muted else volume,
+					'is_muted': is_muted
+				})
+			
+			return volume, is_muted
+	
 	def _adjust_volume(self, change):
 		"""
 		Internal method to adjust volume.